@@ -0,0 +1,85 @@
+"""
+Асинхронный режим представлений для ASGI.
+
+В ASGI Django выполняет синхронные представления в одном общем потоке
+процесса. Горячие эндпоинты чтения оборачиваются в асинхронные
+представления, которые выполняют работу с ORM в ограниченном пуле
+потоков, не блокируя цикл событий и не занимая общий поток.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.decorators import classonlymethod
+
+from api import profiling
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Пул потоков для ORM создаётся лениво, уже в процессе воркера."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_VIEW_THREADS,
+                thread_name_prefix='async-views'
+            )
+    return _executor
+
+
+def _call(view, request, args, kwargs):
+    """Выполняет представление в потоке пула вместе с рендерингом."""
+    close_old_connections()
+    try:
+        with profiling.instrument():
+            response = view(request, *args, **kwargs)
+            if callable(getattr(response, 'render', None)):
+                response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def offload(view):
+    """
+    Оборачивает синхронное представление в асинхронное.
+
+    :param view: Синхронное представление
+    :returns: Корутинная функция, выполняющая view в пуле потоков
+    """
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            get_executor(),
+            functools.partial(context.run, _call, view, request, args, kwargs)
+        )
+    return async_view
+
+
+class AsyncReadMixin:
+    """
+    Миксин ViewSet, включающий асинхронный режим для части действий.
+
+    :param async_actions: Действия, маршруты которых выполняются
+    асинхронно при settings.ASYNC_VIEWS
+    """
+
+    async_actions = ()
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        """Асинхронная обёртка для маршрутов с действиями из async_actions"""
+        view = super().as_view(actions, **initkwargs)
+        if (settings.ASYNC_VIEWS and actions
+                and set(actions.values()) & set(cls.async_actions)):
+            return offload(view)
+        return view
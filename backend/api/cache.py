@@ -0,0 +1,68 @@
+"""Кэш сериализованных ответов API для анонимных пользователей."""
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+from api import metrics
+from api.pagination import PagesOrCursorPagination
+from recipes.response_cache import get_cache, get_version
+
+HITS_KEY = 'recipes:cache:hits'
+MISSES_KEY = 'recipes:cache:misses'
+
+
+def make_key(request, action, pk=None):
+    """
+    Формирует ключ кэша по действию и нормализованной строке запроса.
+
+    Параметры сортируются, пустые значения отбрасываются, а хост входит
+    в ключ, так как ссылки на изображения в ответе абсолютные. Пустой
+    cursor остаётся в ключе: он переключает пагинацию в курсорный режим.
+    """
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values
+        if value != '' or name == PagesOrCursorPagination.cursor_query_param
+    )
+    raw = '|'.join((request.get_host(), action, str(pk), urlencode(params)))
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return f'recipes:{get_version()}:{action}:{digest}'
+
+
+def load(key):
+    """Возвращает закэшированные данные и обновляет счётчики."""
+    cache = get_cache()
+    data = cache.get(key)
+    _increment(HITS_KEY if data is not None else MISSES_KEY)
+    metrics.observe_cache(data is not None)
+    return data
+
+
+def store(key, data):
+    """Сохраняет сериализованные данные ответа."""
+    get_cache().set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+
+
+def stats():
+    """Возвращает счётчики попаданий и промахов кэша."""
+    cache = get_cache()
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else 0.0,
+    }
+
+
+def _increment(key):
+    """Атомарно увеличивает счётчик в кэше."""
+    cache = get_cache()
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
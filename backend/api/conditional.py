@@ -0,0 +1,45 @@
+"""
+Условные GET-запросы.
+
+ETag и Last-Modified считаются по updated_at строк и версии словаря
+жанров до построения тела ответа, поэтому на актуальный
+If-None-Match / If-Modified-Since отвечаем 304 без сериализации.
+"""
+import hashlib
+
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """Сильный ETag из всего, от чего зависит тело ответа."""
+    raw = '|'.join(str(part) for part in parts)
+    return '"{}"'.format(hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+
+def respond(request, etag, last_modified, get_response):
+    """
+    Отвечает 304 (412 для If-Match), если версия клиента актуальна.
+
+    Иначе строит ответ через get_response. Ответ помечается
+    no-cache: клиенты и nginx хранят его, но перепроверяют
+    при каждом обращении.
+
+    :param last_modified: Время последнего изменения (timestamp)
+    :param get_response: Функция без аргументов, возвращающая ответ
+    """
+    last_modified = int(last_modified)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = get_response()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(
+            response, no_cache=True, private=request.user.is_authenticated
+        )
+        patch_vary_headers(response, ('Authorization',))
+    return response
@@ -0,0 +1,139 @@
+import base64
+import binascii
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
+from rest_framework import serializers
+
+import constants
+from api import metrics
+from recipes import images
+
+BASE64_CHUNK_SIZE = 64 * 1024
+DATA_URI_SEPARATOR = ';base64,'
+
+
+class Base64ImageField(serializers.ImageField):
+    """
+    Изображение в base64 (data URI) или файлом multipart/form-data.
+
+    Размер проверяется по длине строки до декодирования, base64
+    декодируется частями во временный файл, а формат и размер
+    в пикселях - по заголовку изображения, без декодирования пикселей.
+    """
+
+    default_error_messages = {
+        'invalid_base64': 'Изображение не является корректной '
+                          'строкой base64.',
+        'invalid_image': 'Загрузите корректное изображение.',
+        'invalid_format': 'Поддерживаются изображения {formats}.',
+        'too_large': 'Размер изображения не должен превышать '
+                     '{max_bytes} байт.',
+        'too_many_pixels': 'Изображение не должно быть больше '
+                           '{max_pixels} пикселей.',
+    }
+
+    def to_internal_value(self, data):
+        """Функция декодирования изображения."""
+        if data in ('', None):
+            return None
+        if isinstance(data, str):
+            upload = self.decode(data)
+        elif isinstance(data, UploadedFile):
+            upload = data
+        else:
+            self.fail('invalid_image')
+        if upload.size > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.fail('too_large', max_bytes=settings.IMAGE_UPLOAD_MAX_BYTES)
+        # Проверки FileField: имя и пустой файл; проверка ImageField
+        # через Django открывает изображение целиком и заменена своей.
+        upload = super(serializers.ImageField, self).to_internal_value(
+            upload
+        )
+        self.check_header(upload)
+        metrics.observe_upload(self.field_name, upload.size)
+        return upload
+
+    def decode(self, data):
+        """
+        Декодирует base64 частями во временный файл.
+
+        :param data: Строка base64, возможно с заголовком data URI
+        :returns: UploadedFile поверх безымянного временного файла
+        """
+        start = data.find(DATA_URI_SEPARATOR)
+        start = 0 if start < 0 else start + len(DATA_URI_SEPARATOR)
+        if (len(data) - start) // 4 * 3 > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.fail('too_large', max_bytes=settings.IMAGE_UPLOAD_MAX_BYTES)
+        upload = UploadedFile(
+            tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR),
+            'upload', None, 0
+        )
+        carry = ''
+        try:
+            for position in range(start, len(data), BASE64_CHUNK_SIZE):
+                chunk = carry + ''.join(
+                    data[position:position + BASE64_CHUNK_SIZE].split()
+                )
+                usable = len(chunk) - len(chunk) % 4
+                upload.write(base64.b64decode(chunk[:usable], validate=True))
+                carry = chunk[usable:]
+            if carry:
+                raise binascii.Error('Неполная группа base64')
+        except (binascii.Error, ValueError):
+            upload.close()
+            self.fail('invalid_base64')
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+    def check_header(self, upload):
+        """
+        Проверяет формат и размер изображения по заголовку.
+
+        Image.open читает только заголовок файла. Загрузке выдаётся
+        имя на основе uuid с расширением по фактическому формату.
+        """
+        try:
+            image = Image.open(upload)
+        except Image.DecompressionBombError:
+            self.fail('too_many_pixels',
+                      max_pixels=settings.IMAGE_UPLOAD_MAX_PIXELS)
+        except (OSError, SyntaxError, ValueError):
+            self.fail('invalid_image')
+        extension = constants.IMAGE_UPLOAD_FORMATS.get(image.format)
+        if extension is None:
+            self.fail('invalid_format', formats=', '.join(
+                sorted(set(constants.IMAGE_UPLOAD_FORMATS.values()))
+            ))
+        width, height = image.size
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            self.fail('too_many_pixels',
+                      max_pixels=settings.IMAGE_UPLOAD_MAX_PIXELS)
+        upload.seek(0)
+        upload.image = image
+        upload.content_type = Image.MIME.get(image.format)
+        upload.name = f'{uuid.uuid4()}.{extension}'
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    Поле со ссылками на производные изображения.
+
+    :param image_field: Имя поля модели с исходным изображением
+    """
+
+    def __init__(self, image_field, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        self.image_field = image_field
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        """Функция репрезентации."""
+        return images.variant_urls(
+            instance, self.image_field, self.context.get('request')
+        )
@@ -1,4 +1,8 @@
 from django_filters import rest_framework as filters
+
+import constants
+from recipes import relations
+from recipes import search as recipe_search
 from recipes.models import Recipe
 
 
@@ -8,23 +12,41 @@ class RecipeFilter(filters.FilterSet):
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         """Meta класс описания объекта"""
 
         model = Recipe
-        fields = ['author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['author', 'is_favorited', 'is_in_shopping_cart', 'search']
+
+    def _filter_related(self, queryset, kind, lookup, value):
+        """
+        Оставляет альбомы из связей пользователя.
+
+        Идентификаторы берутся из кэша связей; слишком длинный список
+        заменяется соединением с таблицей связей.
+        """
+        user = self.request.user
+        if not (user.is_authenticated and value):
+            return queryset
+        ids = getattr(relations.for_request(self.request), kind)
+        if len(ids) > constants.RELATIONS_FILTER_MAX_IDS:
+            return queryset.filter(**{lookup: user})
+        return queryset.filter(pk__in=list(ids))
 
     def filter_is_favorited(self, queryset, name, value):
         """Функция для фильтрации избранных рецептов."""
-        user = self.request.user
-        if user.is_authenticated and value:
-            return queryset.filter(favorites__user=user)
-        return queryset
+        return self._filter_related(
+            queryset, relations.FAVORITES, 'favorites__user', value
+        )
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         """Функция для фильтрации корзин покупок."""
-        user = self.request.user
-        if user.is_authenticated and value:
-            return queryset.filter(shoppingcarts__user=user)
-        return queryset
+        return self._filter_related(
+            queryset, relations.CART, 'shoppingcarts__user', value
+        )
+
+    def filter_search(self, queryset, name, value):
+        """Функция для полнотекстового поиска по альбомам."""
+        return recipe_search.search(queryset, value)
@@ -0,0 +1,195 @@
+"""
+Метрики Prometheus.
+
+Метрики пишутся в память процесса, а при заданной переменной
+окружения PROMETHEUS_MULTIPROC_DIR - в файлы этой директории, общие
+для всех воркеров gunicorn. Значения всех процессов отдаёт мастер
+gunicorn на отдельном порту METRICS_PORT (см. gunicorn.conf.py),
+а эндпоинт /metrics - только адресам из METRICS_ALLOWED_IPS
+и сотрудникам.
+"""
+import asyncio
+import ipaddress
+import os
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.deprecation import MiddlewareMixin
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+from api import profiling
+
+UNMATCHED = 'unmatched'
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+UPLOAD_BUCKETS = tuple(
+    kib * 1024 for kib in (16, 64, 256, 512, 1024, 2048, 5120, 10240, 20480)
+)
+
+REQUESTS = Counter(
+    'api_requests_total', 'Количество запросов',
+    ['view', 'method', 'status']
+)
+LATENCY = Histogram(
+    'api_request_duration_seconds', 'Время обработки запроса',
+    ['view', 'method']
+)
+IN_PROGRESS = Gauge(
+    'api_requests_in_progress', 'Запросы в обработке',
+    multiprocess_mode='livesum'
+)
+DB_QUERIES = Histogram(
+    'api_request_db_queries', 'Количество SQL-запросов на запрос',
+    ['view'], buckets=QUERY_BUCKETS
+)
+DB_DURATION = Histogram(
+    'api_request_db_duration_seconds', 'Время SQL-запросов на запрос',
+    ['view']
+)
+RESPONSE_CACHE = Counter(
+    'api_response_cache_total', 'Обращения к кэшу ответов', ['result']
+)
+IMAGE_UPLOAD = Histogram(
+    'api_image_upload_bytes', 'Размер загруженных изображений',
+    ['field'], buckets=UPLOAD_BUCKETS
+)
+WORKERS = Gauge(
+    'gunicorn_workers', 'Живые воркеры gunicorn',
+    multiprocess_mode='livesum'
+)
+WORKER_CAPACITY = Gauge(
+    'gunicorn_worker_capacity',
+    'Запросы, которые воркеры могут обрабатывать одновременно',
+    multiprocess_mode='livesum'
+)
+
+
+def view_label(view_func):
+    """
+    Имя представления для меток.
+
+    Для ViewSet это Класс.действие, например RecipeViewSet.list.
+    """
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    return cls.__name__
+
+
+def request_label(request):
+    """
+    Метка представления, обработавшего запрос.
+
+    Берётся из resolver_match после ответа: process_view в асинхронном
+    режиме выполнялся бы через общий поток sync_to_async.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED
+    label = view_label(match.func)
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        action = actions.get(request.method.lower())
+        label = f'{label}.{action}' if action else label
+    return label
+
+
+def observe_upload(field, size):
+    """Учитывает размер загруженного изображения."""
+    IMAGE_UPLOAD.labels(field).observe(size)
+
+
+def observe_cache(hit):
+    """Учитывает попадание или промах кэша ответов."""
+    RESPONSE_CACHE.labels('hit' if hit else 'miss').inc()
+
+
+def worker_started(capacity):
+    """Регистрирует воркер gunicorn, вызывается из его хука."""
+    WORKERS.set(1)
+    WORKER_CAPACITY.set(capacity)
+
+
+def registry():
+    """Реестр со значениями всех процессов или текущего процесса."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    collected = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collected)
+    return collected
+
+
+def is_allowed(request):
+    """Проверяет, что адрес клиента входит в METRICS_ALLOWED_IPS."""
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in settings.METRICS_ALLOWED_IPS
+    )
+
+
+def metrics_view(request):
+    """Отдаёт метрики в текстовом формате Prometheus."""
+    if not (is_allowed(request) or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        generate_latest(registry()), content_type=CONTENT_TYPE_LATEST
+    )
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Middleware, считающий запросы, задержки и SQL-запросы.
+
+    Работает в синхронном и асинхронном режиме, поэтому под ASGI
+    запросы не проходят через единственный поток sync_to_async.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        profiling.watch_connections()
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        IN_PROGRESS.inc()
+        try:
+            with profiling.activate() as profile:
+                response = self.get_response(request)
+        finally:
+            IN_PROGRESS.dec()
+        return self.observe(request, response, profile, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        IN_PROGRESS.inc()
+        try:
+            with profiling.activate() as profile:
+                response = await self.get_response(request)
+        finally:
+            IN_PROGRESS.dec()
+        return self.observe(request, response, profile, started)
+
+    @staticmethod
+    def observe(request, response, profile, started):
+        """Записывает метрики завершённого запроса."""
+        view = request_label(request)
+        if view == view_label(metrics_view):
+            return response
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        LATENCY.labels(view, request.method).observe(
+            time.perf_counter() - started
+        )
+        DB_QUERIES.labels(view).observe(profile.query_count)
+        DB_DURATION.labels(view).observe(profile.db_time)
+        return response
@@ -1,4 +1,10 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 import constants
 
 
@@ -9,3 +15,116 @@ class PagesPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = constants.PAGE_SIZE
     max_page_size = constants.MAX_PAGE_SIZE
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Курсорная пагинация по паре (created_at, id).
+
+    Не выполняет COUNT и не использует OFFSET по всей таблице,
+    поэтому время ответа не зависит от глубины прокрутки.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = constants.PAGE_SIZE
+    max_page_size = constants.MAX_PAGE_SIZE
+    ordering = ('-created_at', '-id')
+
+
+class PagesOrCursorPagination(PagesPagination):
+    """
+    Постраничная пагинация с опциональным курсорным режимом.
+
+    Курсорный режим включается параметром ?cursor= (пустое значение
+    запрашивает первую страницу), порядок задаётся атрибутом
+    cursor_ordering представления. Параметры из cursor_conflicts
+    представления задают свой порядок (например, ранг поиска),
+    поэтому вместе с cursor они отклоняются.
+    """
+
+    cursor_query_param = KeysetPagination.cursor_query_param
+    cursor_conflict_message = 'Параметр {} нельзя использовать вместе с {}.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Выбор режима пагинации по параметрам запроса"""
+        self.keyset = None
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        for param in getattr(view, 'cursor_conflicts', ()):
+            if request.query_params.get(param):
+                raise ValidationError({
+                    self.cursor_query_param: [
+                        self.cursor_conflict_message.format(
+                            self.cursor_query_param, param
+                        )
+                    ]
+                })
+        self.keyset = KeysetPagination()
+        self.keyset.ordering = getattr(
+            view, 'cursor_ordering', KeysetPagination.ordering
+        )
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        """Ответ в формате выбранного режима пагинации"""
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FeedPagination(KeysetPagination):
+    """
+    Курсорная пагинация ленты подписок.
+
+    Курсор кодирует позицию последнего альбома страницы
+    (created_at в микросекундах, id), поэтому следующая страница
+    начинается сразу после него. Пагинация только вперёд.
+    """
+
+    def paginate_feed(self, fetch, request):
+        """
+        Идентификаторы альбомов текущей страницы.
+
+        :param fetch: Функция fetch(before, limit), возвращающая позиции
+            ленты старше before
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        limit = self.get_page_size(request)
+        positions = fetch(self.decode_position(request), limit + 1)
+        self.next_position = positions[limit - 1] if (
+            len(positions) > limit
+        ) else None
+        return [pk for timestamp, pk in positions[:limit]]
+
+    def decode_position(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            timestamp, pk = b64decode(
+                encoded.encode('ascii'), altchars=b'-_'
+            ).decode('ascii').split('.')
+            return int(timestamp), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_position(self, position):
+        raw = '{}.{}'.format(*position).encode('ascii')
+        return b64encode(raw, altchars=b'-_').decode('ascii')
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param,
+            self.encode_position(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        ]))
@@ -0,0 +1,258 @@
+"""
+Профилирование запросов.
+
+ProfilingMiddleware включается настройкой PROFILING_ENABLED и для
+каждого запроса считает общее время, время и количество SQL-запросов,
+повторяющиеся запросы (признак N+1) и время сериализации. Результат
+отдаётся заголовком Server-Timing и строкой лога в формате JSON.
+Часть запросов (PROFILING_SAMPLE_RATE) выполняется под cProfile,
+статистика медленных из них сохраняется в PROFILING_DIR.
+
+SQL-запросы учитывает постоянная обёртка каждого соединения: она берёт
+профиль из contextvars, поэтому запросы учитываются в любом потоке,
+куда передан контекст запроса (пул AsyncReadMixin, sync_to_async).
+Middleware работают и в WSGI, и в ASGI без перехода в один поток.
+"""
+import asyncio
+import contextvars
+import cProfile
+import json
+import logging
+import pstats
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+DUPLICATES_IN_LOG = 5
+
+_profile = contextvars.ContextVar('request_profile', default=None)
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_placeholders = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+
+
+def fingerprint(sql):
+    """Текст запроса без литералов и с одним элементом в списках IN."""
+    return _placeholders.sub('(%s)', _literals.sub('%s', sql))
+
+
+class RequestProfile:
+    """Измерения одного запроса."""
+
+    def __init__(self, sampled=False):
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = Counter()
+        self.serializers = defaultdict(float)
+        self.sampled = sampled
+        self.profilers = []
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicates(self):
+        fingerprints = Counter()
+        for sql, count in self.queries.items():
+            fingerprints[fingerprint(sql)] += count
+        return [(sql, count) for sql, count in fingerprints.most_common()
+                if count > 1]
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper, учитывающий время и текст запроса."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries[sql] += 1
+
+
+def _record(execute, sql, params, many, context):
+    """execute_wrapper соединения: учитывает запрос в профиле контекста."""
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def _watch(sender=None, connection=None, **kwargs):
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+def watch_connections():
+    """Подключает учёт запросов к текущим и будущим соединениям."""
+    connection_created.connect(_watch, dispatch_uid='api.profiling')
+    for connection in connections.all():
+        _watch(connection=connection)
+
+
+@contextmanager
+def instrument():
+    """
+    Включает cProfile текущего потока для выборочного профиля.
+
+    cProfile работает в пределах потока, поэтому представления,
+    вынесенные в пул потоков, вызывают instrument повторно.
+    Без активного выборочного профиля ничего не делает.
+    """
+    profile = _profile.get()
+    if profile is None or not profile.sampled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profile.profilers.append(profiler)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+
+@contextmanager
+def activate(sampled=False):
+    """
+    Профиль текущего запроса, создаётся при первом вызове.
+
+    Профилирование и метрики используют один профиль, чтобы каждый
+    SQL-запрос учитывался один раз.
+    """
+    profile = _profile.get()
+    if profile is not None:
+        yield profile
+        return
+    profile = RequestProfile(sampled)
+    token = _profile.set(profile)
+    try:
+        with instrument():
+            yield profile
+    finally:
+        _profile.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Учитывает время блока как время сериализации name."""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.serializers[name] += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """Учитывает время получения data сериализатора верхнего уровня."""
+
+    @property
+    def data(self):
+        with timed(type(self).__name__):
+            return super().data
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    """ListSerializer, учитывающий время под именем дочернего класса."""
+
+    @property
+    def data(self):
+        with timed(type(self.child).__name__):
+            return super().data
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """Middleware, измеряющий время и SQL-запросы каждого запроса."""
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        watch_connections()
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with activate(self.sample()) as profile:
+            response = self.get_response(request)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        with activate(self.sample()) as profile:
+            response = await self.get_response(request)
+        return self.finish(request, response, profile)
+
+    @staticmethod
+    def sample():
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def finish(self, request, response, profile):
+        """Заголовок Server-Timing, строка лога и дамп cProfile."""
+        total = time.perf_counter() - profile.started
+        response['Server-Timing'] = self.server_timing(profile, total)
+        self.log(request, response, profile, total)
+        if profile.sampled and total * 1000 >= settings.PROFILING_SLOW_MS:
+            self.dump(request, profile, total)
+        return response
+
+    @staticmethod
+    def server_timing(profile, total):
+        """Значение заголовка Server-Timing."""
+        metrics = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={profile.db_time * 1000:.1f};'
+            f'desc="{profile.query_count} queries, '
+            f'{len(profile.duplicates)} duplicated"',
+        ]
+        if profile.serializers:
+            serialization = sum(profile.serializers.values())
+            metrics.append(f'serializer;dur={serialization * 1000:.1f}')
+        return ', '.join(metrics)
+
+    @staticmethod
+    def log(request, response, profile, total):
+        """Структурированная строка лога с измерениями запроса."""
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(profile.db_time * 1000, 2),
+            'queries': profile.query_count,
+            'duplicates': [
+                {'sql': sql, 'count': count}
+                for sql, count in profile.duplicates[:DUPLICATES_IN_LOG]
+            ],
+            'serializers_ms': {
+                name: round(duration * 1000, 2)
+                for name, duration in profile.serializers.items()
+            },
+        }, ensure_ascii=False))
+
+    @staticmethod
+    def dump(request, profile, total):
+        """Сохраняет статистику cProfile медленного запроса."""
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^\w]+', '_', request.path).strip('_') or 'root'
+        path = directory / (
+            f'{time.strftime("%Y%m%d-%H%M%S")}-{request.method}-{slug}-'
+            f'{total * 1000:.0f}ms.prof'
+        )
+        pstats.Stats(*profile.profilers).dump_stats(path)
+        logger.info('cProfile статистика сохранена в %s', path)
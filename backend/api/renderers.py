@@ -0,0 +1,88 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from recipes.shopping_list import MEDIA_TYPES
+
+
+class RawJSON(str):
+    """Готовый JSON-текст, который вставляется в ответ без разбора."""
+
+
+class SnapshotJSONRenderer(JSONRenderer):
+    """
+    JSON-рендерер, склеивающий готовые фрагменты RawJSON.
+
+    Фрагменты могут быть самим ответом, списком или полем results
+    ответа пагинации; остальные данные рендерятся как обычно.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, RawJSON):
+            return data.encode('utf-8')
+        if self._is_fragments(data):
+            return self._join(data)
+        if isinstance(data, dict) and self._is_fragments(data.get('results')):
+            envelope = super().render(
+                {key: value for key, value in data.items()
+                 if key != 'results'},
+                accepted_media_type, renderer_context
+            )
+            separator = b',' if envelope != b'{}' else b''
+            return b''.join((
+                envelope[:-1], separator, b'"results":',
+                self._join(data['results']), b'}'
+            ))
+        return super().render(data, accepted_media_type, renderer_context)
+
+    @staticmethod
+    def _is_fragments(data):
+        return (
+            isinstance(data, list) and bool(data)
+            and isinstance(data[0], RawJSON)
+        )
+
+    @staticmethod
+    def _join(fragments):
+        return ('[' + ','.join(fragments) + ']').encode('utf-8')
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок.
+
+    Сам файл формирует представление, рендерер нужен для согласования
+    формата (?format=) и вывода ошибок.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Функция вывода ошибок в выбранном формате."""
+        if data is None:
+            return b''
+        if isinstance(data, bytes):
+            return data
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class PlainTextRenderer(ShoppingListRenderer):
+    """Рендерер списка покупок в формате txt."""
+
+    format = 'txt'
+    media_type = MEDIA_TYPES[format]
+
+
+class CSVRenderer(ShoppingListRenderer):
+    """Рендерер списка покупок в формате csv."""
+
+    format = 'csv'
+    media_type = MEDIA_TYPES[format]
+
+
+class PDFRenderer(ShoppingListRenderer):
+    """Рендерер списка покупок в формате pdf."""
+
+    format = 'pdf'
+    media_type = MEDIA_TYPES[format]
+    charset = None
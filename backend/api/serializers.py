@@ -1,32 +1,39 @@
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.urls import reverse
 from djoser.serializers import UserSerializer as DjoserUserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField, ReadOnlyField
 
+import constants
+
+from .fields import Base64ImageField, ImageVariantsField
+from .profiling import TimedListSerializer, TimedSerializerMixin
+
+from recipes import cart_totals, relations, response_cache, search
 from recipes.models import (
-    Favorite, Recipe, ShoppingCart,
+    Favorite, Job, Recipe, ShoppingCart, ShoppingCartTotal,
     IngredientInRecipe, Ingredient,
     Subscription, User
 )
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Сериализатор для модели Ingredient."""
 
     class Meta:
         """Meta класс описания объекта"""
 
         model = Ingredient
+        list_serializer_class = TimedListSerializer
         fields = ('id', 'name', 'measurement_unit')
 
 
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для связи ингредиентов с рецептом."""
 
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient.id'
-    )
+    id = serializers.IntegerField(source='ingredient.id')
     name = ReadOnlyField(source='ingredient.name')
     measurement_unit = ReadOnlyField(source='ingredient.measurement_unit')
     amount = serializers.IntegerField(min_value=1)
@@ -38,33 +45,36 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class UserSerializer(DjoserUserSerializer):
+class UserSerializer(TimedSerializerMixin, DjoserUserSerializer):
     """Сериализатор пользователя с доп. полями is_subscribed и avatar."""
 
     is_subscribed = SerializerMethodField()
     avatar = Base64ImageField(required=False)
+    avatar_variants = ImageVariantsField('avatar')
 
     class Meta(DjoserUserSerializer.Meta):
         """Meta класс описания объекта"""
 
         model = User
+        list_serializer_class = TimedListSerializer
         fields = (
             'id', 'username', 'email', 'first_name',
-            'last_name', 'is_subscribed', 'avatar',
+            'last_name', 'is_subscribed', 'avatar', 'avatar_variants',
         )
         read_only_fields = ('id', 'username', 'email', 'first_name',
                             'last_name')
 
     def get_is_subscribed(self, user):
         """Функция для получения информации о подписках пользователя."""
-        request = self.context.get('request')
-        return (
-            request and request.user.is_authenticated
-            and user.authors.filter(user=request.user).exists()
-        )
+        if hasattr(user, 'is_subscribed'):
+            return user.is_subscribed
+        return relations.for_request(
+            self.context.get('request')
+        ).is_following(user.pk)
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Сериализатор для чтения рецепта."""
 
     author = UserSerializer(read_only=True)
@@ -74,32 +84,45 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
     image = serializers.ImageField(read_only=True)
+    image_variants = ImageVariantsField('image')
 
     class Meta:
         """Meta класс описания объекта"""
 
         model = Recipe
+        list_serializer_class = TimedListSerializer
         fields = (
-            'id', 'name', 'text', 'image', 'author',
+            'id', 'name', 'text', 'image', 'image_variants', 'author',
             'cooking_time', 'ingredients', 'is_favorited',
             'is_in_shopping_cart',
         )
 
-    def _check_existence(self, manager):
-        """Функция для проверки существования рецепта для
-         авторизированного пользователя."""
-        request = self.context.get('request')
-        return (request
-                and request.user.is_authenticated
-                and manager.filter(user=request.user).exists())
+    def to_representation(self, recipe):
+        """Передаёт автору заданный флаг подписки, если он есть."""
+        if hasattr(recipe, 'is_author_subscribed'):
+            recipe.author.is_subscribed = recipe.is_author_subscribed
+        return super().to_representation(recipe)
+
+    def _check_existence(self, recipe, attribute, check):
+        """Функция для проверки связи рецепта с пользователем.
+
+        Заданный на объекте флаг имеет приоритет, иначе ответ берётся
+        из связей пользователя без запросов к базе.
+        """
+        if hasattr(recipe, attribute):
+            return getattr(recipe, attribute)
+        return check(relations.for_request(self.context.get('request')),
+                     recipe.pk)
 
     def get_is_favorited(self, recipe):
         """Функция для получения информации, если рецепт избранный."""
-        return self._check_existence(recipe.favorites)
+        return self._check_existence(recipe, 'is_favorited',
+                                     relations.Relations.is_favorited)
 
     def get_is_in_shopping_cart(self, recipe):
         """Функция для получения информации, если рецепт в корзине."""
-        return self._check_existence(recipe.shoppingcarts)
+        return self._check_existence(recipe, 'is_in_shopping_cart',
+                                     relations.Relations.is_in_shopping_cart)
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
@@ -130,28 +153,44 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 'ingredients': 'Список ингредиентов не может быть пустым'
             })
 
-        ingredient_ids = ([item['ingredient']['id'].id
+        ingredient_ids = ([item['ingredient']['id']
                            for item in ingredients_data])
         if len(ingredient_ids) != len(set(ingredient_ids)):
             raise serializers.ValidationError({
                 'ingredients': 'Ингредиенты в рецепте не должны повторяться'
             })
 
+        ingredients = Ingredient.objects.in_bulk(ingredient_ids)
+        if len(ingredients) != len(ingredient_ids):
+            message = (serializers.PrimaryKeyRelatedField
+                       .default_error_messages['does_not_exist'])
+            raise serializers.ValidationError({'ingredients': [
+                {} if pk in ingredients
+                else {'id': [message.format(pk_value=pk)]}
+                for pk in ingredient_ids
+            ]})
+        for item in ingredients_data:
+            item['ingredient'] = ingredients[item['ingredient']['id']]
+
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         """Функция для создания рецепта."""
         ingredients_data = validated_data.pop('recipe_ingredients')
         recipe = Recipe.objects.create(**validated_data)
         self._save_ingredients(recipe, ingredients_data)
+        search.update_index((recipe.pk,))
+        transaction.on_commit(response_cache.bump_version)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Функция для обновления рецепта."""
         ingredients_data = validated_data.pop('recipe_ingredients')
-        instance.ingredients.clear()
-        self._save_ingredients(instance, ingredients_data)
+        self._update_ingredients(instance, ingredients_data)
         instance = super().update(instance, validated_data)
+        transaction.on_commit(response_cache.bump_version)
         return instance
 
     def _save_ingredients(self, recipe, ingredients_data):
@@ -159,51 +198,101 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         IngredientInRecipe.objects.bulk_create([
             IngredientInRecipe(
                 recipe=recipe,
-                ingredient=ingredient['ingredient']['id'],
+                ingredient=ingredient['ingredient'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients_data
         ])
 
+    def _update_ingredients(self, recipe, ingredients_data):
+        """
+        Функция для обновления ингредиентов по разнице.
+
+        Удаляются только убранные ингредиенты, меняются только
+        изменённые количества и создаются только новые строки.
+        """
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientInRecipe.objects.filter(recipe=recipe)
+        }
+        old_amounts = {pk: row.amount for pk, row in existing.items()}
+        new_amounts = {
+            item['ingredient'].pk: item['amount'] for item in ingredients_data
+        }
+
+        removed = [row.pk for pk, row in existing.items()
+                   if pk not in new_amounts]
+        changed = []
+        for pk, amount in new_amounts.items():
+            row = existing.get(pk)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        added = [item for item in ingredients_data
+                 if item['ingredient'].pk not in existing]
+
+        if removed:
+            IngredientInRecipe.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            self._save_ingredients(recipe, added)
+        cart_totals.recipe_changed(recipe.pk, old_amounts, new_amounts)
+
     def to_representation(self, instance):
         """Представление после создания/обновления рецепта."""
-
+        prefetch_related_objects([instance], Prefetch(
+            'recipe_ingredients',
+            IngredientInRecipe.objects.select_related('ingredient')
+        ))
         return RecipeReadSerializer(instance, context=self.context).data
 
 
 class RecipeShortLinkSerializer(serializers.ModelSerializer):
     """Краткий сериализатор рецепта."""
 
+    image_variants = ImageVariantsField('image')
+
     class Meta:
         """Meta класс описания объекта"""
 
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class SubscribedUserSerializer(UserSerializer):
     """Сериализатор для отображения информации о подписанном пользователе."""
 
     recipes = SerializerMethodField()
-    recipes_count = ReadOnlyField(source='recipes.count')
+    recipes_count = ReadOnlyField()
 
     class Meta(UserSerializer.Meta):
         """Meta класс описания объекта"""
         fields = (
             'id', 'username', 'email', 'first_name',
             'last_name', 'is_subscribed', 'recipes',
-            'recipes_count', 'avatar'
+            'recipes_count', 'avatar', 'avatar_variants'
         )
 
+    @staticmethod
+    def get_recipes_limit(request):
+        """Функция для получения параметра recipes_limit."""
+        try:
+            limit = int(request.GET['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit >= 0 else None
+
     def get_recipes(self, author):
-        """Функция для получения рецептов автора."""
-        request = self.context.get('request')
-        recipes_limit = request.GET.get('recipes_limit')
-        recipes = author.recipes.all()
-        if recipes_limit:
-            try:
-                recipes = recipes[:int(recipes_limit)]
-            except ValueError:
-                pass
+        """
+        Функция для получения рецептов автора.
+
+        Использует альбомы, заранее загруженные представлением
+        в recent_recipes, если они есть.
+        """
+        recipes = getattr(author, 'recent_recipes', None)
+        if recipes is None:
+            limit = self.get_recipes_limit(self.context.get('request'))
+            recipes = author.recipes.all()[:limit]
         return RecipeShortLinkSerializer(recipes, many=True,
                                          context=self.context).data
 
@@ -258,6 +347,93 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
                                          context=self.context).data
 
 
+class ShoppingCartTotalSerializer(serializers.ModelSerializer):
+    """Сериализатор итогов корзины покупок по жанрам."""
+
+    id = ReadOnlyField(source='ingredient.id')
+    name = ReadOnlyField(source='ingredient.name')
+    measurement_unit = ReadOnlyField(source='ingredient.measurement_unit')
+
+    class Meta:
+        """Meta класс описания объекта"""
+
+        model = ShoppingCartTotal
+        fields = ('id', 'name', 'measurement_unit', 'total_amount')
+
+
+class BatchSerializer(serializers.Serializer):
+    """Сериализатор пакета идентификаторов для добавления и удаления."""
+
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=constants.BATCH_MAX_SIZE,
+        required=False,
+        default=list
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=constants.BATCH_MAX_SIZE,
+        required=False,
+        default=list
+    )
+
+    def validate(self, data):
+        """Функция валидации пакета."""
+        if not data['add'] and not data['remove']:
+            raise serializers.ValidationError(
+                'Укажите идентификаторы в add или remove'
+            )
+        if set(data['add']) & set(data['remove']):
+            raise serializers.ValidationError(
+                'Один идентификатор не может быть в add и remove'
+            )
+        return data
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Сериализатор состояния фоновой задачи."""
+
+    url = SerializerMethodField()
+    result_url = SerializerMethodField()
+
+    class Meta:
+        """Meta класс описания объекта"""
+        model = Job
+        fields = ('id', 'name', 'status', 'attempts', 'created_at',
+                  'started_at', 'finished_at', 'result', 'error', 'url',
+                  'result_url')
+        read_only_fields = fields
+
+    def _absolute(self, name, obj):
+        return self.context['request'].build_absolute_uri(
+            reverse(name, args=(obj.pk,))
+        )
+
+    def get_url(self, obj):
+        """Ссылка для опроса состояния задачи."""
+        return self._absolute('recipes:jobs-detail', obj)
+
+    def get_result_url(self, obj):
+        """Ссылка на результат выполненной задачи."""
+        if obj.status != Job.DONE:
+            return None
+        return self._absolute('recipes:jobs-result', obj)
+
+
+class GenreImportSerializer(serializers.Serializer):
+    """Сериализатор файла для фонового импорта жанров."""
+
+    file = serializers.FileField()
+
+    def validate_file(self, value):
+        """Функция валидации формата файла."""
+        if not value.name.lower().endswith(constants.GENRE_IMPORT_FORMATS):
+            raise serializers.ValidationError(
+                'Поддерживаются только CSV и JSON файлы'
+            )
+        return value
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     """Сериализатор для подписки пользователя на автора."""
 
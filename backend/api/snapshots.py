@@ -0,0 +1,115 @@
+"""
+Готовые JSON-представления альбомов.
+
+Общая для всех пользователей часть ответа RecipeReadSerializer
+хранится в RecipeSnapshot. Вместо адреса сервера и персональных флагов
+в тексте стоят управляющие символы: JSON-кодировщик всегда экранирует
+их в данных, поэтому неоднозначности нет. При отдаче маркеры
+заменяются одним вызовом str.translate, а ответ собирается склейкой
+строк без обхода полей сериализатора. Представления, которых нет
+или которые построены для другой VERSION, строятся при чтении.
+"""
+import uuid
+from urllib.parse import urlsplit
+
+from django.db.models import Prefetch, prefetch_related_objects
+from rest_framework.renderers import JSONRenderer
+
+from recipes import relations
+from recipes.models import IngredientInRecipe, RecipeSnapshot
+
+from .renderers import RawJSON
+from .serializers import RecipeReadSerializer
+
+VERSION = 1
+ORIGIN = '\x1e'
+FLAGS = {
+    'is_favorited': '\x1c',
+    'is_in_shopping_cart': '\x1d',
+    'is_author_subscribed': '\x1f',
+}
+
+
+def flags(recipe, user_relations):
+    """Персональные флаги альбома по связям пользователя."""
+    return {
+        'is_favorited': user_relations.is_favorited(recipe.pk),
+        'is_in_shopping_cart': user_relations.is_in_shopping_cart(recipe.pk),
+        'is_author_subscribed': user_relations.is_following(
+            recipe.author_id
+        ),
+    }
+
+
+class _MarkerRequest:
+    """Подменяет запрос при построении: ссылки строятся от маркера."""
+
+    def __init__(self, marker):
+        self.marker = marker
+
+    def build_absolute_uri(self, location):
+        if urlsplit(location).scheme:
+            return location
+        return self.marker + location
+
+
+def build(recipes):
+    """
+    Строит и сохраняет представления альбомов.
+
+    Персональные флаги альбомов при этом заменяются маркерами.
+
+    :returns: Словарь {recipe_id: текст представления}
+    """
+    prefetch_related_objects(recipes, Prefetch(
+        'recipe_ingredients',
+        IngredientInRecipe.objects.select_related('ingredient')
+    ))
+    token = uuid.uuid4().hex
+    for recipe in recipes:
+        for name in FLAGS:
+            setattr(recipe, name, token + name)
+    data = RecipeReadSerializer(
+        recipes, many=True, context={'request': _MarkerRequest(token)}
+    ).data
+    bodies = {}
+    for recipe, item in zip(recipes, data):
+        body = JSONRenderer().render(item).decode('utf-8')
+        for name, marker in FLAGS.items():
+            body = body.replace(f'"{token}{name}"', marker)
+        bodies[recipe.pk] = body.replace(token, ORIGIN)
+    RecipeSnapshot.objects.filter(pk__in=bodies).delete()
+    RecipeSnapshot.objects.bulk_create([
+        RecipeSnapshot(recipe_id=pk, version=VERSION, body=body)
+        for pk, body in bodies.items()
+    ], ignore_conflicts=True)
+    return bodies
+
+
+def render(recipes, request):
+    """
+    Представления альбомов для текущего пользователя.
+
+    Флаги берутся из связей пользователя (recipes.relations).
+
+    :returns: Список RawJSON в порядке recipes
+    """
+    recipes = list(recipes)
+    tables = {}
+    origin = request.build_absolute_uri('/')[:-1]
+    user_relations = relations.for_request(request)
+    for recipe in recipes:
+        table = {ord(ORIGIN): origin}
+        for name, value in flags(recipe, user_relations).items():
+            table[ord(FLAGS[name])] = 'true' if value else 'false'
+        tables[recipe.pk] = table
+    bodies = dict(RecipeSnapshot.objects.filter(
+        recipe_id__in=tables, version=VERSION
+    ).values_list('recipe_id', 'body'))
+    missing = [recipe for recipe in recipes if recipe.pk not in bodies]
+    if missing:
+        bodies.update(build(missing))
+    return [
+        RawJSON(bodies[recipe.pk].translate(tables[recipe.pk]))
+        for recipe in recipes
+    ]
@@ -0,0 +1,1132 @@
+import base64
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from contextlib import contextmanager
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from api import cache, fields
+from foodgram.caches import require_shared
+from foodgram.db import pool
+from foodgram.db.sqlite3.base import DatabaseWrapper as PooledSQLiteWrapper
+from recipes import batch, cart_totals, feed, images, jobs
+from recipes.management.commands.import_genres import (CopySource,
+                                                       JSONArrayReader)
+from recipes.management.commands.load_test_data import SYNTHETIC_EPOCH
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Job,
+                            Recipe, RecipeSnapshot, ShoppingCart,
+                            ShoppingCartTotal, Subscription, User)
+
+RECIPES_COUNT = 30
+PAGE_SIZES = (1, 5, 30)
+LIST_QUERY_BUDGET = 5
+SLOW_TASK = 'test_slow'
+FAILING_TASK = 'test_failing'
+
+
+@jobs.task(SLOW_TASK)
+def slow_task(job):
+    """Задача, которая выполняется дольше JOBS_STALE_TIMEOUT."""
+    time.sleep(job.payload['seconds'])
+    return {'requeued': jobs.requeue_stale()}
+
+
+@jobs.task(FAILING_TASK, max_attempts=1)
+def failing_task(job):
+    """Задача, которая всегда завершается ошибкой."""
+    raise RuntimeError('Ошибка задачи')
+
+
+@contextmanager
+def execute_on_commit():
+    """
+    Выполняет колбэки on_commit, поставленные внутри блока.
+
+    В отличие от captureOnCommitCallbacks выполняет и колбэки,
+    которые поставили сами колбэки (задачи при JOBS_BACKEND='sync').
+    """
+    start = len(connection.run_on_commit)
+    yield
+    while start < len(connection.run_on_commit):
+        callbacks = connection.run_on_commit[start:]
+        start = len(connection.run_on_commit)
+        for _, callback in callbacks:
+            callback()
+
+
+def png_base64(size=(1, 1)):
+    """Возвращает PNG-изображение в виде data URI."""
+    buffer = io.BytesIO()
+    Image.new('RGB', size).save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+class MediaRootMixin:
+    """Сохраняет загруженные файлы во временный каталог."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overridden = override_settings(MEDIA_ROOT=media_root)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка альбомов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author', password='x',
+            first_name='Автор', last_name='Авторов'
+        )
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader', password='x',
+            first_name='Читатель', last_name='Читателев'
+        )
+        genres = [
+            Ingredient.objects.create(name=f'Жанр {number}',
+                                      measurement_unit='трек')
+            for number in range(3)
+        ]
+        recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Альбом {number}', text='Текст',
+                cooking_time=10, image='recipes/images/cover.png'
+            )
+            for number in range(RECIPES_COUNT)
+        ]
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(recipe=recipe, ingredient=genre, amount=1)
+            for recipe in recipes for genre in genres
+        ])
+        Favorite.objects.bulk_create([
+            Favorite(user=cls.reader, recipe=recipe)
+            for recipe in recipes[::2]
+        ])
+        ShoppingCart.objects.bulk_create([
+            ShoppingCart(user=cls.reader, recipe=recipe)
+            for recipe in recipes[::3]
+        ])
+        Subscription.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def count_queries(self, client, limit):
+        caches['default'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), limit)
+        return len(queries)
+
+    def assert_constant(self, client):
+        counts = [self.count_queries(client, limit) for limit in PAGE_SIZES]
+        self.assertEqual(len(set(counts)), 1, counts)
+        self.assertLessEqual(counts[0], LIST_QUERY_BUDGET, counts)
+
+    def test_stored_snapshots(self):
+        self.count_queries(self.anonymous, RECIPES_COUNT)
+        self.assert_constant(self.anonymous)
+        self.assert_constant(self.client)
+
+    def test_missing_snapshots(self):
+        for client in (self.anonymous, self.client):
+            counts = []
+            for limit in PAGE_SIZES:
+                RecipeSnapshot.objects.all().delete()
+                counts.append(self.count_queries(client, limit))
+            self.assertEqual(len(set(counts)), 1, counts)
+
+    def test_anonymous_cache_keeps_pagination_mode(self):
+        caches['default'].clear()
+        pages = self.anonymous.get('/api/recipes/').json()
+        cursor = self.anonymous.get('/api/recipes/', {'cursor': ''}).json()
+        self.assertIn('count', pages)
+        self.assertNotIn('count', cursor)
+        self.assertIn('count', self.anonymous.get('/api/recipes/').json())
+
+    def test_flags(self):
+        results = self.client.get(
+            '/api/recipes/', {'limit': RECIPES_COUNT}
+        ).json()['results']
+        favorited = set(Favorite.objects.filter(
+            user=self.reader
+        ).values_list('recipe_id', flat=True))
+        in_cart = set(ShoppingCart.objects.filter(
+            user=self.reader
+        ).values_list('recipe_id', flat=True))
+        for recipe in results:
+            self.assertEqual(recipe['is_favorited'],
+                             recipe['id'] in favorited)
+            self.assertEqual(recipe['is_in_shopping_cart'],
+                             recipe['id'] in in_cart)
+            self.assertTrue(recipe['author']['is_subscribed'])
+
+
+class RecipeCacheVersionTest(MediaRootMixin, TestCase):
+    """Версия кэша ответов меняется только после фиксации транзакции."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author', password='x',
+            first_name='Автор', last_name='Авторов'
+        )
+        cls.genre = Ingredient.objects.create(name='Жанр',
+                                              measurement_unit='трек')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def assert_bumped_on_commit(self, method, url, data):
+        version = cache.get_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = method(url, data, format='json')
+            self.assertLess(response.status_code, 300, response.content)
+            self.assertEqual(cache.get_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(cache.get_version(), version)
+        return response
+
+    def test_create_and_update(self):
+        data = {
+            'name': 'Альбом', 'text': 'Текст', 'cooking_time': 10,
+            'image': png_base64(),
+            'ingredients': [{'id': self.genre.pk, 'amount': 1}],
+        }
+        response = self.assert_bumped_on_commit(
+            self.client.post, '/api/recipes/', data
+        )
+        self.assert_bumped_on_commit(
+            self.client.patch, f'/api/recipes/{response.json()["id"]}/',
+            dict(data, name='Другой альбом')
+        )
+
+
+@override_settings(JOBS_BACKEND='sync')
+class FeedTest(TestCase):
+    """Лента подписок упорядочена и следует за изменениями."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, *cls.authors = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', username=f'user{number}',
+                password='x', first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(4)
+        ]
+        for author in cls.authors[:2]:
+            Subscription.objects.create(user=cls.reader, author=author)
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.authors[number % 3], name=f'Альбом {number}',
+                text='Текст', cooking_time=10
+            )
+            for number in range(6)
+        ]
+
+    def setUp(self):
+        feed.get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def feed_ids(self):
+        response = self.client.get('/api/recipes/feed/', {'limit': 100})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def expected(self, *authors):
+        return list(Recipe.objects.filter(author__in=authors).order_by(
+            '-created_at', '-id'
+        ).values_list('id', flat=True))
+
+    def test_ordering(self):
+        self.assertEqual(self.feed_ids(), self.expected(*self.authors[:2]))
+
+    def test_publish_and_delete(self):
+        self.feed_ids()
+        with execute_on_commit():
+            recipe = Recipe.objects.create(
+                author=self.authors[0], name='Новый', text='Текст',
+                cooking_time=10
+            )
+        job = Job.objects.get(name=feed.FANOUT_TASK_NAME)
+        self.assertEqual(job.result, {'updated': 1})
+        self.assertEqual(self.feed_ids()[0], recipe.pk)
+        with execute_on_commit():
+            self.recipes[0].delete()
+        self.assertEqual(self.feed_ids(), self.expected(*self.authors[:2]))
+        self.assertNotIn(self.recipes[0].pk, self.feed_ids())
+
+    def test_subscribe_and_unsubscribe(self):
+        self.feed_ids()
+        url = f'/api/users/{self.authors[2].pk}/subscribe/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.feed_ids(), self.expected(*self.authors))
+        url = f'/api/users/{self.authors[0].pk}/subscribe/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.feed_ids(), self.expected(*self.authors[1:]))
+
+
+class CursorPaginationTest(TestCase):
+    """Курсорный режим работает для всех списков с PagesOrCursorPagination."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', username=f'user{number}',
+                password='x', first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(5)
+        ]
+        for author in cls.users[1:]:
+            Subscription.objects.create(user=cls.users[0], author=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def walk(self, url):
+        ids = []
+        response = self.client.get(url, {'cursor': '', 'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            self.assertNotIn('count', data)
+            ids.extend(item['id'] for item in data['results'])
+            if data['next'] is None:
+                return ids
+            response = self.client.get(data['next'])
+
+    def test_users(self):
+        self.assertEqual(self.walk('/api/users/'),
+                         [user.pk for user in self.users])
+
+    def test_subscriptions(self):
+        self.assertEqual(self.walk('/api/users/subscriptions/'),
+                         [user.pk for user in self.users[1:]])
+
+    def test_search_rejected(self):
+        response = self.client.get('/api/recipes/',
+                                   {'cursor': '', 'search': 'Альбом'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json())
+        response = self.client.get('/api/recipes/',
+                                   {'cursor': '', 'search': ''})
+        self.assertEqual(response.status_code, 200, response.content)
+
+
+class ImageVariantsReadTest(TestCase):
+    """Чтение альбомов без производных не ставит задачи."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader', password='x',
+            first_name='Читатель', last_name='Читателев'
+        )
+        for number in range(3):
+            author = User.objects.create_user(
+                email=f'author{number}@example.com',
+                username=f'author{number}', password='x',
+                first_name='Автор', last_name='Авторов'
+            )
+            Subscription.objects.create(user=cls.reader, author=author)
+            for position in range(3):
+                Recipe.objects.create(
+                    author=author, name=f'Альбом {position}', text='Текст',
+                    cooking_time=10
+                )
+        # Изображения без производных, как у загруженных до их появления.
+        User.objects.exclude(pk=cls.reader.pk).update(
+            avatar='users/avatars/avatar.png'
+        )
+        Recipe.objects.update(image='recipes/images/cover.png')
+
+    def test_subscriptions(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        counts = []
+        for _ in range(3):
+            with self.captureOnCommitCallbacks() as callbacks, \
+                    CaptureQueriesContext(connection) as queries:
+                response = client.get('/api/users/subscriptions/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(callbacks, [])
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1, counts)
+        self.assertFalse(Job.objects.exists())
+
+
+class ImageVariantsScheduleTest(TestCase):
+    """Повторные сохранения изображения ставят одну задачу."""
+
+    def test_one_job_per_file(self):
+        author = User.objects.create_user(
+            email='author@example.com', username='author', password='x',
+            first_name='Автор', last_name='Авторов'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=author, name='Альбом', text='Текст', cooking_time=10,
+                image='recipes/images/cover.png'
+            )
+            recipe.name = 'Другой альбом'
+            recipe.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        self.assertEqual(
+            Job.objects.filter(name=images.TASK_NAME).count(), 1
+        )
+
+
+class BuildImageVariantsTest(MediaRootMixin, TestCase):
+    """Команда build_image_variants сбрасывает готовые представления."""
+
+    def test_snapshot_refreshed(self):
+        author = User.objects.create_user(
+            email='author@example.com', username='author', password='x',
+            first_name='Автор', last_name='Авторов'
+        )
+        name = default_storage.save('recipes/images/cover.png', ContentFile(
+            base64.b64decode(png_base64((8, 8)).split(',')[1])
+        ))
+        recipe = Recipe.objects.create(
+            author=author, name='Альбом', text='Текст', cooking_time=10,
+            image=name
+        )
+        client = APIClient()
+        url = f'/api/recipes/{recipe.pk}/'
+        before = client.get(url)
+        self.assertIsNone(before.json()['image_variants'])
+        self.assertTrue(RecipeSnapshot.objects.filter(recipe=recipe).exists())
+        call_command('build_image_variants', workers=1, stdout=io.StringIO())
+        after = client.get(url)
+        self.assertIsNotNone(after.json()['image_variants'])
+        self.assertNotEqual(after['ETag'], before['ETag'])
+
+
+class GenreValidatorsTest(TestCase):
+    """Валидаторы списка жанров зависят только от словаря в базе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genres = [
+            Ingredient.objects.create(name=f'Жанр {number}',
+                                      measurement_unit='трек')
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def validators(self):
+        response = APIClient().get('/api/ingredients/')
+        self.assertEqual(response.status_code, 200)
+        return response['ETag'], response['Last-Modified']
+
+    def test_stable_without_changes(self):
+        validators = self.validators()
+        caches['default'].clear()
+        self.assertEqual(self.validators(), validators)
+        response = APIClient().get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=validators[0]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes(self):
+        seen = [self.validators()[0]]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genres[0].name = 'Жанр'
+            self.genres[0].save()
+        seen.append(self.validators()[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genres[1].delete()
+        seen.append(self.validators()[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Новый', measurement_unit='трек')
+        seen.append(self.validators()[0])
+        self.assertEqual(len(set(seen)), len(seen), seen)
+
+    def names(self, query):
+        response = APIClient().get('/api/ingredients/', {'name': query})
+        self.assertEqual(response.status_code, 200)
+        return [genre['name'] for genre in response.json()]
+
+    def test_warm_index_without_queries(self):
+        self.names('жанр')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.names('жанр')), len(self.genres))
+        self.assertEqual(len(queries), 0, queries.captured_queries)
+
+    def test_rename_and_delete_rebuild_index(self):
+        self.assertEqual(self.names('жанр 0'), ['Жанр 0'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genres[0].name = 'Джаз'
+            self.genres[0].save()
+        self.assertEqual(self.names('жанр 0'), [])
+        self.assertEqual(self.names('джаз'), ['Джаз'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genres[1].delete()
+        self.assertEqual(self.names('жанр'), ['Жанр 2'])
+
+
+class JobHeartbeatTest(TransactionTestCase):
+    """Задача возвращается в очередь, только когда воркер её не отмечает."""
+
+    @override_settings(JOBS_HEARTBEAT_INTERVAL=0.05, JOBS_STALE_TIMEOUT=0.3)
+    def test_long_job_not_requeued(self):
+        job = jobs.enqueue(SLOW_TASK, {'seconds': 0.8})
+        claimed = jobs.claim()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertTrue(jobs.execute(claimed))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.result, {'requeued': 0})
+        self.assertEqual(job.attempts, 1)
+
+    @override_settings(JOBS_STALE_TIMEOUT=0)
+    def test_job_without_heartbeat_requeued(self):
+        job = jobs.enqueue(SLOW_TASK, {'seconds': 0})
+        self.assertEqual(jobs.claim().pk, job.pk)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+
+class MetricsAccessTest(TestCase):
+    """Метрики отдаются только разрешённым адресам и сотрудникам."""
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.0/8'])
+    def test_allowed_ips(self):
+        client = APIClient()
+        self.assertEqual(
+            client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403
+        )
+        self.assertEqual(
+            client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200
+        )
+
+    @override_settings(METRICS_ALLOWED_IPS=[])
+    def test_staff(self):
+        client = APIClient()
+        user = User.objects.create_user(
+            email='user@example.com', username='user', password='x',
+            first_name='Имя', last_name='Фамилия'
+        )
+        client.force_login(user)
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(client.get('/metrics').status_code, 200)
+
+
+class ImportGenresTest(TransactionTestCase):
+    """Импорт жанров пачками и через COPY, с пропуском повторов."""
+
+    rows = [('Джаз', 'трек'), ('Рок', 'трек'), ('Джаз', 'трек'),
+            ('Рок', 'альбом'), ('Блюз, "дельта"', 'трек')]
+
+    def write(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def write_json(self, rows):
+        return self.write('.json', json.dumps([
+            {'name': name, 'measurement_unit': unit} for name, unit in rows
+        ], ensure_ascii=False))
+
+    def write_csv(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(rows)
+        return self.write('.csv', buffer.getvalue())
+
+    def imported(self):
+        return set(Ingredient.objects.values_list('name', 'measurement_unit'))
+
+    def run_import(self, path, **options):
+        output = io.StringIO()
+        call_command('import_genres', path, stdout=output, **options)
+        return output.getvalue()
+
+    def test_batches(self):
+        Ingredient.objects.create(name='Рок', measurement_unit='трек')
+        # Тестовая база SQLite в памяти блокирует таблицы целиком,
+        # параллельные пачки там падают с "database table is locked".
+        in_memory = (connection.vendor == 'sqlite'
+                     and connection.is_in_memory_db())
+        for path in (self.write_json(self.rows), self.write_csv(self.rows)):
+            for workers in (1,) if in_memory else (1, 2):
+                output = self.run_import(path, batch_size=2, workers=workers)
+                self.assertIn('Обработано строк: 5', output)
+                self.assertEqual(self.imported(), set(self.rows))
+                self.assertEqual(Ingredient.objects.count(), 4)
+
+    def test_malformed_csv_row(self):
+        path = self.write_csv(self.rows[:2] + [('Соул', 'трек', 'лишнее')])
+        with self.assertRaisesMessage(CommandError, 'строке 3'):
+            self.run_import(path, batch_size=2)
+        self.assertEqual(self.imported(), set(self.rows[:2]))
+
+    def test_malformed_json_item(self):
+        path = self.write('.json', '[{"name": "Соул"}]')
+        with self.assertRaisesMessage(CommandError,
+                                      'отсутствуют обязательные поля'):
+            self.run_import(path)
+        with self.assertRaisesMessage(CommandError, 'Неверный формат JSON'):
+            self.run_import(self.write('.json', '[{"name": "Соул", '))
+
+    def test_json_reader_item_size_limit(self):
+        content = '[{"name": "Соул", "tags": [' + '"тег", ' * 10000
+        file = io.StringIO(content)
+        reader = JSONArrayReader(file, chunk_size=16, max_item_size=256)
+        with self.assertRaisesMessage(json.JSONDecodeError, 'длиннее 256'):
+            list(reader)
+        self.assertLess(file.tell(), 512)
+        self.assertLess(len(reader.buffer), 512)
+
+    def test_json_reader_small_chunks(self):
+        content = json.dumps([
+            {'name': name, 'measurement_unit': unit}
+            for name, unit in self.rows
+        ], ensure_ascii=False, indent=2)
+        items = list(JSONArrayReader(io.StringIO(content), chunk_size=3))
+        self.assertEqual([(item['name'], item['measurement_unit'])
+                          for item in items], self.rows)
+
+    def test_copy_source(self):
+        progress = []
+        source = CopySource(iter(self.rows), progress.append)
+        chunks = iter(lambda: source.read(7), '')
+        self.assertEqual(
+            [tuple(row) for row in csv.reader(io.StringIO(''.join(chunks)))],
+            self.rows
+        )
+        self.assertEqual(sum(progress), len(self.rows))
+
+    def test_copy(self):
+        path = self.write_csv(self.rows)
+        if connection.vendor != 'postgresql':
+            with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+                self.run_import(path, copy=True)
+            return
+        Ingredient.objects.create(name='Рок', measurement_unit='трек')
+        self.assertIn('Обработано строк: 5',
+                      self.run_import(path, copy=True))
+        self.assertEqual(self.imported(), set(self.rows))
+        with self.assertRaisesMessage(CommandError, 'строке 1'):
+            self.run_import(self.write_csv([('Соул',)]), copy=True)
+
+
+class PoolResetTest(SimpleTestCase):
+    """Соединение возвращается в пул без незавершённой транзакции."""
+
+    def setUp(self):
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        self.wrapper = PooledSQLiteWrapper(
+            dict(connection.settings_dict, NAME=path, POOL={
+                'ENABLED': True, 'MAX_SIZE': 1
+            }),
+            alias=f'pool-test-{os.path.basename(path)}'
+        )
+        self.addCleanup(self.close_pool)
+
+    def close_pool(self):
+        self.wrapper.close()
+        pool._pools.pop(self.wrapper.alias).close()
+
+    def test_rollback_on_return(self):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id integer)')
+        self.wrapper.set_autocommit(False)
+        with self.wrapper.cursor() as cursor:
+            cursor.execute('INSERT INTO item VALUES (1)')
+        raw = self.wrapper.connection
+        self.wrapper.close()
+
+        with self.wrapper.cursor() as cursor:
+            self.assertIs(self.wrapper.connection, raw)
+            self.assertFalse(raw.in_transaction)
+            cursor.execute('SELECT COUNT(*) FROM item')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+
+class CartTotalsTest(TestCase):
+    """Итоги корзин совпадают с суммой, посчитанной заново."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author', password='x',
+            first_name='Автор', last_name='Авторов'
+        )
+        cls.buyers = [
+            User.objects.create_user(
+                email=f'buyer{number}@example.com',
+                username=f'buyer{number}', password='x',
+                first_name='Покупатель', last_name='Покупателев'
+            )
+            for number in range(2)
+        ]
+        cls.genres = [
+            Ingredient.objects.create(name=f'Жанр {number}',
+                                      measurement_unit='трек')
+            for number in range(3)
+        ]
+        cls.recipes = []
+        for number, amounts in enumerate(((1, 2, 0), (3, 0, 4))):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Альбом {number}', text='Текст',
+                cooking_time=10
+            )
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(recipe=recipe, ingredient=genre,
+                                   amount=amount)
+                for genre, amount in zip(cls.genres, amounts) if amount
+            ])
+            cls.recipes.append(recipe)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def cart_url(self, recipe):
+        return f'/api/recipes/{recipe.pk}/shopping_cart/'
+
+    def assertFresh(self):
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in
+            ShoppingCartTotal.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )
+        }
+        expected = {}
+        for cart in ShoppingCart.objects.all():
+            for ingredient_id, total in IngredientInRecipe.objects.filter(
+                recipe_id=cart.recipe_id
+            ).values_list('ingredient').annotate(
+                total=Sum('amount')
+            ).order_by():
+                key = (cart.user_id, ingredient_id)
+                expected[key] = expected.get(key, 0) + total
+        self.assertEqual(stored, expected)
+        self.assertEqual(cart_totals.check(), 0)
+
+    def test_add_and_remove(self):
+        client = self.client_for(self.buyers[0])
+        for recipe in self.recipes:
+            response = client.post(self.cart_url(recipe))
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertFresh()
+        response = client.get('/api/recipes/shopping_cart_summary/')
+        self.assertEqual(
+            [(item['id'], item['total_amount']) for item in response.json()],
+            [(self.genres[0].pk, 4), (self.genres[1].pk, 2),
+             (self.genres[2].pk, 4)]
+        )
+        self.assertEqual(
+            client.delete(self.cart_url(self.recipes[0])).status_code, 204
+        )
+        self.assertFresh()
+        self.assertFalse(ShoppingCartTotal.objects.filter(
+            ingredient=self.genres[1]
+        ).exists())
+
+    def test_batch(self):
+        client = self.client_for(self.buyers[0])
+        response = client.post('/api/recipes/shopping_cart/batch/', {
+            'add': [recipe.pk for recipe in self.recipes]
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFresh()
+        response = client.post('/api/recipes/shopping_cart/batch/', {
+            'remove': [self.recipes[1].pk]
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFresh()
+
+    def test_ingredient_edits(self):
+        for buyer in self.buyers:
+            ShoppingCart.objects.create(user=buyer, recipe=self.recipes[0])
+        ShoppingCart.objects.create(user=self.buyers[1],
+                                    recipe=self.recipes[1])
+        self.assertFresh()
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{self.recipes[0].pk}/', {'ingredients': [
+                {'id': self.genres[0].pk, 'amount': 5},
+                {'id': self.genres[2].pk, 'amount': 1},
+            ]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFresh()
+        self.recipes[1].delete()
+        self.assertFresh()
+
+
+class IngredientDiffUpdateTest(TestCase):
+    """Обновление жанров альбома не трогает неизменённые строки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author', password='x',
+            first_name='Автор', last_name='Авторов'
+        )
+        cls.genres = [
+            Ingredient.objects.create(name=f'Жанр {number}',
+                                      measurement_unit='трек')
+            for number in range(4)
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Альбом', text='Текст', cooking_time=10
+        )
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(recipe=cls.recipe, ingredient=genre,
+                               amount=number + 1)
+            for number, genre in enumerate(cls.genres[:3])
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def rows(self):
+        return {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount in
+            IngredientInRecipe.objects.filter(
+                recipe=self.recipe
+            ).values_list('pk', 'ingredient_id', 'amount')
+        }
+
+    def patch(self, amounts):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {'ingredients': [
+                {'id': genre.pk, 'amount': amount}
+                for genre, amount in amounts
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith((
+                'INSERT INTO "recipes_ingredientinrecipe"',
+                'UPDATE "recipes_ingredientinrecipe"',
+                'DELETE FROM "recipes_ingredientinrecipe"',
+            ))
+        ]
+
+    def test_unchanged(self):
+        before = self.rows()
+        writes = self.patch([(genre, amount) for genre, (_, amount) in
+                             zip(self.genres, before.values())])
+        self.assertEqual(writes, [])
+        self.assertEqual(self.rows(), before)
+
+    def test_diff(self):
+        before = self.rows()
+        first, second, third, fourth = self.genres
+        writes = self.patch([(first, 1), (second, 5), (fourth, 7)])
+        self.assertEqual(len(writes), 3, writes)
+        after = self.rows()
+        self.assertEqual(after[first.pk], before[first.pk])
+        self.assertEqual(after[second.pk], (before[second.pk][0], 5))
+        self.assertNotIn(third.pk, after)
+        self.assertEqual(after[fourth.pk][1], 7)
+
+
+class BatchTest(TestCase):
+    """Пакетные эндпоинты возвращают статус для каждого идентификатора."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', username=f'user{number}',
+                password='x', first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(3)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.users[1], name=f'Альбом {number}', text='Текст',
+                cooking_time=10
+            )
+            for number in range(3)
+        ]
+        Favorite.objects.create(user=cls.users[0], recipe=cls.recipes[0])
+        Subscription.objects.create(user=cls.users[0], author=cls.users[1])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def post(self, url, data):
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['id'], item['action'], item['status'])
+                for item in response.json()['results']]
+
+    def test_favorite(self):
+        missing_pk = self.recipes[-1].pk + 1
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        results = self.post('/api/recipes/favorite/batch/', {
+            'add': [first, second, missing_pk, second],
+            'remove': [third, missing_pk + 1],
+        })
+        self.assertEqual(results, [
+            (first, 'add', 'exists'),
+            (second, 'add', 'added'),
+            (missing_pk, 'add', 'not_found'),
+            (third, 'remove', 'missing'),
+            (missing_pk + 1, 'remove', 'not_found'),
+        ])
+        results = self.post('/api/recipes/favorite/batch/', {
+            'remove': [first, second],
+        })
+        self.assertEqual(results, [(first, 'remove', 'removed'),
+                                   (second, 'remove', 'removed')])
+        self.assertFalse(Favorite.objects.filter(user=self.users[0]).exists())
+        for recipe in self.recipes:
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.favorites_count, 0)
+
+    def test_shopping_cart(self):
+        first, second, _ = (recipe.pk for recipe in self.recipes)
+        results = self.post('/api/recipes/shopping_cart/batch/', {
+            'add': [first, second],
+        })
+        self.assertEqual(results, [(first, 'add', 'added'),
+                                   (second, 'add', 'added')])
+        self.assertEqual(
+            set(ShoppingCart.objects.filter(
+                user=self.users[0]
+            ).values_list('recipe_id', flat=True)),
+            {first, second}
+        )
+        self.recipes[0].refresh_from_db()
+        self.assertEqual(self.recipes[0].in_carts_count, 1)
+
+    def test_subscribe(self):
+        me, followed, other = self.users
+        results = self.post('/api/users/subscribe/batch/', {
+            'add': [me.pk, other.pk],
+            'remove': [followed.pk],
+        })
+        self.assertEqual(results, [
+            (me.pk, 'add', 'forbidden'),
+            (other.pk, 'add', 'added'),
+            (followed.pk, 'remove', 'removed'),
+        ])
+        results = self.post('/api/users/subscribe/batch/', {
+            'add': [other.pk],
+        })
+        self.assertEqual(results, [(other.pk, 'add', 'exists')])
+        self.assertEqual(
+            list(Subscription.objects.filter(
+                user=me
+            ).values_list('author_id', flat=True)),
+            [other.pk]
+        )
+        for user in self.users:
+            user.refresh_from_db()
+        self.assertEqual(me.following_count, 1)
+        self.assertEqual(followed.followers_count, 0)
+        self.assertEqual(other.followers_count, 1)
+
+    def test_concurrent_duplicate_skipped(self):
+        recipe = self.recipes[1]
+        insert = batch._insert
+
+        def insert_after_concurrent(model, objects, target_field):
+            Favorite.objects.create(user=self.users[0], recipe=recipe)
+            return insert(model, objects, target_field)
+
+        with mock.patch.object(batch, '_insert', insert_after_concurrent):
+            results = self.post('/api/recipes/favorite/batch/', {
+                'add': [recipe.pk],
+            })
+        self.assertEqual(results, [(recipe.pk, 'add', 'exists')])
+        self.assertEqual(
+            Favorite.objects.filter(user=self.users[0], recipe=recipe).count(),
+            1
+        )
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_unique_constraint(self):
+        for model in (Favorite, ShoppingCart):
+            model.objects.create(user=self.users[2], recipe=self.recipes[2])
+            with self.subTest(model=model.__name__), self.assertRaises(
+                IntegrityError
+            ), transaction.atomic():
+                model.objects.create(user=self.users[2],
+                                     recipe=self.recipes[2])
+
+    def test_invalid_body(self):
+        pk = self.recipes[0].pk
+        for data in ({'add': 'x'}, {'add': [pk], 'remove': [pk]}):
+            response = self.client.post('/api/recipes/favorite/batch/',
+                                        data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+    """Base64 декодируется частями с проверкой размера и дополнения."""
+
+    def setUp(self):
+        self.field = fields.Base64ImageField()
+        self.field.bind('image', None)
+
+    def assertFails(self, data, code):
+        with self.assertRaises(ValidationError) as error:
+            self.field.to_internal_value(data)
+        self.assertEqual(error.exception.get_codes(), [code])
+
+    def decode(self, data):
+        upload = self.field.to_internal_value(data)
+        self.addCleanup(upload.close)
+        return upload
+
+    def test_small_chunks(self):
+        header, encoded = png_base64((8, 8)).split(',', 1)
+        expected = base64.b64decode(encoded)
+        wrapped = header + ',' + '\n'.join(
+            encoded[i:i + 7] for i in range(0, len(encoded), 7)
+        )
+        for chunk_size in (1, 3, 5, fields.BASE64_CHUNK_SIZE):
+            with self.subTest(chunk_size=chunk_size), mock.patch.object(
+                fields, 'BASE64_CHUNK_SIZE', chunk_size
+            ):
+                upload = self.decode(wrapped)
+                self.assertEqual(upload.size, len(expected))
+                self.assertEqual(upload.read(), expected)
+                self.assertTrue(upload.name.endswith('.png'))
+
+    def test_bad_padding(self):
+        data = png_base64()
+        for broken in (data[:-1], data.rstrip('=') + 'A', data + '='):
+            with self.subTest(broken=broken[-8:]), mock.patch.object(
+                fields, 'BASE64_CHUNK_SIZE', 4
+            ):
+                self.assertFails(broken, 'invalid_base64')
+        self.assertFails('data:image/png;base64,!!!!', 'invalid_base64')
+
+    def test_too_large(self):
+        data = png_base64((8, 8))
+        size = len(base64.b64decode(data.split(',', 1)[1]))
+        with override_settings(IMAGE_UPLOAD_MAX_BYTES=size):
+            self.assertEqual(self.decode(data).size, size)
+        with override_settings(IMAGE_UPLOAD_MAX_BYTES=size - 1):
+            self.assertFails(data, 'too_large')
+        with override_settings(IMAGE_UPLOAD_MAX_BYTES=size + 1):
+            self.assertFails(data + 'A' * 8, 'too_large')
+
+    def test_not_image(self):
+        self.assertFails(base64.b64encode(b'not an image').decode(),
+                         'invalid_image')
+
+
+class SharedCacheTest(SimpleTestCase):
+    """Несколько процессов не запускаются с кэшем в памяти процесса."""
+
+    def test_local_cache_rejected(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'default'):
+            require_shared('процессов несколько')
+        with self.assertRaisesMessage(CommandError, 'CACHE_BACKEND'):
+            call_command('run_worker', '--once')
+
+    def test_feed_cache_checked(self):
+        self.assertIn(settings.FEED_CACHE_ALIAS,
+                      settings.SHARED_CACHE_ALIASES)
+
+    def test_genres_cache_checked(self):
+        self.assertIn(settings.GENRES_CACHE_ALIAS,
+                      settings.SHARED_CACHE_ALIASES)
+
+    def test_shared_cache_accepted(self):
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': 'redis://localhost:6379/1',
+        }}):
+            require_shared('процессов несколько')
+
+
+@override_settings(JOBS_BACKEND='sync')
+class SyncJobsTest(TransactionTestCase):
+    """При JOBS_BACKEND='sync' задачи выполняются после коммита."""
+
+    def test_failing_job_keeps_caller_write(self):
+        with transaction.atomic():
+            Ingredient.objects.create(name='Соул', measurement_unit='трек')
+            job = jobs.enqueue(FAILING_TASK)
+            self.assertEqual(Job.objects.get(pk=job.pk).status, Job.QUEUED)
+        self.assertTrue(Ingredient.objects.filter(name='Соул').exists())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, 'Ошибка задачи')
+
+
+class LoadTestDataTest(MediaRootMixin, TestCase):
+    """Синтетические данные получают заданное время создания."""
+
+    def test_created_at(self):
+        for number in range(3):
+            Ingredient.objects.create(name=f'Жанр {number}',
+                                      measurement_unit='трек')
+        call_command(
+            'load_test_data', users=4, recipes_per_user=2,
+            genres_per_recipe=1, favorites_per_user=1, carts_per_user=1,
+            subscriptions_per_user=1, stdout=io.StringIO()
+        )
+        self.assertEqual(Recipe.objects.count(), 8)
+        for model in (Recipe, Favorite, ShoppingCart, Subscription):
+            with self.subTest(model=model.__name__):
+                self.assertFalse(model.objects.filter(
+                    created_at__gte=SYNTHETIC_EPOCH + timedelta(days=1)
+                ).exists())
+                self.assertTrue(
+                    model._meta.get_field('created_at').auto_now_add
+                )
@@ -4,12 +4,14 @@ from api.views import (
     UserViewSet,
     RecipeViewSet,
     IngredientViewSet,
+    JobViewSet,
 )
 
 router = DefaultRouter()
 router.register('users', UserViewSet, basename='users')
 router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
+router.register('jobs', JobViewSet, basename='jobs')
 
 app_name = 'recipes'
 
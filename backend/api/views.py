@@ -1,23 +1,41 @@
+import os
+import uuid
 from datetime import timezone
-from django.db.models import Sum
+from functools import partial
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.permissions import (IsAuthenticated,
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.permissions import (IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError, NotAuthenticated
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet as DjoserUserViewSet
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.utils import timezone
-from recipes.models import (Ingredient, Recipe,
+from foodgram.db.pool import pool_stats
+from recipes import (autocomplete, batch, cart_totals, jobs, relations,
+                     response_cache, shopping_list, tasks)
+from recipes import feed as recipe_feed
+from recipes.queries import latest_by_author
+from recipes.models import (Ingredient, Job, Recipe,
                             ShoppingCart, Favorite,
-                            Subscription, User, IngredientInRecipe)
-from .pagination import PagesPagination
+                            Subscription, User)
+from . import cache, conditional, snapshots
+from .async_views import AsyncReadMixin
+from .pagination import FeedPagination, PagesOrCursorPagination
 from .permissions import IsAuthorOrReadOnly
+from .renderers import (CSVRenderer, PDFRenderer, PlainTextRenderer,
+                        SnapshotJSONRenderer)
 from .serializers import (
+    BatchSerializer,
+    GenreImportSerializer,
     IngredientSerializer,
+    JobSerializer,
     RecipeReadSerializer,
     RecipeWriteSerializer,
     UserSerializer,
@@ -25,33 +43,133 @@ from .serializers import (
     RecipeShortLinkSerializer,
     FavoriteSerializer,
     ShoppingCartSerializer,
+    ShoppingCartTotalSerializer,
     SubscriptionSerializer
 )
 from .filters import RecipeFilter
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+def batch_response(request, model, field, targets, forbidden=()):
+    """
+    Ответ пакетного эндпоинта.
+
+    Тело запроса: {"add": [id, ...], "remove": [id, ...]}, в ответе
+    результат для каждого идентификатора.
+    """
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return Response({'results': batch.apply(
+        request.user, model, field, targets,
+        forbidden=forbidden, **serializer.validated_data
+    )})
+
+
+def job_response(request, job):
+    """Ответ 202 с состоянием поставленной задачи."""
+    data = JobSerializer(job, context={'request': request}).data
+    return Response(data, status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': data['url']},
+                    content_type='application/json')
+
+
+class IngredientViewSet(AsyncReadMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet, описывающий работу с ингредиентами"""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
+    async_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        """
+        Метод для получения ингредиентов по имени.
+
+        Поиск без учёта регистра: сначала совпадения по началу названия,
+        затем по вхождению. Обслуживается индексом в памяти процесса.
+        ETag и Last-Modified берутся из версии словаря жанров.
+        """
+        version = autocomplete.get_version()
+        return conditional.respond(
+            request,
+            conditional.make_etag(
+                'genres', version, request.query_params.urlencode()
+            ),
+            version,
+            partial(self._list, request, version)
+        )
 
-    def get_queryset(self):
-        """Метод для получения ингредиентов по имени"""
-        name = self.request.query_params.get('name')
-        if name:
-            return self.queryset.filter(name__startswith=name)
-        return self.queryset
+    def _list(self, request, version):
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = None
+        if limit is not None and limit < 1:
+            limit = None
+        genres = autocomplete.search(
+            request.query_params.get('name', ''), limit, version
+        )
+        return Response(self.get_serializer(genres, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Жанр с поддержкой условных запросов"""
+        genre = self.get_object()
+        return conditional.respond(
+            request,
+            conditional.make_etag('genre', genre.pk, genre.updated_at),
+            genre.updated_at.timestamp(),
+            lambda: Response(self.get_serializer(genre).data)
+        )
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='import',
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser, FormParser]
+    )
+    def import_genres(self, request):
+        """
+        Фоновый импорт жанров из CSV или JSON файла.
+
+        Файл сохраняется в хранилище, импорт выполняет воркер;
+        в ответе задача для опроса (/api/jobs/{id}/).
+        """
+        serializer = GenreImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        name = default_storage.save(
+            'jobs/uploads/{}{}'.format(
+                uuid.uuid4().hex, os.path.splitext(upload.name)[1].lower()
+            ),
+            upload
+        )
+        return job_response(request, jobs.enqueue(
+            tasks.IMPORT_GENRES, {'upload': name}, user=request.user
+        ))
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     """ViewSet для рецептов"""
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly)
-    pagination_class = PagesPagination
+    pagination_class = PagesOrCursorPagination
+    cursor_ordering = ('-created_at', '-id')
+    cursor_conflicts = ('search',)
+    async_actions = ('list', 'retrieve')
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    renderer_classes = (SnapshotJSONRenderer, BrowsableAPIRenderer)
+
+    def get_queryset(self):
+        """
+        Рецепты вместе с автором.
+
+        Флаги is_favorited, is_in_shopping_cart и is_subscribed берутся
+        из связей пользователя (recipes.relations) без запросов к базе.
+        Жанры загружаются только при построении представлений
+        (см. api.snapshots).
+        """
+        return self.queryset.select_related('author').defer('search_vector')
 
     def get_serializer_class(self):
         """Выбор сериализатора в зависимости от действия"""
@@ -65,6 +183,117 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Метод для автоматического указания автора рецепта"""
         serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        """Удаление рецепта со сбросом кэша ответов"""
+        with transaction.atomic(), cart_totals.deferred():
+            super().perform_destroy(instance)
+        response_cache.bump_version()
+
+    def _cached(self, handler, request, *args, **kwargs):
+        """
+        Отдаёт ответ из кэша для анонимных пользователей.
+
+        Авторизованным пользователям ответ не кэшируется, так как
+        содержит персональные флаги.
+        """
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        key = cache.make_key(request, self.action, kwargs.get('pk'))
+        data = cache.load(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.store(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def _list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(snapshots.render(queryset, request))
+        return self.get_paginated_response(snapshots.render(page, request))
+
+    def _retrieve(self, request, *args, recipe, **kwargs):
+        return Response(snapshots.render([recipe], request)[0])
+
+    @staticmethod
+    def _validators(recipe, request):
+        """
+        ETag и Last-Modified альбома.
+
+        Учитывают сам альбом, профиль автора, словарь жанров, формат
+        представления, адрес сервера в ссылках и флаги пользователя.
+        """
+        genres_version = autocomplete.get_version()
+        flags = snapshots.flags(recipe, relations.for_request(request))
+        etag = conditional.make_etag(
+            'recipe', snapshots.VERSION, request.build_absolute_uri('/'),
+            recipe.pk, recipe.updated_at, recipe.author.updated_at,
+            genres_version, *flags.values()
+        )
+        last_modified = max(
+            recipe.updated_at.timestamp(),
+            recipe.author.updated_at.timestamp(),
+            genres_version
+        )
+        return etag, last_modified
+
+    def list(self, request, *args, **kwargs):
+        """Список рецептов из готовых представлений"""
+        return self._cached(self._list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Рецепт из готового представления с условными запросами"""
+        recipe = self.get_object()
+        return conditional.respond(
+            request, *self._validators(recipe, request),
+            partial(self._cached, self._retrieve, request, *args,
+                    recipe=recipe, **kwargs)
+        )
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAdminUser]
+    )
+    def cache_stats(self, request):
+        """Счётчики попаданий и промахов кэша ответов"""
+        return Response(cache.stats())
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAdminUser]
+    )
+    def db_pool_stats(self, request):
+        """Статистика пулов соединений с базой данных этого процесса"""
+        return Response(pool_stats())
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+        pagination_class=FeedPagination
+    )
+    def feed(self, request):
+        """
+        Лента альбомов авторов, на которых подписан пользователь.
+
+        Позиции страницы берутся из кэша ленты, сами альбомы
+        загружаются одним запросом по идентификаторам.
+        """
+        ids = self.paginator.paginate_feed(
+            partial(recipe_feed.page, request.user.pk), request
+        )
+        recipes = self.get_queryset().in_bulk(ids)
+        return self.paginator.get_paginated_response(snapshots.render(
+            [recipes[pk] for pk in ids if pk in recipes], request
+        ))
+
     @action(detail=True, methods=['get'])
     def short_link(self, request, pk=None):
         """Получение короткой ссылки на рецепт"""
@@ -118,86 +347,113 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    def _render_shopping_cart(self, ingredient_totals, recipe_names, date):
-        """Формирует текстовый отчет со списком покупок"""
-        from io import BytesIO
-
-        buffer = BytesIO()
-
-        header = f"Список покупок на {date}\n\n"
-        buffer.write(header.encode('utf-8'))
-
-        buffer.write("Альбом в списке покупок:\n".encode('utf-8'))
-        for recipe_name, author in recipe_names.items():
-            recipe_line = f"- {recipe_name} (автор: {author})\n"
-            buffer.write(recipe_line.encode('utf-8'))
-        buffer.write("\n".encode('utf-8'))
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='favorite/batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def favorite_batch(self, request):
+        """Пакетное добавление и удаление альбомов в избранном"""
+        return batch_response(request, Favorite, 'recipe',
+                              Recipe.objects.all())
 
-        buffer.write("Жанры:\n".encode('utf-8'))
-        for i, (name, unit, amount) in enumerate(ingredient_totals, 1):
-            ingredient_line = f"{i}. {name} - {amount} {unit}\n"
-            buffer.write(ingredient_line.encode('utf-8'))
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='shopping_cart/batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_batch(self, request):
+        """Пакетное добавление и удаление альбомов в корзине"""
+        return batch_response(request, ShoppingCart, 'recipe',
+                              Recipe.objects.all())
 
-        footer = "\nСпасибо за использование сервиса Musicgram!"
-        buffer.write(footer.encode('utf-8'))
+    @staticmethod
+    def _cart_totals(user):
+        """Готовые итоги корзины пользователя, упорядоченные по жанру."""
+        return user.cart_totals.order_by('ingredient__name')
 
-        buffer.seek(0)
-        return buffer
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='shopping_cart_summary',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_summary(self, request):
+        """Метод для получения итогов корзины покупок по жанрам."""
+        return Response(ShoppingCartTotalSerializer(
+            self._cart_totals(request.user).select_related('ingredient'),
+            many=True
+        ).data)
 
     @action(
         detail=False,
         methods=['get'],
         url_path='download_shopping_cart',
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[PlainTextRenderer, CSVRenderer, PDFRenderer]
     )
     def download_shopping_cart(self, request):
-        """Метод для загрузки текстового отчета со списком покупок"""
-        recipe_names = {}
-
-        recipe_ids = request.user.shoppingcarts.values_list('recipe_id',
-                                                            flat=True)
-
-        recipes_info = Recipe.objects.filter(id__in=recipe_ids).select_related(
-            'author'
-        ).values_list('name', 'author__username')
-
-        for name, author in recipes_info:
-            recipe_names[name] = author
-
-        ingredient_totals = IngredientInRecipe.objects.filter(
-            recipe_id__in=recipe_ids
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            total_amount=Sum('amount')
-        ).order_by('ingredient__name').values_list(
-            'ingredient__name',
-            'ingredient__measurement_unit',
-            'total_amount'
-        )
+        """
+        Метод для загрузки списка покупок.
+
+        Формат выбирается параметром ?format=txt|csv|pdf, txt и csv
+        отдаются потоково по мере чтения строк из базы. С ?async=true
+        файл формирует воркер, а в ответе задача для опроса.
+        """
+        report_format = request.accepted_renderer.format
+        if request.query_params.get('async', '').lower() in ('1', 'true'):
+            return job_response(request, jobs.enqueue(
+                tasks.SHOPPING_CART_REPORT, {'format': report_format},
+                user=request.user
+            ))
+
+        recipes, ingredient_totals = shopping_list.cart_rows(request.user)
+        date = timezone.now().strftime('%d.%m.%Y')
+        filename = f'shopping_cart.{report_format}'
+
+        if report_format == PDFRenderer.format:
+            return FileResponse(
+                shopping_list.render_pdf(recipes, ingredient_totals, date),
+                content_type=PDFRenderer.media_type,
+                as_attachment=True,
+                filename=filename
+            )
 
-        report_text = self._render_shopping_cart(
-            ingredient_totals,
-            recipe_names,
-            timezone.now().strftime('%d.%m.%Y')
+        render = (shopping_list.iter_csv
+                  if report_format == CSVRenderer.format
+                  else shopping_list.iter_txt)
+        response = StreamingHttpResponse(
+            (line.encode('utf-8') for line in render(
+                recipes.iterator(), ingredient_totals.iterator(), date
+            )),
+            content_type=(
+                f'{request.accepted_renderer.media_type}; charset=utf-8'
+            )
         )
-
-        return FileResponse(
-            report_text,
-            content_type='text/plain',
-            filename='shopping_cart.txt'
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"'
         )
+        return response
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(AsyncReadMixin, DjoserUserViewSet):
     """ViewSet, описывающий работу с пользователями и подписками"""
 
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    pagination_class = PagesPagination
+    pagination_class = PagesOrCursorPagination
+    async_actions = ('subscriptions',)
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    @property
+    def cursor_ordering(self):
+        """Порядок курсорного режима: подписки по дате, пользователи по id"""
+        if self.action == 'subscriptions':
+            return ('created_at', 'id')
+        return ('id',)
+
     def get_permissions(self):
         """Переопределение разрешений для метода me"""
         if self.action == 'me':
@@ -213,7 +469,16 @@ class UserViewSet(DjoserUserViewSet):
         """Метод для получения текущего пользователя"""
         if not request.user.is_authenticated:
             raise NotAuthenticated()
-        return Response(self.get_serializer(request.user).data)
+        user = request.user
+        return conditional.respond(
+            request,
+            conditional.make_etag(
+                'me', request.build_absolute_uri('/'), user.pk,
+                user.updated_at
+            ),
+            user.updated_at.timestamp(),
+            lambda: Response(self.get_serializer(user).data)
+        )
 
     @action(detail=False, methods=['put', 'delete'], url_path='me/avatar')
     def change_avatar(self, request):
@@ -230,12 +495,14 @@ class UserViewSet(DjoserUserViewSet):
             )
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            response_cache.bump_version()
             return Response(
                 {'avatar': serializer.data['avatar']},
                 status=status.HTTP_200_OK
             )
         user.avatar.delete()
         user.save()
+        response_cache.bump_version()
         return Response(
             {'message': 'Аватар успешно удалён'},
             status=status.HTTP_204_NO_CONTENT
@@ -270,15 +537,44 @@ class UserViewSet(DjoserUserViewSet):
         ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, methods=['get'], url_path='subscriptions')
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='subscribe/batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def subscribe_batch(self, request):
+        """Пакетная подписка на авторов и отписка от них"""
+        return batch_response(request, Subscription, 'author',
+                              User.objects.all(),
+                              forbidden=(request.user.pk,))
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='subscriptions',
+        permission_classes=[IsAuthenticated]
+    )
     def subscriptions(self, request):
-        """Метод для вывода всех авторов, на которых подписан пользователь"""
-        user = request.user
-        subscriptions = user.users.all().select_related('author')
+        """
+        Метод для вывода всех авторов, на которых подписан пользователь.
+
+        Альбомы всех авторов страницы загружаются одним запросом
+        с оконной функцией, поэтому число запросов не зависит
+        от размера страницы и recipes_limit.
+        """
+        subscriptions = request.user.users.select_related('author')
 
         page = self.paginate_queryset(subscriptions)
 
         authors = [subscription.author for subscription in page]
+        recipes = latest_by_author(
+            [author.id for author in authors],
+            SubscribedUserSerializer.get_recipes_limit(request)
+        )
+        for author in authors:
+            author.is_subscribed = True
+            author.recent_recipes = recipes[author.id]
 
         serializer = SubscribedUserSerializer(
             authors,
@@ -286,3 +582,32 @@ class UserViewSet(DjoserUserViewSet):
             context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet состояния и результатов фоновых задач пользователя"""
+
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """Только задачи текущего пользователя"""
+        return self.request.user.jobs.all()
+
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        """Файл или данные результата выполненной задачи"""
+        job = self.get_object()
+        if job.status != Job.DONE:
+            return Response(
+                {'detail': 'Задача ещё не выполнена', 'status': job.status},
+                status=status.HTTP_409_CONFLICT
+            )
+        if not job.result_file:
+            return Response(job.result)
+        return FileResponse(
+            job.result_file.open('rb'),
+            as_attachment=True,
+            filename=job.result['filename'],
+            content_type=job.result['content_type']
+        )
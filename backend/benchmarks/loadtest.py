@@ -0,0 +1,175 @@
+"""
+Нагрузочный тест HTTP-эндпоинтов.
+
+Каждый клиент держит keep-alive соединение и отправляет запросы
+без пауз. Режим compare по очереди запускает gunicorn в режимах
+wsgi и asgi и сравнивает пропускную способность и задержки.
+
+Примеры:
+    python -m benchmarks.loadtest run http://127.0.0.1:8000/api/recipes/
+    python -m benchmarks.loadtest compare --path /api/recipes/ -c 64
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+STARTUP_TIMEOUT = 30
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def _client(url, deadline, latencies, errors, headers):
+    """Поток-клиент с одним keep-alive соединением."""
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    connection = None
+    while time.perf_counter() < deadline:
+        if connection is None:
+            connection = http.client.HTTPConnection(
+                parts.hostname, parts.port or 80, timeout=30
+            )
+        started = time.perf_counter()
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+            else:
+                latencies.append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException) as error:
+            errors.append(type(error).__name__)
+            connection.close()
+            connection = None
+    if connection is not None:
+        connection.close()
+
+
+def run(url, concurrency, duration, token=None):
+    """
+    Нагружает url заданным числом клиентов.
+
+    :returns: Словарь с rps, перцентилями задержки и числом ошибок
+    """
+    headers = {'Connection': 'keep-alive'}
+    if token:
+        headers['Authorization'] = f'Token {token}'
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(
+            target=_client, args=(url, deadline, latencies, errors, headers)
+        )
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def _free_port():
+    """Свободный локальный порт."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(port, process):
+    """Ожидает, пока сервер начнёт принимать соединения."""
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn завершился при запуске')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn не запустился')
+
+
+def serve_and_run(mode, path, concurrency, duration, workers, token=None):
+    """Запускает gunicorn в заданном режиме и нагружает path."""
+    port = _free_port()
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        GUNICORN_WORKERS=str(workers),
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for(port, process)
+        result = run(f'http://127.0.0.1:{port}{path}', concurrency,
+                     duration, token)
+    finally:
+        process.terminate()
+        process.wait()
+    result['mode'] = mode
+    return result
+
+
+def main(argv=None):
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Нагрузить URL')
+    run_parser.add_argument('url')
+
+    compare_parser = commands.add_parser(
+        'compare', help='Сравнить режимы wsgi и asgi'
+    )
+    compare_parser.add_argument('--path', default='/api/recipes/')
+    compare_parser.add_argument('--workers', type=int, default=2)
+
+    for command in (run_parser, compare_parser):
+        command.add_argument('-c', '--concurrency', type=int, default=32)
+        command.add_argument('-d', '--duration', type=float, default=10)
+        command.add_argument('--token', help='Токен авторизации')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        results = [run(args.url, args.concurrency, args.duration,
+                       args.token)]
+    else:
+        results = [
+            serve_and_run(mode, args.path, args.concurrency, args.duration,
+                          args.workers, args.token)
+            for mode in ('wsgi', 'asgi')
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+"""
+Бенчмарк эндпоинтов API через тестовый клиент Django.
+
+Для каждого эндпоинта измеряются задержки (p50/p95), количество
+SQL-запросов и размер ответа. Все изменения в базе откатываются,
+поэтому прогон можно выполнять на синтетических данных
+из load_test_data --users.
+
+Примеры:
+    python -m benchmarks.suite record -o benchmarks/baseline.json
+    python -m benchmarks.suite compare benchmarks/baseline.json
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Callable, Optional
+
+from benchmarks.loadtest import percentile
+
+DEFAULT_REPEAT = 20
+DEFAULT_WARMUP = 2
+LATENCY_THRESHOLD = 0.25
+LATENCY_FLOOR_MS = 1.0
+QUERY_THRESHOLD = 0
+
+
+class Rollback(Exception):
+    """Откатывает транзакцию с данными прогона."""
+
+
+@dataclass
+class Case:
+    """
+    Один измеряемый запрос.
+
+    prepare выполняется перед каждым запросом внутри откатываемой
+    транзакции и может вернуть дополнительные заголовки запроса.
+    """
+
+    name: str
+    method: str
+    path: str
+    data: Optional[dict] = None
+    auth: bool = True
+    prepare: Optional[Callable[[], None]] = None
+
+
+def setup_django():
+    """Инициализирует Django для запуска вне manage.py."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    import django
+    django.setup()
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+
+def png_base64():
+    """Небольшая картинка для создания и изменения альбомов."""
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (200, 80, 80)).save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+class Fixtures:
+    """Объекты синтетического набора, на которых строятся запросы."""
+
+    def __init__(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.authtoken.models import Token
+
+        from recipes import jobs, tasks
+        from recipes.models import Favorite, Ingredient, Recipe
+
+        User = get_user_model()
+        self.user = User.objects.filter(
+            recipes__isnull=False
+        ).order_by('-following_count', '-recipes_count', 'id').first()
+        if self.user is None:
+            raise SystemExit(
+                'Нет данных. Запустите load_test_data --users N.'
+            )
+        self.token = Token.objects.get_or_create(user=self.user)[0].key
+        self.recipe = Recipe.objects.order_by('-favorites_count', 'id')[0]
+        self.own_recipe = self.user.recipes.order_by('id')[0]
+        self.author = Recipe.objects.exclude(
+            author=self.user
+        ).order_by('-author__followers_count', 'id')[0].author
+        self.stranger = User.objects.exclude(pk=self.user.pk).exclude(
+            pk__in=self.user.users.values('author')
+        ).order_by('id').first()
+        self.free_recipe = Recipe.objects.exclude(
+            pk__in=Favorite.objects.filter(
+                user=self.user
+            ).values('recipe')
+        ).exclude(
+            pk__in=self.user.shoppingcarts.values('recipe')
+        ).order_by('id')[0]
+        self.genres = list(
+            Ingredient.objects.order_by('id').values_list('id', 'name')[:3]
+        )
+        self.batch_recipes = list(Recipe.objects.exclude(
+            author=self.user
+        ).order_by('id').values_list('id', flat=True)[:20])
+        self.batch_authors = list(User.objects.exclude(
+            pk=self.user.pk
+        ).order_by('id').values_list('id', flat=True)[:20])
+        self.search_word = self.recipe.name.split()[0]
+        self.job = jobs.enqueue(
+            tasks.SHOPPING_CART_REPORT, {'format': 'csv'}, user=self.user
+        )
+        jobs.run_now(self.job)
+
+
+def build_cases(fixtures):
+    """Список измеряемых запросов по всем эндпоинтам api/urls.py."""
+    from django.test import Client
+
+    from recipes.models import Favorite, ShoppingCart, Subscription
+
+    user = fixtures.user
+    recipe = fixtures.recipe.pk
+    own = fixtures.own_recipe.pk
+    free = fixtures.free_recipe.pk
+    author = fixtures.author.pk
+    stranger = fixtures.stranger.pk
+    genre_prefix = fixtures.genres[0][1][:2]
+    ingredients = [
+        {'id': pk, 'amount': amount}
+        for amount, (pk, _) in enumerate(fixtures.genres, start=1)
+    ]
+    image = png_base64()
+    half = len(fixtures.batch_recipes) // 2
+    batch_recipes = {
+        'add': fixtures.batch_recipes[:half],
+        'remove': fixtures.batch_recipes[half:],
+    }
+    half = len(fixtures.batch_authors) // 2
+    batch_authors = {
+        'add': fixtures.batch_authors[:half],
+        'remove': fixtures.batch_authors[half:],
+    }
+    job = fixtures.job.pk
+    client = Client()
+
+    def add(model, **kwargs):
+        def prepare():
+            model.objects.create(user=user, **kwargs)
+        return prepare
+
+    def add_all(model, field, ids):
+        def prepare():
+            model.objects.bulk_create(
+                [model(user=user, **{field: pk}) for pk in ids],
+                ignore_conflicts=True
+            )
+        return prepare
+
+    def revalidate(path, auth=True):
+        """Заголовки с валидаторами свежего ответа для ответа 304."""
+        extra = {'HTTP_AUTHORIZATION': f'Token {fixtures.token}'}
+
+        def prepare():
+            response = client.get(path, **(extra if auth else {}))
+            return {'HTTP_IF_NONE_MATCH': response['ETag']}
+        return prepare
+
+    return [
+        Case('recipes.list.anon', 'GET', '/api/recipes/', auth=False),
+        Case('recipes.list', 'GET', '/api/recipes/'),
+        Case('recipes.list.page', 'GET', '/api/recipes/?page=2&limit=6'),
+        Case('recipes.list.cursor', 'GET', '/api/recipes/?cursor='),
+        Case('recipes.list.author', 'GET', f'/api/recipes/?author={author}'),
+        Case('recipes.list.is_favorited', 'GET',
+             '/api/recipes/?is_favorited=1'),
+        Case('recipes.list.is_in_shopping_cart', 'GET',
+             '/api/recipes/?is_in_shopping_cart=1'),
+        Case('recipes.search.anon', 'GET',
+             f'/api/recipes/?search={fixtures.search_word}', auth=False),
+        Case('recipes.search', 'GET',
+             f'/api/recipes/?search={fixtures.search_word}'),
+        Case('recipes.feed', 'GET', '/api/recipes/feed/'),
+        Case('recipes.feed.cursor', 'GET', '/api/recipes/feed/?cursor='),
+        Case('recipes.detail.anon', 'GET', f'/api/recipes/{recipe}/',
+             auth=False),
+        Case('recipes.detail', 'GET', f'/api/recipes/{recipe}/'),
+        Case('recipes.detail.not_modified', 'GET', f'/api/recipes/{recipe}/',
+             prepare=revalidate(f'/api/recipes/{recipe}/')),
+        Case('recipes.short_link', 'GET',
+             f'/api/recipes/{recipe}/short_link/'),
+        Case('recipes.create', 'POST', '/api/recipes/', data={
+            'name': 'Benchmark album', 'text': 'Benchmark',
+            'cooking_time': 42, 'image': image,
+            'ingredients': ingredients,
+        }),
+        Case('recipes.update', 'PATCH', f'/api/recipes/{own}/', data={
+            'name': 'Benchmark album', 'text': 'Benchmark',
+            'cooking_time': 42, 'image': image,
+            'ingredients': ingredients[::-1],
+        }),
+        Case('recipes.favorite.add', 'POST',
+             f'/api/recipes/{free}/favorite/'),
+        Case('recipes.favorite.remove', 'DELETE',
+             f'/api/recipes/{free}/favorite/',
+             prepare=add(Favorite, recipe_id=free)),
+        Case('recipes.shopping_cart.add', 'POST',
+             f'/api/recipes/{free}/shopping_cart/'),
+        Case('recipes.shopping_cart.remove', 'DELETE',
+             f'/api/recipes/{free}/shopping_cart/',
+             prepare=add(ShoppingCart, recipe_id=free)),
+        Case('recipes.favorite.batch', 'POST',
+             '/api/recipes/favorite/batch/', data=batch_recipes,
+             prepare=add_all(Favorite, 'recipe_id',
+                             batch_recipes['remove'])),
+        Case('recipes.shopping_cart.batch', 'POST',
+             '/api/recipes/shopping_cart/batch/', data=batch_recipes,
+             prepare=add_all(ShoppingCart, 'recipe_id',
+                             batch_recipes['remove'])),
+        Case('recipes.shopping_cart_summary', 'GET',
+             '/api/recipes/shopping_cart_summary/'),
+        Case('recipes.download_shopping_cart.txt', 'GET',
+             '/api/recipes/download_shopping_cart/?format=txt'),
+        Case('recipes.download_shopping_cart.csv', 'GET',
+             '/api/recipes/download_shopping_cart/?format=csv'),
+        Case('recipes.download_shopping_cart.pdf', 'GET',
+             '/api/recipes/download_shopping_cart/?format=pdf'),
+        Case('recipes.download_shopping_cart.async', 'GET',
+             '/api/recipes/download_shopping_cart/?format=pdf&async=true'),
+        Case('jobs.detail', 'GET', f'/api/jobs/{job}/'),
+        Case('jobs.result', 'GET', f'/api/jobs/{job}/result/'),
+        Case('ingredients.list', 'GET', '/api/ingredients/', auth=False),
+        Case('ingredients.list.not_modified', 'GET', '/api/ingredients/',
+             auth=False,
+             prepare=revalidate('/api/ingredients/', auth=False)),
+        Case('ingredients.search', 'GET',
+             f'/api/ingredients/?name={genre_prefix}', auth=False),
+        Case('ingredients.detail', 'GET',
+             f'/api/ingredients/{fixtures.genres[0][0]}/', auth=False),
+        Case('ingredients.detail.not_modified', 'GET',
+             f'/api/ingredients/{fixtures.genres[0][0]}/', auth=False,
+             prepare=revalidate(
+                 f'/api/ingredients/{fixtures.genres[0][0]}/', auth=False
+             )),
+        Case('users.list', 'GET', '/api/users/'),
+        Case('users.detail', 'GET', f'/api/users/{author}/'),
+        Case('users.me', 'GET', '/api/users/me/'),
+        Case('users.me.not_modified', 'GET', '/api/users/me/',
+             prepare=revalidate('/api/users/me/')),
+        Case('users.subscriptions', 'GET',
+             '/api/users/subscriptions/?recipes_limit=3'),
+        Case('users.subscriptions.cursor', 'GET',
+             '/api/users/subscriptions/?cursor=&recipes_limit=3'),
+        Case('users.subscribe', 'POST', f'/api/users/{stranger}/subscribe/'),
+        Case('users.unsubscribe', 'DELETE',
+             f'/api/users/{stranger}/subscribe/',
+             prepare=add(Subscription, author_id=stranger)),
+        Case('users.subscribe.batch', 'POST', '/api/users/subscribe/batch/',
+             data=batch_authors,
+             prepare=add_all(Subscription, 'author_id',
+                             batch_authors['remove'])),
+    ]
+
+
+def response_size(response):
+    """Размер тела ответа, потоковые ответы читаются полностью."""
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def measure(client, case, token, repeat, warmup):
+    """Выполняет запрос repeat раз, каждый раз откатывая изменения."""
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+
+    extra = {'HTTP_AUTHORIZATION': f'Token {token}'} if case.auth else {}
+    if case.data is not None:
+        extra.update(data=json.dumps(case.data),
+                     content_type='application/json')
+    request = getattr(client, case.method.lower())
+    latencies, queries, size, status = [], 0, 0, None
+    for iteration in range(warmup + repeat):
+        try:
+            with transaction.atomic():
+                headers = case.prepare() if case.prepare else None
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = request(case.path, **extra, **(headers or {}))
+                    size = response_size(response)
+                    elapsed = time.perf_counter() - started
+                raise Rollback
+        except Rollback:
+            pass
+        status = response.status_code
+        if iteration >= warmup:
+            latencies.append(elapsed)
+            queries = max(queries, len(captured))
+    latencies.sort()
+    return {
+        'method': case.method,
+        'path': case.path,
+        'status': status,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'queries': queries,
+        'bytes': size,
+    }
+
+
+def record(repeat, warmup, only=None):
+    """Прогоняет все запросы и возвращает результаты."""
+    from django.db import connection, transaction
+    from django.test import Client, override_settings
+
+    results = {}
+    with tempfile.TemporaryDirectory() as media_root:
+        with override_settings(MEDIA_ROOT=media_root):
+            try:
+                with transaction.atomic():
+                    fixtures = Fixtures()
+                    client = Client()
+                    for case in build_cases(fixtures):
+                        if only and not case.name.startswith(only):
+                            continue
+                        results[case.name] = measure(
+                            client, case, fixtures.token, repeat, warmup
+                        )
+                        print(f'{case.name}: {results[case.name]}',
+                              file=sys.stderr)
+                    raise Rollback
+            except Rollback:
+                pass
+    return {
+        'meta': {
+            'vendor': connection.vendor,
+            'repeat': repeat,
+            'warmup': warmup,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, latency_threshold, query_threshold):
+    """
+    Сравнивает текущий прогон с базовым.
+
+    :returns: Список строк с описанием регрессий
+    """
+    regressions = []
+    for name, old in baseline['results'].items():
+        new = current['results'].get(name)
+        if new is None:
+            continue
+        if new['status'] != old['status']:
+            regressions.append(
+                f'{name}: статус {old["status"]} -> {new["status"]}'
+            )
+        if new['queries'] > old['queries'] + query_threshold:
+            regressions.append(
+                f'{name}: запросов {old["queries"]} -> {new["queries"]}'
+            )
+        for metric in ('p50_ms', 'p95_ms'):
+            limit = max(old[metric] * (1 + latency_threshold),
+                        old[metric] + LATENCY_FLOOR_MS)
+            if new[metric] > limit:
+                regressions.append(
+                    f'{name}: {metric} {old[metric]} -> {new[metric]}'
+                )
+    return regressions
+
+
+def main(argv=None):
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser(
+        'record', help='Измерить эндпоинты и сохранить результаты'
+    )
+    record_parser.add_argument('-o', '--output', help='Файл для JSON')
+
+    compare_parser = commands.add_parser(
+        'compare', help='Сравнить с сохранённым базовым прогоном'
+    )
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument(
+        '--current', help='Готовый прогон вместо нового измерения'
+    )
+    compare_parser.add_argument(
+        '--latency-threshold', type=float, default=LATENCY_THRESHOLD,
+        help='Допустимый относительный рост задержки'
+    )
+    compare_parser.add_argument(
+        '--query-threshold', type=int, default=QUERY_THRESHOLD,
+        help='Допустимый рост количества запросов'
+    )
+
+    for command in (record_parser, compare_parser):
+        command.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+        command.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+        command.add_argument('--only', help='Префикс имени эндпоинта')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare' and args.current:
+        with open(args.current) as file:
+            current = json.load(file)
+    else:
+        setup_django()
+        current = record(args.repeat, args.warmup, args.only)
+
+    if args.command == 'record':
+        output = json.dumps(current, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, 'w') as file:
+                file.write(output + '\n')
+        else:
+            print(output)
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(baseline, current, args.latency_threshold,
+                          args.query_threshold)
+    for line in regressions:
+        print(line)
+    if regressions:
+        sys.exit(1)
+    print('Регрессий не найдено')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,16 @@
 PAGE_SIZE = 6
 MAX_PAGE_SIZE = 100
+BATCH_MAX_SIZE = 500
+FEED_LENGTH = 500
+FEED_AUTHOR_LIMIT = 50
+RELATIONS_FILTER_MAX_IDS = 1000
+JOB_NAME_MAX_LENGTH = 64
+JOB_KEY_MAX_LENGTH = 255
+JOB_STATUS_MAX_LENGTH = 16
+JOB_MAX_ATTEMPTS = 3
+JOB_CLAIM_CANDIDATES = 5
+JOB_MAINTENANCE_INTERVAL = 60
+GENRE_IMPORT_FORMATS = ('.csv', '.json')
 INGREDIENT_NAME_MAX_LENGTH = 128
 INGREDIENT_MEASURE_MAX_LENGTH = 64
 EMAIL_MAX_LENGTH = 256
@@ -10,3 +21,20 @@ LAST_NAME_MAX_LENGTH = 150
 RECIPE_NAME_MAX_LENGTH = 256
 RECIPE_MIN_COOKING_TIME = 1
 INGREDIENT_IN_RECIPE_MIN_AMOUNT = 1
+IMAGE_VARIANT_SIZES = {
+    'thumb': 100,
+    'card': 480,
+    'full': 1600,
+}
+IMAGE_VARIANT_FORMATS = {
+    'jpeg': 'jpg',
+    'webp': 'webp',
+}
+IMAGE_VARIANT_QUALITY = 85
+IMAGE_UPLOAD_FORMATS = {
+    'JPEG': 'jpg',
+    'MPO': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
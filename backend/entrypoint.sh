@@ -6,6 +6,7 @@ python prepare_fonts.py
 
 python manage.py makemigrations
 python manage.py migrate
+python manage.py build_image_variants --enqueue
 
 python manage.py collectstatic --noinput
 echo "Создание суперюзера..."
@@ -15,4 +16,4 @@ if [ -f "data/genres.json" ]; then
     python manage.py load_test_data
 fi
 
-gunicorn foodgram.wsgi:application --bind 0.0.0.0:8000
\ No newline at end of file
+gunicorn -c gunicorn.conf.py
\ No newline at end of file
@@ -0,0 +1,33 @@
+"""
+Проверка общего кэша.
+
+Версия кэша ответов, связи пользователей, ленты подписок и версия
+словаря жанров меняются в том процессе, который обработал запись,
+а читаются всеми воркерами gunicorn. Если кэш у каждого процесса свой,
+остальные процессы отдают устаревшие данные до истечения срока ключей.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def require_shared(reason):
+    """
+    Проверяет, что кэши с общим состоянием видны всем процессам.
+
+    :param reason: Почему процессов несколько, для текста ошибки
+    :raises ImproperlyConfigured: Если такой кэш локален для процесса
+    """
+    local = sorted({
+        alias for alias in settings.SHARED_CACHE_ALIASES
+        if settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_BACKENDS
+    })
+    if local:
+        raise ImproperlyConfigured(
+            f'Кэш {", ".join(local)} хранится в памяти процесса, '
+            f'а {reason}. Укажите общий кэш в CACHE_BACKEND, например '
+            f'django_redis.cache.RedisCache.'
+        )
@@ -0,0 +1,280 @@
+"""
+Пул соединений с базой данных внутри процесса.
+
+Пул не зависит от драйвера: соединения создаются переданной функцией,
+поэтому его можно проверить и на SQLite. Мы используем его
+в бэкендах foodgram.db.postgresql и foodgram.db.sqlite3.
+"""
+import threading
+import time
+from collections import deque
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(DatabaseError):
+    """Не удалось получить соединение за отведённое время."""
+
+
+class ConnectionPool:
+    """
+    Пул соединений с ограничением размера и ожиданием.
+
+    :param connect: Функция, открывающая новое соединение
+    :param min_size: Количество соединений, открываемых заранее
+    :param max_size: Максимальное количество постоянных соединений
+    :param max_overflow: Сколько временных соединений можно открыть
+    сверх max_size, вместо ожидания
+    :param timeout: Время ожидания свободного соединения в секундах
+    """
+
+    def __init__(self, connect, min_size=0, max_size=10, max_overflow=0,
+                 timeout=30.0):
+        if max_size < 1 or min_size > max_size:
+            raise ImproperlyConfigured(
+                'Размеры пула должны удовлетворять 0 <= MIN_SIZE <= MAX_SIZE'
+            )
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0
+        self._overflow = set()
+        self._condition = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'overflow': 0,
+            'created': 0,
+            'discarded': 0,
+        }
+
+    def warm(self):
+        """Открывает min_size соединений заранее."""
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            connection = self._open()
+            with self._condition:
+                self._idle.append(connection)
+                self._condition.notify()
+
+    def _open(self):
+        """Открывает соединение, освобождая место при ошибке."""
+        try:
+            connection = self.connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._stats['created'] += 1
+        return connection
+
+    def getconn(self):
+        """
+        Выдаёт соединение из пула.
+
+        :raises PoolTimeout: Если соединение не освободилось за timeout
+        """
+        overflow = False
+        with self._condition:
+            self._stats['checkouts'] += 1
+            deadline = None
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if len(self._overflow) < self.max_overflow:
+                    self._size += 1
+                    overflow = True
+                    self._stats['overflow'] += 1
+                    break
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                    self._stats['waits'] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        'Нет свободных соединений с базой данных'
+                    )
+                self._condition.wait(remaining)
+                self._stats['wait_time'] += min(
+                    time.monotonic() - now, remaining
+                )
+        connection = self._open()
+        if overflow:
+            with self._condition:
+                self._overflow.add(id(connection))
+        return connection
+
+    def putconn(self, connection, discard=False):
+        """
+        Возвращает соединение в пул.
+
+        :param discard: Закрыть соединение вместо возврата
+        """
+        with self._condition:
+            overflow = id(connection) in self._overflow
+            self._overflow.discard(id(connection))
+            if not (discard or overflow):
+                self._idle.append(connection)
+                self._condition.notify()
+                return
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._condition.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Закрывает все свободные соединения."""
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            connection.close()
+
+    def stats(self):
+        """Статистика использования пула."""
+        with self._condition:
+            return dict(
+                self._stats,
+                wait_time=round(self._stats['wait_time'], 4),
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                max_size=self.max_size,
+            )
+
+
+def get_pool(alias, connect, options):
+    """
+    Возвращает пул соединений для алиаса базы данных.
+
+    :param alias: Алиас базы данных
+    :param connect: Функция, открывающая соединение
+    :param options: Словарь POOL из настроек базы данных
+    """
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(
+                connect,
+                min_size=options.get('MIN_SIZE', 0),
+                max_size=options.get('MAX_SIZE', 10),
+                max_overflow=options.get('MAX_OVERFLOW', 0),
+                timeout=options.get('TIMEOUT', 30.0),
+            )
+            pool = _pools[alias]
+        else:
+            return _pools[alias]
+    pool.warm()
+    return pool
+
+
+def pool_stats():
+    """Статистика всех пулов процесса по алиасам баз данных."""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
+
+
+class PooledDatabaseMixin:
+    """
+    Миксин DatabaseWrapper с пулом соединений и проверкой здоровья.
+
+    Настройки в DATABASES:
+        POOL: {'ENABLED', 'MIN_SIZE', 'MAX_SIZE', 'MAX_OVERFLOW',
+        'TIMEOUT'} - пул соединений внутри процесса;
+        CONN_HEALTH_CHECKS: проверять постоянное соединение
+        перед первым использованием в запросе.
+    """
+
+    health_check_done = False
+
+    @property
+    def pool_options(self):
+        """Настройки пула или None, если пул выключен."""
+        options = self.settings_dict.get('POOL') or {}
+        return options if options.get('ENABLED') else None
+
+    def get_new_connection(self, conn_params):
+        """Соединение из пула вместо нового подключения."""
+        if self.pool_options is None:
+            return super().get_new_connection(conn_params)
+        pool = get_pool(
+            self.alias,
+            lambda: super(PooledDatabaseMixin, self).get_new_connection(
+                conn_params
+            ),
+            self.pool_options
+        )
+        self.health_check_done = True
+        connection = pool.getconn()
+        if self.settings_dict.get('CONN_HEALTH_CHECKS'):
+            self.connection = connection
+            usable = self.is_usable()
+            self.connection = None
+            if not usable:
+                pool.putconn(connection, discard=True)
+                connection = pool.getconn()
+        return connection
+
+    def reset_connection(self, connection):
+        """
+        Готовит соединение к возврату в пул.
+
+        По умолчанию откатывает незавершённую транзакцию средствами
+        DB-API: вне транзакции rollback ничего не делает. Бэкенды
+        дополняют сброс состоянием сеанса своей базы данных.
+        Соединение, которое не удалось сбросить, закрывается.
+        """
+        connection.rollback()
+
+    def _close(self):
+        """Возвращает соединение в пул, если пул включён."""
+        if self.pool_options is None or self.connection is None:
+            return super()._close()
+        discard = self.errors_occurred and not self.is_usable()
+        if not discard:
+            try:
+                self.reset_connection(self.connection)
+            except Exception:
+                discard = True
+        get_pool(self.alias, None, self.pool_options).putconn(
+            self.connection, discard=discard
+        )
+
+    def close_if_unusable_or_obsolete(self):
+        """Границы запроса: следующее использование проверит соединение."""
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        """Проверка постоянного соединения перед первым использованием."""
+        if (self.connection is not None
+                and self.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not self.health_check_done
+                and not self.in_atomic_block):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
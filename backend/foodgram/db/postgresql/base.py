@@ -0,0 +1,26 @@
+"""PostgreSQL с пулом соединений и проверкой здоровья."""
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from foodgram.db.pool import PooledDatabaseMixin
+
+
+class DatabaseWrapper(PooledDatabaseMixin, base.DatabaseWrapper):
+    """Бэкенд PostgreSQL с пулом соединений."""
+
+    def reset_connection(self, connection):
+        """
+        Откатывает незавершённую транзакцию и сбрасывает состояние
+        сеанса: параметры SET, временные таблицы, подготовленные
+        запросы и advisory-блокировки.
+
+        DISCARD ALL выполняется вне транзакции, поэтому соединение
+        переводится в autocommit; часовой пояс и режим autocommit
+        Django восстанавливает при следующей выдаче из пула.
+        """
+        status = connection.get_transaction_status()
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('DISCARD ALL')
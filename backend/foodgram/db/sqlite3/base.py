@@ -0,0 +1,8 @@
+"""SQLite с пулом соединений, для локальной проверки настроек пула."""
+from django.db.backends.sqlite3 import base
+
+from foodgram.db.pool import PooledDatabaseMixin
+
+
+class DatabaseWrapper(PooledDatabaseMixin, base.DatabaseWrapper):
+    """Бэкенд SQLite с пулом соединений."""
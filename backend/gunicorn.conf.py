@@ -0,0 +1,71 @@
+"""
+Конфигурация gunicorn.
+
+SERVER_MODE=wsgi - синхронные воркеры (по умолчанию),
+SERVER_MODE=asgi - воркеры uvicorn с асинхронными эндпоинтами чтения.
+"""
+import os
+import shutil
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 3))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+if os.getenv('METRICS_ENABLED', 'true').lower() == 'true':
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+
+def on_starting(server):
+    """
+    Проверяет общий кэш и очищает файлы метрик от предыдущего запуска.
+
+    Каждый воркер gunicorn - отдельный процесс, и воркер задач тоже,
+    поэтому кэш в памяти процесса разойдётся между ними.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    from django.conf import settings
+
+    from foodgram.caches import require_shared
+    if workers > 1:
+        require_shared(f'у gunicorn несколько воркеров ({workers})')
+    elif settings.JOBS_BACKEND != 'sync':
+        require_shared('задачи выполняет отдельный процесс run_worker')
+
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def when_ready(server):
+    """Отдаёт метрики всех воркеров на отдельном порту из мастера."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR') and METRICS_PORT:
+        from prometheus_client import (CollectorRegistry, multiprocess,
+                                       start_http_server)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(METRICS_PORT, registry=registry)
+
+
+def post_worker_init(worker):
+    """Регистрирует воркер в метриках насыщенности."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from api import metrics
+        capacity = (int(os.getenv('ASYNC_VIEW_THREADS', 16))
+                    if os.getenv('SERVER_MODE', 'wsgi') == 'asgi' else 1)
+        metrics.worker_started(capacity)
+
+
+def child_exit(server, worker):
+    """Удаляет живые метрики завершившегося воркера."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
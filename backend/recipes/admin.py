@@ -1,11 +1,15 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db import transaction
+from django.db.models import Count, Q
 from .models import (
     Favorite, ShoppingCart,
-    IngredientInRecipe, Ingredient,
+    IngredientInRecipe, Ingredient, Job,
     Recipe, User, Subscription)
 from django.utils.safestring import mark_safe
 
+from . import autocomplete, cart_totals, images, response_cache, search
+
 
 @admin.register(Favorite, ShoppingCart)
 class FavoriteAndShoppingCartAdmin(admin.ModelAdmin):
@@ -50,6 +54,18 @@ class IngredientAdmin(admin.ModelAdmin):
     search_fields = ('name', 'measurement_unit')
     ordering = ('name',)
 
+    def get_queryset(self, request):
+        """Жанры с количеством альбомов, посчитанным одним запросом."""
+        return super().get_queryset(request).annotate(
+            recipe_count=Count('recipe_ingredients')
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по названию с ранжированием совпадений по префиксу."""
+        if not search_term:
+            return queryset, False
+        return autocomplete.search_queryset(search_term, queryset), False
+
     @admin.display(description='Используется в альбомах')
     def get_recipe_count(self, obj):
         """
@@ -59,7 +75,7 @@ class IngredientAdmin(admin.ModelAdmin):
         :params obj: Объект жанра
         :returns: Количество рецептов с данным жанров
         """
-        return obj.recipe_ingredients.count()
+        return obj.recipe_count
 
 
 @admin.register(IngredientInRecipe)
@@ -105,6 +121,35 @@ class RecipeAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
+        transaction.on_commit(response_cache.bump_version)
+
+    def save_related(self, request, form, formsets, change):
+        old_amounts = (cart_totals.amounts((form.instance.pk,))
+                       if change else {})
+        super().save_related(request, form, formsets, change)
+        search.update_index((form.instance.pk,))
+        if change:
+            cart_totals.recipe_changed(
+                form.instance.pk, old_amounts,
+                cart_totals.amounts((form.instance.pk,))
+            )
+        transaction.on_commit(response_cache.bump_version)
+
+    def delete_model(self, request, obj):
+        with cart_totals.deferred():
+            super().delete_model(request, obj)
+        transaction.on_commit(response_cache.bump_version)
+
+    def delete_queryset(self, request, queryset):
+        with cart_totals.deferred():
+            super().delete_queryset(request, queryset)
+        transaction.on_commit(response_cache.bump_version)
+
+    def get_queryset(self, request):
+        """Альбомы вместе с авторами и жанрами."""
+        return super().get_queryset(request).select_related(
+            'author'
+        ).prefetch_related('recipe_ingredients__ingredient')
 
     @admin.display(description='Жанры')
     def get_ingredients_display(self, obj):
@@ -131,12 +176,27 @@ class RecipeAdmin(admin.ModelAdmin):
         """
         if obj.image:
             return mark_safe(
-                f'<img src="{obj.image.url}" '
+                f'<img src="{images.thumbnail_url(obj, "image")}" '
                 'width="50" height="50" />'
             )
         return 'Нет изображения'
 
-    @admin.display(description='В избранном')
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск по полнотекстовому индексу альбомов
+        и по имени пользователя или почте автора.
+        """
+        by_author, use_distinct = super().get_search_results(
+            request, queryset, search_term
+        )
+        if not search_term.strip():
+            return by_author, use_distinct
+        found = search.search(queryset, search_term)
+        return queryset.filter(
+            Q(pk__in=found.values('pk')) | Q(pk__in=by_author.values('pk'))
+        ), False
+
+    @admin.display(description='В избранном', ordering='favorites_count')
     def get_favorites_count(self, obj):
         """
         Функция, которая подсчитывает количество пользователей,
@@ -145,9 +205,9 @@ class RecipeAdmin(admin.ModelAdmin):
         :param obj: Объект рецепта
         :Returns: Количество пользователей, добавивших рецепт в избранное
         """
-        return obj.favorites.count()
+        return obj.favorites_count
 
-    search_fields = ('name', 'author__username', 'author__email', 'text')
+    search_fields = ('author__username', 'author__email')
     list_filter = ('author', 'created_at', 'cooking_time')
     ordering = ('-created_at',)
     readonly_fields = ('created_at',)
@@ -188,24 +248,28 @@ class UserAdmin(BaseUserAdmin):
         """Отображает аватар пользователя в виде миниатюры"""
         if obj.avatar:
             return mark_safe(
-                f'<img src="{obj.avatar.url}" width="50" height="50" />'
+                f'<img src="{images.thumbnail_url(obj, "avatar")}" '
+                'width="50" height="50" />'
             )
         return 'Нет аватара'
 
-    @admin.display(description='Количество альбомов')
+    @admin.display(description='Количество альбомов',
+                   ordering='recipes_count')
     def get_recipe_count(self, obj):
-        """Подсчитывает количество рецептов пользователя"""
-        return obj.recipes.count()
+        """Количество рецептов пользователя"""
+        return obj.recipes_count
 
-    @admin.display(description='Количество подписок')
+    @admin.display(description='Количество подписок',
+                   ordering='following_count')
     def get_subscriptions_count(self, obj):
-        """Подсчитывает количество подписок пользователя"""
-        return obj.users.count()
+        """Количество подписок пользователя"""
+        return obj.following_count
 
-    @admin.display(description='Количество подписчиков')
+    @admin.display(description='Количество подписчиков',
+                   ordering='followers_count')
     def get_subscribers_count(self, obj):
-        """Подсчитывает количество подписчиков пользователя"""
-        return obj.authors.count()
+        """Количество подписчиков пользователя"""
+        return obj.followers_count
 
     search_fields = ('username', 'email', 'first_name', 'last_name')
     list_filter = ('is_staff', 'is_active', 'date_joined')
@@ -243,7 +307,7 @@ class SubscriptionAdmin(admin.ModelAdmin):
         Returns:
             Количество рецептов автора
         """
-        return obj.author.recipes.count()
+        return obj.author.recipes_count
 
     search_fields = (
         'user__email',
@@ -252,5 +316,27 @@ class SubscriptionAdmin(admin.ModelAdmin):
         'author__username'
     )
     list_filter = ('user', 'author')
+    list_select_related = ('user', 'author')
     ordering = ('-created_at',)
     readonly_fields = ('created_at',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """
+    Класс для просмотра фоновых задач (админ).
+
+    :param list_display: Поля, отображаемые в списке задач
+    :param list_filter: Поля для фильтрации задач
+    :param search_fields: Поля, по которым можно осуществлять поиск
+    :param ordering: Порядок сортировки задач
+    """
+
+    list_display = ('id', 'name', 'status', 'priority', 'attempts', 'user',
+                    'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'key', 'user__username')
+    list_select_related = ('user',)
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at', 'started_at', 'heartbeat_at',
+                       'finished_at')
@@ -6,3 +6,10 @@ class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
     verbose_name = 'Альбомы'
+
+    def ready(self):
+        """Подключение обработчиков сигналов и регистрация задач."""
+        from django.db.models.signals import post_migrate
+
+        from . import search, signals, tasks  # noqa: F401
+        post_migrate.connect(search.ensure_index, sender=self)
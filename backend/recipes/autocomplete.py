@@ -0,0 +1,148 @@
+"""
+Автодополнение жанров.
+
+Словарь жанров меняется редко, поэтому поиск по префиксу выполняется
+в памяти процесса: отсортированный список нормализованных названий
+и bisect. Индекс перестраивается, когда меняется версия словаря
+в кэше (изменение Ingredient или запуск import_genres). По той же
+версии считаются ETag и Last-Modified списка жанров. Версию меняют
+админка, import_genres и воркер задач, поэтому кэш GENRES_CACHE_ALIAS
+должен быть общим для всех процессов (см. foodgram.caches).
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Case, IntegerField, Max, Value, When
+from django.db.models.functions import Lower
+
+from .models import Ingredient
+
+VERSION_KEY = 'ingredients:version'
+PREFIX_END = '\U0010ffff'
+
+
+def normalize(value):
+    """Приводит название жанра к виду, в котором ведётся поиск."""
+    return value.strip().casefold()
+
+
+class GenreIndex:
+    """
+    Отсортированный индекс названий жанров.
+
+    :param genres: Итерируемый набор объектов Ingredient
+    """
+
+    def __init__(self, genres):
+        entries = sorted(
+            ((normalize(genre.name), genre.measurement_unit, genre.pk), genre)
+            for genre in genres
+        )
+        self.keys = [key for (key, _, _), _ in entries]
+        self.genres = [genre for _, genre in entries]
+
+    def search(self, query, limit=None):
+        """
+        Ищет жанры сначала по префиксу, затем по вхождению подстроки.
+
+        :param query: Строка поиска
+        :param limit: Максимальное количество результатов
+        :returns: Список жанров, совпадения по префиксу идут первыми
+        """
+        query = normalize(query)
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + PREFIX_END, start)
+        result = self.genres[start:end]
+        if not query or (limit is not None and len(result) >= limit):
+            return result[:limit]
+        for position, key in enumerate(self.keys):
+            if start <= position < end or query not in key:
+                continue
+            result.append(self.genres[position])
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+
+
+def get_cache():
+    """Возвращает бэкенд кэша, настроенный для версии словаря жанров."""
+    return caches[settings.GENRES_CACHE_ALIAS]
+
+
+def get_version():
+    """
+    Возвращает версию словаря жанров из кэша.
+
+    Версия - время последнего изменения словаря (timestamp), ключ
+    хранится без срока жизни. Если ключа нет, версия берётся
+    из updated_at жанров в базе, чтобы процессы с пустым кэшем
+    получили одно и то же значение.
+    """
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        updated = Ingredient.objects.aggregate(
+            updated=Max('updated_at')
+        )['updated']
+        cache.add(VERSION_KEY, updated.timestamp() if updated else 0, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    """Помечает индекс жанров устаревшим во всех процессах."""
+    get_cache().set(VERSION_KEY, time.time(), None)
+
+
+def get_index(version=None):
+    """
+    Возвращает актуальный индекс жанров, перестраивая его при нужде.
+
+    :param version: Уже полученная версия словаря
+    """
+    global _index, _index_version
+    if version is None:
+        version = get_version()
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index = GenreIndex(Ingredient.objects.only(
+                    'id', 'name', 'measurement_unit'
+                ).order_by())
+                _index_version = version
+    return _index
+
+
+def search(query, limit=None, version=None):
+    """Поиск жанров по индексу в памяти процесса."""
+    return get_index(version).search(query, limit)
+
+
+def search_queryset(query, queryset=None):
+    """
+    Ранжированный поиск жанров средствами базы данных.
+
+    Использует индекс по lower(name): совпадения по префиксу
+    ранжируются выше совпадений по подстроке.
+    """
+    query = normalize(query)
+    queryset = Ingredient.objects.all() if queryset is None else queryset
+    return queryset.annotate(
+        lower_name=Lower('name')
+    ).filter(
+        lower_name__contains=query
+    ).annotate(
+        rank=Case(
+            When(lower_name__startswith=query, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField()
+        )
+    ).order_by('rank', 'lower_name')
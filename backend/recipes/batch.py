@@ -0,0 +1,140 @@
+"""
+Пакетное изменение избранного, корзины и подписок.
+
+Все изменения пакета выполняются в одной транзакции: новые записи
+вставляются одним INSERT с пропуском конфликтов, удаляемые удаляются
+одним запросом. Пакетная вставка не отправляет сигналы, поэтому
+счётчики, итоги корзины, лента подписок и кэш связей для вставленных
+записей обновляются здесь же, пачкой.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import cart_totals, counters, feed, relations
+from .models import ShoppingCart, Subscription
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+MISSING = 'missing'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+
+
+def _sync_added(user, model, objects):
+    """Делает за сигналы то, что нужно для записей из bulk_create."""
+    for counter_model, field, related, fk in counters.COUNTERS:
+        if related is model:
+            for obj in objects:
+                counters.adjust(
+                    counter_model, getattr(obj, f'{fk}_id'), field, 1
+                )
+    if model is ShoppingCart:
+        for obj in objects:
+            cart_totals.cart_changed(user.pk, obj.recipe_id, 1)
+    if model is Subscription and objects:
+        transaction.on_commit(lambda: feed.invalidate(user.pk))
+    target_field = relations.SOURCES[model][1]
+    relations.changed(
+        model, user.pk, [getattr(obj, target_field) for obj in objects], True
+    )
+
+
+def _insert(model, objects, target_field):
+    """
+    Вставляет записи, пропуская уже существующие.
+
+    Запись, которую между чтением и вставкой успел добавить параллельный
+    запрос, пропускается уникальным ограничением (user, объект).
+    INSERT ... ON CONFLICT DO NOTHING RETURNING возвращает только
+    действительно вставленные строки (в SQLite - начиная с 3.35,
+    в более старых версиях считаются вставленными все записи).
+
+    :returns: Множество идентификаторов объектов вставленных записей
+    """
+    if not objects:
+        return set()
+    meta = model._meta
+    target_column = meta.get_field(target_field).column
+    user_id, now = objects[0].user_id, timezone.now()
+    targets = [getattr(obj, target_field) for obj in objects]
+    if connection.vendor == 'postgresql':
+        select = 'SELECT %s, target, %s FROM unnest(%s) AS target'
+        params = [user_id, now, targets]
+    elif (connection.vendor == 'sqlite'
+          and connection.Database.sqlite_version_info >= (3, 35)):
+        select = 'VALUES ' + ', '.join(['(%s, %s, %s)'] * len(targets))
+        params = [value for target in targets
+                  for value in (user_id, target, now)]
+    else:
+        model.objects.bulk_create(objects, ignore_conflicts=True)
+        return set(targets)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {meta.db_table} '
+            f'(user_id, {target_column}, created_at) {select} '
+            f'ON CONFLICT DO NOTHING RETURNING {target_column}',
+            params
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def apply(user, model, field, targets, add=(), remove=(), forbidden=()):
+    """
+    Добавляет и удаляет связи пользователя с объектами.
+
+    :param user: Пользователь, чьи связи меняются
+    :param model: Модель связи (Favorite, ShoppingCart, Subscription)
+    :param field: Поле связи с объектом ('recipe' или 'author')
+    :param targets: Queryset объектов, на которые можно ссылаться
+    :param add: Идентификаторы для добавления
+    :param remove: Идентификаторы для удаления
+    :param forbidden: Идентификаторы, которые добавлять нельзя
+    :returns: Список словарей {'id', 'action', 'status'} в порядке запроса
+    """
+    add, remove = list(dict.fromkeys(add)), list(dict.fromkeys(remove))
+    target_field = f'{field}_id'
+    with transaction.atomic(), counters.deferred(), cart_totals.deferred():
+        found = set(targets.filter(
+            pk__in=set(add) | set(remove)
+        ).values_list('pk', flat=True))
+        present = set(model.objects.filter(
+            user=user, **{f'{target_field}__in': found}
+        ).values_list(target_field, flat=True))
+
+        added = [
+            model(user=user, **{target_field: pk}) for pk in add
+            if pk in found and pk not in present and pk not in forbidden
+        ]
+        removed = [pk for pk in remove if pk in present]
+        if model is ShoppingCart:
+            cart_totals.preload(
+                [obj.recipe_id for obj in added] + removed
+            )
+
+        inserted = _insert(model, added, target_field)
+        added = [
+            obj for obj in added if getattr(obj, target_field) in inserted
+        ]
+        _sync_added(user, model, added)
+        if removed:
+            model.objects.filter(
+                user=user, **{f'{target_field}__in': removed}
+            ).delete()
+
+    results = []
+    for pk in add:
+        if pk not in found:
+            status = NOT_FOUND
+        elif pk in forbidden:
+            status = FORBIDDEN
+        else:
+            status = ADDED if pk in inserted else EXISTS
+        results.append({'id': pk, 'action': 'add', 'status': status})
+    for pk in remove:
+        if pk not in found:
+            status = NOT_FOUND
+        else:
+            status = REMOVED if pk in present else MISSING
+        results.append({'id': pk, 'action': 'remove', 'status': status})
+    return results
@@ -0,0 +1,215 @@
+"""
+Итоги корзин покупок по жанрам.
+
+ShoppingCartTotal хранит сумму количеств жанра по всем альбомам
+в корзине пользователя. Итоги меняются на разницу при добавлении
+и удалении альбома из корзины и при изменении жанров альбома,
+поэтому выгрузка списка покупок читает готовые суммы одним запросом.
+Внутри deferred() изменения копятся и применяются пачкой.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+
+from .models import IngredientInRecipe, ShoppingCart, ShoppingCartTotal
+
+BATCH_SIZE = 1000
+
+_state = threading.local()
+
+
+def amounts(recipe_ids):
+    """
+    Суммарные количества жанров в альбомах.
+
+    :returns: Словарь {ingredient_id: amount}
+    """
+    totals = defaultdict(int)
+    for ingredient_id, amount in IngredientInRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('ingredient_id', 'amount'):
+        totals[ingredient_id] += amount
+    return dict(totals)
+
+
+def diff(old, new):
+    """Разница количеств new - old по жанрам, без нулевых значений."""
+    return {
+        pk: new.get(pk, 0) - old.get(pk, 0)
+        for pk in old.keys() | new.keys()
+        if new.get(pk, 0) != old.get(pk, 0)
+    }
+
+
+def _scale(totals, sign):
+    """Количества жанров, умноженные на sign."""
+    return {pk: amount * sign for pk, amount in totals.items()}
+
+
+def apply(user_ids, deltas):
+    """
+    Изменяет итоги корзин пользователей на deltas.
+
+    Недостающие строки сначала создаются с нулём, затем итоги
+    увеличиваются через F-выражения, поэтому параллельные изменения
+    не теряются. Строки с нулевым итогом удаляются.
+
+    :param user_ids: Идентификаторы владельцев корзин
+    :param deltas: Словарь {ingredient_id: приращение}
+    """
+    user_ids = list(user_ids)
+    if not deltas:
+        return
+    by_delta = defaultdict(list)
+    for ingredient_id, delta in deltas.items():
+        by_delta[delta].append(ingredient_id)
+    added = [pk for pk, delta in deltas.items() if delta > 0]
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        users = user_ids[start:start + BATCH_SIZE]
+        if added:
+            ShoppingCartTotal.objects.bulk_create(
+                [ShoppingCartTotal(user_id=user_id, ingredient_id=pk)
+                 for user_id in users for pk in added],
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True
+            )
+        for delta, ingredient_ids in by_delta.items():
+            ShoppingCartTotal.objects.filter(
+                user_id__in=users, ingredient_id__in=ingredient_ids
+            ).update(total_amount=Greatest(F('total_amount') + delta, 0))
+        ShoppingCartTotal.objects.filter(
+            user_id__in=users, ingredient_id__in=deltas, total_amount=0
+        ).delete()
+
+
+def preload(recipe_ids):
+    """
+    Загружает количества жанров альбомов одним запросом.
+
+    Вне deferred() ничего не делает.
+    """
+    loaded = getattr(_state, 'amounts', None)
+    if loaded is None:
+        return
+    missing = set(recipe_ids) - loaded.keys()
+    if not missing:
+        return
+    for recipe_id in missing:
+        loaded[recipe_id] = defaultdict(int)
+    for recipe_id, ingredient_id, amount in IngredientInRecipe.objects.filter(
+        recipe_id__in=missing
+    ).values_list('recipe_id', 'ingredient_id', 'amount'):
+        loaded[recipe_id][ingredient_id] += amount
+
+
+def cart_changed(user_id, recipe_id, sign):
+    """
+    Учитывает добавление (sign=1) или удаление (sign=-1) альбома.
+
+    Количества жанров читаются сразу: при каскадном удалении альбома
+    к моменту применения его жанров уже нет.
+    """
+    pending = getattr(_state, 'pending', None)
+    if pending is None:
+        apply((user_id,), _scale(amounts((recipe_id,)), sign))
+        return
+    preload((recipe_id,))
+    pending[user_id][recipe_id] += sign
+
+
+def recipe_changed(recipe_id, old, new):
+    """
+    Переносит изменение жанров альбома в корзины с этим альбомом.
+
+    :param old: Количества жанров до изменения
+    :param new: Количества жанров после изменения
+    """
+    deltas = diff(old, new)
+    if deltas:
+        apply(ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True), deltas)
+
+
+@contextmanager
+def deferred():
+    """
+    Накапливает изменения корзин и применяет их при выходе.
+
+    Изменения каждого пользователя складываются, пользователи
+    с одинаковой разницей обновляются вместе.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        yield
+        return
+    _state.pending = defaultdict(lambda: defaultdict(int))
+    _state.amounts = {}
+    try:
+        yield
+        pending, recipe_amounts = _state.pending, _state.amounts
+    finally:
+        _state.pending = _state.amounts = None
+    by_deltas = defaultdict(list)
+    for user_id, recipes in pending.items():
+        deltas = defaultdict(int)
+        for recipe_id, sign in recipes.items():
+            for ingredient_id, amount in recipe_amounts[recipe_id].items():
+                deltas[ingredient_id] += amount * sign
+        key = tuple(sorted(
+            (pk, delta) for pk, delta in deltas.items() if delta
+        ))
+        if key:
+            by_deltas[key].append(user_id)
+    for deltas, user_ids in by_deltas.items():
+        apply(user_ids, dict(deltas))
+
+
+def _expected():
+    """Итоги корзин, посчитанные заново по корзинам и альбомам."""
+    return IngredientInRecipe.objects.filter(
+        recipe__shoppingcarts__isnull=False
+    ).values_list(
+        'recipe__shoppingcarts__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+
+
+def check():
+    """
+    Сравнивает итоги с фактическими корзинами.
+
+    :returns: Количество расходящихся пар (пользователь, жанр)
+    """
+    actual = {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in
+        ShoppingCartTotal.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount'
+        ).iterator()
+    }
+    drifted = 0
+    for user_id, ingredient_id, total in _expected().iterator():
+        if actual.pop((user_id, ingredient_id), None) != total:
+            drifted += 1
+    return drifted + len(actual)
+
+
+def rebuild():
+    """
+    Пересоздаёт таблицу итогов с нуля.
+
+    :returns: Количество созданных строк
+    """
+    ShoppingCartTotal.objects.all().delete()
+    created, batch = 0, []
+    for user_id, ingredient_id, total in _expected().iterator():
+        batch.append(ShoppingCartTotal(
+            user_id=user_id, ingredient_id=ingredient_id, total_amount=total
+        ))
+        if len(batch) >= BATCH_SIZE:
+            created += len(ShoppingCartTotal.objects.bulk_create(batch))
+            batch = []
+    created += len(ShoppingCartTotal.objects.bulk_create(batch))
+    return created
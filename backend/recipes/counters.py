@@ -0,0 +1,101 @@
+"""
+Денормализованные счётчики избранного, корзин, подписок и альбомов.
+
+Счётчики обновляются атомарно через F-выражения. Внутри deferred()
+изменения накапливаются и применяются пачкой, по одному UPDATE
+на каждое значение приращения.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Favorite, Recipe, ShoppingCart, Subscription, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+    (User, 'following_count', Subscription, 'user'),
+)
+
+_state = threading.local()
+
+
+def _apply(model, pks, field, delta):
+    """Изменяет счётчик у набора объектов одним запросом."""
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def adjust(model, pk, field, delta):
+    """
+    Изменяет счётчик объекта на delta.
+
+    :param model: Модель со счётчиком
+    :param pk: Первичный ключ объекта
+    :param field: Имя поля счётчика
+    :param delta: Приращение
+    """
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending[(model, field)][pk] += delta
+        return
+    _apply(model, (pk,), field, delta)
+
+
+@contextmanager
+def deferred():
+    """Накапливает изменения счётчиков и применяет их при выходе."""
+    if getattr(_state, 'pending', None) is not None:
+        yield
+        return
+    _state.pending = defaultdict(lambda: defaultdict(int))
+    try:
+        yield
+        pending = _state.pending
+    finally:
+        _state.pending = None
+    for (model, field), deltas in pending.items():
+        by_delta = defaultdict(list)
+        for pk, delta in deltas.items():
+            if delta:
+                by_delta[delta].append(pk)
+        for delta, pks in by_delta.items():
+            _apply(model, pks, field, delta)
+
+
+def _actual(related, fk):
+    """Подзапрос с фактическим количеством связанных записей."""
+    return Coalesce(
+        Subquery(
+            related.objects.filter(
+                **{fk: OuterRef('pk')}
+            ).order_by().values(fk).annotate(
+                total=Count('pk')
+            ).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def recount():
+    """
+    Пересчитывает все счётчики по фактическим данным.
+
+    :returns: Словарь с количеством исправленных записей по счётчикам
+    """
+    repaired = {}
+    for model, field, related, fk in COUNTERS:
+        drifted = model.objects.annotate(
+            actual=_actual(related, fk)
+        ).exclude(**{field: F('actual')}).values_list('pk', flat=True)
+        repaired[f'{model.__name__}.{field}'] = model.objects.filter(
+            pk__in=drifted
+        ).update(**{field: _actual(related, fk)})
+    return repaired
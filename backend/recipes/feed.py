@@ -0,0 +1,226 @@
+"""
+Лента альбомов авторов, на которых подписан пользователь.
+
+Лента пользователя хранится в кэше как список позиций
+(created_at в микросекундах, id) от новых к старым длиной не более
+FEED_LENGTH. Если ленты нет в кэше, она собирается слиянием последних
+альбомов каждого автора (не более FEED_AUTHOR_LIMIT на автора).
+При публикации альбома позиция добавляется в закэшированные ленты
+подписчиков, при удалении - убирается из них; обход подписчиков
+выполняет фоновая задача (recipes.jobs), а не запрос автора. Задача
+идёт в воркере задач, а ленты читают воркеры gunicorn, поэтому кэш
+FEED_CACHE_ALIAS должен быть общим (см. foodgram.caches).
+Страницы дальше закэшированной части читаются из базы по индексу
+(author, created_at).
+"""
+import heapq
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+import constants
+
+from . import jobs
+from .models import Recipe, Subscription
+from .queries import latest_by_author
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+FANOUT_BATCH_SIZE = 500
+FANOUT_TASK_NAME = 'feed_fan_out'
+
+
+def get_cache():
+    """Возвращает бэкенд кэша, настроенный для лент."""
+    return caches[settings.FEED_CACHE_ALIAS]
+
+
+def make_key(user_id):
+    return f'feed:{user_id}'
+
+
+def to_position(created_at, pk):
+    """Позиция альбома в ленте: (микросекунды от эпохи, id)."""
+    return ((created_at - EPOCH) // MICROSECOND, pk)
+
+
+def from_timestamp(timestamp):
+    """Момент времени по числу микросекунд от эпохи."""
+    return EPOCH + timestamp * MICROSECOND
+
+
+def build(user_id):
+    """
+    Собирает ленту слиянием последних альбомов каждого автора.
+
+    Если у автора загружено ровно FEED_AUTHOR_LIMIT альбомов, более
+    старые его альбомы в слияние не попали, поэтому лента обрезается
+    по самому новому из последних загруженных альбомов таких авторов.
+
+    :returns: Пара (complete, positions); complete - лента содержит
+        все альбомы подписок
+    """
+    author_ids = Subscription.objects.filter(
+        user_id=user_id
+    ).values_list('author_id', flat=True)
+    recipes = latest_by_author(author_ids, constants.FEED_AUTHOR_LIMIT)
+    by_author = [
+        [to_position(recipe.created_at, recipe.pk) for recipe in items]
+        for items in recipes.values()
+    ]
+    cutoff = max((
+        positions[-1] for positions in by_author
+        if len(positions) >= constants.FEED_AUTHOR_LIMIT
+    ), default=None)
+    positions = []
+    for position in heapq.merge(*by_author, reverse=True):
+        if cutoff is not None and position < cutoff:
+            break
+        if len(positions) == constants.FEED_LENGTH:
+            return False, positions
+        positions.append(position)
+    return cutoff is None, positions
+
+
+def get(user_id):
+    """Лента пользователя из кэша; при промахе собирается и кэшируется."""
+    cache = get_cache()
+    key = make_key(user_id)
+    feed = cache.get(key)
+    if feed is None:
+        feed = build(user_id)
+        cache.set(key, feed, settings.FEED_CACHE_TIMEOUT)
+    return feed
+
+
+def _query(user_id, before, limit):
+    """Позиции альбомов подписок старше before из базы."""
+    queryset = Recipe.objects.filter(author_id__in=Subscription.objects.filter(
+        user_id=user_id
+    ).values('author_id'))
+    if before is not None:
+        created_at, pk = from_timestamp(before[0]), before[1]
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+        )
+    return [
+        to_position(created_at, pk) for created_at, pk in queryset.order_by(
+            '-created_at', '-id'
+        ).values_list('created_at', 'id')[:limit]
+    ]
+
+
+def page(user_id, before, limit):
+    """
+    Позиции страницы ленты.
+
+    :param before: Позиция последнего альбома предыдущей страницы
+        или None для первой страницы
+    :param limit: Количество позиций
+    :returns: Список позиций от новых к старым
+    """
+    complete, positions = get(user_id)
+    start = 0
+    if before is not None:
+        start = bisect_right(
+            [(-timestamp, -pk) for timestamp, pk in positions],
+            (-before[0], -before[1])
+        )
+    result = positions[start:start + limit]
+    if len(result) < limit and not complete:
+        result += _query(
+            user_id, result[-1] if result else before, limit - len(result)
+        )
+    return result
+
+
+def _fan_out(author_id, change):
+    """
+    Применяет change к закэшированным лентам подписчиков автора.
+
+    Ленты, которых нет в кэше, не трогаются: они соберутся при чтении.
+    Запись в кэш не атомарна, поэтому одновременные публикации могут
+    потерять позицию; такие расхождения живут не дольше
+    FEED_CACHE_TIMEOUT.
+
+    :returns: Количество обновлённых лент
+    """
+    cache = get_cache()
+    follower_ids = Subscription.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True).iterator()
+    updated = 0
+    batch = []
+    for follower_id in follower_ids:
+        batch.append(make_key(follower_id))
+        if len(batch) >= FANOUT_BATCH_SIZE:
+            updated += _update_many(cache, batch, change)
+            batch = []
+    return updated + _update_many(cache, batch, change)
+
+
+def _update_many(cache, keys, change):
+    feeds = cache.get_many(keys)
+    if feeds:
+        cache.set_many(
+            {key: change(*feed) for key, feed in feeds.items()},
+            settings.FEED_CACHE_TIMEOUT
+        )
+    return len(feeds)
+
+
+def _insert(position, complete, positions):
+    """Лента с добавленной позицией."""
+    if not complete and positions and position < positions[-1]:
+        return complete, positions
+    positions = sorted({*positions, position}, reverse=True)
+    if len(positions) > constants.FEED_LENGTH:
+        return False, positions[:constants.FEED_LENGTH]
+    return complete, positions
+
+
+def _remove(position, complete, positions):
+    """Лента без позиции."""
+    return complete, [item for item in positions if item != position]
+
+
+CHANGES = {
+    'published': _insert,
+    'removed': _remove,
+}
+
+
+@jobs.task(FANOUT_TASK_NAME, priority=8)
+def fan_out(job):
+    """Задача очереди: применяет изменение к лентам подписчиков автора."""
+    change = CHANGES[job.payload['change']]
+    position = tuple(job.payload['position'])
+    return {'updated': _fan_out(job.payload['author'],
+                                partial(change, position))}
+
+
+def _enqueue(recipe, change):
+    return jobs.enqueue(FANOUT_TASK_NAME, {
+        'author': recipe.author_id,
+        'change': change,
+        'position': to_position(recipe.created_at, recipe.pk),
+    })
+
+
+def published(recipe):
+    """Ставит добавление альбома в ленты подписчиков автора."""
+    return _enqueue(recipe, 'published')
+
+
+def removed(recipe):
+    """Ставит удаление альбома из лент подписчиков автора."""
+    return _enqueue(recipe, 'removed')
+
+
+def invalidate(user_id):
+    """Сбрасывает ленту пользователя после изменения его подписок."""
+    get_cache().delete(make_key(user_id))
@@ -0,0 +1,188 @@
+"""
+Производные изображения альбомов и аватаров.
+
+Для каждого загруженного изображения строятся уменьшенные копии
+(thumb, card, full) в форматах JPEG и WebP с именами на основе хэша
+содержимого. Генерация ставится фоновой задачей (recipes.jobs) после
+фиксации транзакции, в которой сохранено изображение; для старых
+изображений задачи ставит manage.py build_image_variants --enqueue.
+Чтение производных ничего не ставит в очередь и не обращается к базе.
+"""
+import hashlib
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+import constants
+
+from . import jobs, response_cache, snapshots
+
+VARIANT_FIELDS = {
+    'image': 'image_variants',
+    'avatar': 'avatar_variants',
+}
+HASH_CHUNK_SIZE = 64 * 1024
+DERIVATIVES_DIR = 'derivatives'
+TASK_NAME = 'image_variants'
+
+
+def _content_hash(name, storage):
+    """Хэш содержимого исходного файла."""
+    digest = hashlib.sha1()
+    with storage.open(name, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+
+def _encode(image, image_format):
+    """Кодирует изображение в заданный формат."""
+    if image.mode not in ('RGB', 'L'):
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.convert('RGBA').split()[-1])
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, image_format.upper(),
+               quality=constants.IMAGE_VARIANT_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def build_variants(name, storage=default_storage):
+    """
+    Строит производные изображения для файла.
+
+    :param name: Имя исходного файла в хранилище
+    :returns: Словарь вида {'source': name,
+    'thumb': {'jpeg': путь, 'webp': путь}, ...}
+    """
+    digest = _content_hash(name, storage)
+    with storage.open(name, 'rb') as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+
+    variants = {'source': name}
+    for variant, size in constants.IMAGE_VARIANT_SIZES.items():
+        image = original.copy()
+        image.thumbnail((size, size))
+        variants[variant] = {}
+        for image_format, extension in (
+            constants.IMAGE_VARIANT_FORMATS.items()
+        ):
+            path = f'{DERIVATIVES_DIR}/{digest[:2]}/{digest}-{variant}.' \
+                   f'{extension}'
+            if not storage.exists(path):
+                storage.save(path, ContentFile(_encode(image, image_format)))
+            variants[variant][image_format] = path
+    return variants
+
+
+def is_stale(instance, field):
+    """Проверяет, что производные не соответствуют текущему файлу."""
+    image = getattr(instance, field)
+    variants = getattr(instance, VARIANT_FIELDS[field]) or {}
+    return bool(image) and variants.get('source') != image.name
+
+
+def generate(model, pk, field):
+    """
+    Строит производные и сохраняет их в объект.
+
+    Запись выполняется, только если файл за это время не сменился.
+
+    :returns: Количество обновлённых записей
+    """
+    name = model.objects.filter(pk=pk).values_list(field, flat=True).first()
+    if not name:
+        return 0
+    return model.objects.filter(pk=pk, **{field: name}).update(
+        updated_at=timezone.now(),
+        **{VARIANT_FIELDS[field]: build_variants(name)}
+    )
+
+
+def refresh(model, pk, field):
+    """
+    Строит производные и сбрасывает представления и кэш ответов.
+
+    :returns: Количество обновлённых записей
+    """
+    updated = generate(model, pk, field)
+    if updated:
+        if field == 'image':
+            snapshots.invalidate((pk,))
+        else:
+            snapshots.invalidate_author(pk)
+        response_cache.bump_version()
+    return updated
+
+
+@jobs.task(TASK_NAME, priority=10)
+def run(job):
+    """Задача очереди: строит производные и сбрасывает кэши."""
+    model = apps.get_model(job.payload['model'])
+    return {'updated': refresh(
+        model, job.payload['pk'], job.payload['field']
+    )}
+
+
+def enqueue(model, pk, field, name):
+    """
+    Ставит генерацию производных файла name.
+
+    Пока задача для того же файла ждёт выполнения, новая не ставится.
+    """
+    label = model._meta.label_lower
+    return jobs.enqueue(
+        TASK_NAME,
+        {'model': label, 'pk': pk, 'field': field},
+        key=f'{TASK_NAME}:{label}:{pk}:{name}'
+    )
+
+
+def schedule(instance, field):
+    """
+    Ставит генерацию производных в очередь после коммита.
+
+    Вызывается при сохранении объекта; повторные вызовы для того же
+    файла ставят одну задачу за счёт ключа задачи в enqueue.
+    """
+    model, pk = type(instance), instance.pk
+    name = getattr(instance, field).name
+    transaction.on_commit(lambda: enqueue(model, pk, field, name))
+
+
+def variant_urls(instance, field, request=None):
+    """
+    Ссылки на производные изображения.
+
+    Если производных ещё нет, возвращает None.
+    """
+    if not getattr(instance, field) or is_stale(instance, field):
+        return None
+    variants = getattr(instance, VARIANT_FIELDS[field])
+    urls = {}
+    for variant in constants.IMAGE_VARIANT_SIZES:
+        urls[variant] = {}
+        for image_format, path in variants[variant].items():
+            url = default_storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[variant][image_format] = url
+    return urls
+
+
+def thumbnail_url(instance, field):
+    """Ссылка на миниатюру JPEG или на исходный файл."""
+    image = getattr(instance, field)
+    if not image:
+        return None
+    if is_stale(instance, field):
+        return image.url
+    return default_storage.url(
+        getattr(instance, VARIANT_FIELDS[field])['thumb']['jpeg']
+    )
@@ -0,0 +1,261 @@
+"""
+Фоновые задачи.
+
+Очередь хранится в таблице Job. Задача ставится в той же транзакции,
+что и данные, из которых она появилась, поэтому после отката в очереди
+ничего не остаётся. Воркеры (manage.py run_worker) забирают задачи по
+приоритету: на PostgreSQL через SELECT ... FOR UPDATE SKIP LOCKED,
+на остальных базах - условным UPDATE по состоянию. Неудачная попытка
+повторяется с экспоненциальной задержкой до max_attempts раз. Пока
+задача выполняется, воркер раз в JOBS_HEARTBEAT_INTERVAL секунд
+обновляет её heartbeat_at; задачи без отметки дольше
+JOBS_STALE_TIMEOUT (упавший воркер) возвращаются в очередь.
+
+При JOBS_BACKEND = 'database' задачи выполняет воркер, при 'sync'
+задача выполняется в том же процессе сразу после фиксации транзакции,
+в которой поставлена, - так работают тесты и локальная разработка без
+отдельного воркера. Упавшая задача не откатывает данные вызывающего.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+import constants
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+SYNC = 'sync'
+
+TASKS = {}
+
+
+def task(name, priority=0, max_attempts=constants.JOB_MAX_ATTEMPTS):
+    """
+    Регистрирует функцию как задачу.
+
+    Функция получает объект Job и возвращает JSON-совместимый
+    результат; файл результата она сохраняет в job.result_file
+    без записи в базу.
+
+    :param name: Имя задачи в очереди
+    :param priority: Приоритет по умолчанию
+    :param max_attempts: Допустимое количество попыток
+    """
+    def register(func):
+        TASKS[name] = (func, priority, max_attempts)
+        return func
+    return register
+
+
+def enqueue(name, payload=None, user=None, key='', priority=None):
+    """
+    Ставит задачу в очередь.
+
+    :param name: Имя зарегистрированной задачи
+    :param payload: Аргументы задачи
+    :param user: Пользователь, которому принадлежит результат
+    :param key: Если задача с таким ключом уже ждёт выполнения,
+    новая не ставится и возвращается существующая
+    :param priority: Приоритет вместо заданного при регистрации
+    :returns: Объект Job
+    """
+    _, default_priority, max_attempts = TASKS[name]
+    if key:
+        job = Job.objects.filter(
+            key=key, status__in=(Job.QUEUED, Job.RUNNING)
+        ).first()
+        if job is not None:
+            return job
+    job = Job.objects.create(
+        name=name,
+        key=key,
+        payload=payload or {},
+        user=user,
+        priority=default_priority if priority is None else priority,
+        max_attempts=max_attempts,
+    )
+    if settings.JOBS_BACKEND == SYNC:
+        transaction.on_commit(partial(run_now, job))
+    return job
+
+
+def _start(job):
+    """Переводит задачу в работу; False, если её забрал другой воркер."""
+    now = timezone.now()
+    started = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+        status=Job.RUNNING,
+        attempts=F('attempts') + 1,
+        started_at=now,
+        heartbeat_at=now,
+    )
+    if started:
+        job.refresh_from_db()
+    return bool(started)
+
+
+def claim():
+    """
+    Забирает следующую задачу из очереди.
+
+    :returns: Объект Job в состоянии running или None
+    """
+    queue = Job.objects.filter(
+        status=Job.QUEUED, run_after__lte=timezone.now()
+    ).order_by('-priority', 'run_after', 'id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            queue = queue.select_for_update(skip_locked=True)
+        for job in queue[:constants.JOB_CLAIM_CANDIDATES]:
+            if _start(job):
+                return job
+    return None
+
+
+@contextmanager
+def heartbeat(job):
+    """
+    Обновляет heartbeat_at задачи из отдельного потока, пока она идёт.
+
+    Без отметок долгая задача считалась бы зависшей и через
+    JOBS_STALE_TIMEOUT досталась бы второму воркеру.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.JOBS_HEARTBEAT_INTERVAL):
+                try:
+                    Job.objects.filter(
+                        pk=job.pk, status=Job.RUNNING
+                    ).update(heartbeat_at=timezone.now())
+                except Exception:
+                    logger.exception('Не удалось отметить задачу #%s',
+                                     job.pk)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(
+        target=beat, name=f'job-heartbeat-{job.pk}', daemon=True
+    )
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def execute(job):
+    """
+    Выполняет начатую задачу и сохраняет результат.
+
+    При ошибке задача возвращается в очередь с задержкой
+    JOBS_RETRY_DELAY * 2 ** (попытка - 1) или, если попытки
+    кончились, помечается проваленной.
+
+    :returns: True, если задача выполнена
+    """
+    try:
+        if job.name not in TASKS:
+            raise LookupError(f'Задача {job.name} не зарегистрирована')
+        with heartbeat(job):
+            result = TASKS[job.name][0](job)
+    except Exception as error:
+        logger.exception('Задача %s #%s завершилась ошибкой',
+                         job.name, job.pk)
+        retry = job.attempts < job.max_attempts
+        job.status = Job.QUEUED if retry else Job.FAILED
+        job.error = str(error) or repr(error)
+        job.run_after = timezone.now() + timedelta(
+            seconds=settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+        )
+        job.finished_at = None if retry else timezone.now()
+        job.save(update_fields=('status', 'error', 'run_after',
+                                'finished_at'))
+        return False
+    job.status = Job.DONE
+    job.result = result
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=('status', 'result', 'result_file', 'error',
+                            'finished_at'))
+    return True
+
+
+def run_now(job):
+    """Выполняет задачу в текущем процессе, повторяя без задержек."""
+    while _start(job):
+        if execute(job):
+            return
+
+
+def requeue_stale():
+    """
+    Возвращает в очередь задачи, воркер которых перестал их отмечать.
+
+    :returns: Количество возвращённых задач
+    """
+    return Job.objects.filter(
+        status=Job.RUNNING,
+        heartbeat_at__lt=timezone.now() - timedelta(
+            seconds=settings.JOBS_STALE_TIMEOUT
+        ),
+    ).update(status=Job.QUEUED, run_after=timezone.now())
+
+
+def purge():
+    """
+    Удаляет завершённые задачи старше JOBS_RESULT_TTL вместе с файлами.
+
+    :returns: Количество удалённых задач
+    """
+    expired = Job.objects.filter(
+        status__in=(Job.DONE, Job.FAILED),
+        finished_at__lt=timezone.now() - timedelta(
+            seconds=settings.JOBS_RESULT_TTL
+        ),
+    )
+    for job in expired.only('result_file', 'payload').iterator():
+        if job.result_file:
+            job.result_file.delete(save=False)
+        upload = job.payload.get('upload')
+        if upload:
+            default_storage.delete(upload)
+    return expired.delete()[0]
+
+
+def work(stop, once=False):
+    """
+    Цикл воркера: забирает и выполняет задачи, пока не выставлен stop.
+
+    :param stop: Событие остановки (threading или multiprocessing)
+    :param once: Выйти, когда очередь опустеет
+    """
+    maintained = 0
+    while not stop.is_set():
+        close_old_connections()
+        if time.monotonic() - maintained >= (
+            constants.JOB_MAINTENANCE_INTERVAL
+        ):
+            maintained = time.monotonic()
+            requeue_stale()
+            purge()
+        job = claim()
+        if job is not None:
+            execute(job)
+        elif once:
+            break
+        else:
+            stop.wait(settings.JOBS_POLL_INTERVAL)
+    close_old_connections()
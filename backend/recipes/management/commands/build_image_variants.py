@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recipes import images
+from recipes.models import Recipe, User
+
+
+class Command(BaseCommand):
+    """Класс, в котором описана команда построения производных
+    изображений для manage.py"""
+    help = 'Строит уменьшенные копии картинок альбомов и аватаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Перестроить производные, даже если они уже есть'
+        )
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Поставить генерацию фоновыми задачами'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Количество потоков'
+        )
+
+    def handle(self, *args, **options):
+        """Функция handler."""
+        for model, field in ((Recipe, 'image'), (User, 'avatar')):
+            tasks = [
+                (obj.pk, getattr(obj, field).name)
+                for obj in model.objects.exclude(
+                    **{field: ''}
+                ).exclude(**{f'{field}__isnull': True}).only(
+                    'pk', field, images.VARIANT_FIELDS[field]
+                ).iterator()
+                if options['force'] or images.is_stale(obj, field)
+            ]
+            if options['enqueue']:
+                for pk, name in tasks:
+                    images.enqueue(model, pk, field, name)
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}: '
+                    f'поставлено задач {len(tasks)}'
+                )
+                continue
+            if options['workers'] > 1:
+                with ThreadPoolExecutor(options['workers']) as executor:
+                    results = list(executor.map(
+                        lambda task: self.build(model, task[0], field), tasks
+                    ))
+            else:
+                results = [self.build(model, pk, field) for pk, _ in tasks]
+            failed = results.count(False)
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: '
+                f'обработано {len(tasks)}, ошибок {failed}'
+            )
+        if options['enqueue']:
+            self.stdout.write(self.style.SUCCESS('Задачи поставлены'))
+            return
+        self.stdout.write(self.style.SUCCESS('Производные построены'))
+
+    def build(self, model, pk, field):
+        """Строит производные одного объекта в потоке пула."""
+        try:
+            images.refresh(model, pk, field)
+            return True
+        except Exception as error:
+            self.stderr.write(f'{model.__name__} {pk}: {error}')
+            return False
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
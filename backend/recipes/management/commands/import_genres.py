@@ -1,11 +1,175 @@
 import csv
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
 
+from recipes import autocomplete
 from recipes.models import Ingredient
 
+JSON_CHUNK_SIZE = 64 * 1024
+JSON_MAX_ITEM_SIZE = 1024 * 1024
+COPY_SQL = (
+    'CREATE TEMP TABLE genres_import (name text, measurement_unit text) '
+    'ON COMMIT DROP'
+)
+
+
+def iter_csv(file):
+    """Построчно читает пары (название, единица измерения) из CSV."""
+    for line_number, row in enumerate(csv.reader(file), 1):
+        if len(row) != 2:
+            raise ValueError(
+                f'Неверный формат CSV файла в строке {line_number}. '
+                'Ожидаются колонки: название, единица измерения'
+            )
+        yield row[0], row[1]
+
+
+class JSONArrayReader:
+    """
+    Инкрементальный разбор JSON-массива верхнего уровня.
+
+    В памяти держится только текущий фрагмент файла, элементы
+    массива отдаются по одному. Элемент длиннее max_item_size символов
+    считается ошибкой формата: иначе испорченный файл дочитывался бы
+    в память целиком в поисках конца элемента.
+    """
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, file, chunk_size=JSON_CHUNK_SIZE,
+                 max_item_size=JSON_MAX_ITEM_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.max_item_size = max_item_size
+        self.buffer = ''
+        self.index = 0
+
+    def refill(self):
+        """Дочитывает следующий фрагмент файла."""
+        chunk = self.file.read(self.chunk_size)
+        self.buffer, self.index = self.buffer[self.index:] + chunk, 0
+        return bool(chunk)
+
+    def next_char(self):
+        """Первый непробельный символ, при нужде дочитывая файл."""
+        while True:
+            while (self.index < len(self.buffer)
+                   and self.buffer[self.index].isspace()):
+                self.index += 1
+            if self.index < len(self.buffer):
+                return self.buffer[self.index]
+            if not self.refill():
+                raise json.JSONDecodeError(
+                    'Неожиданный конец файла', self.buffer, self.index
+                )
+
+    def expect(self, chars):
+        """Пропускает один из ожидаемых символов."""
+        char = self.next_char()
+        if char not in chars:
+            raise json.JSONDecodeError(
+                f'Ожидается один из символов {chars}', self.buffer, self.index
+            )
+        self.index += 1
+        return char
+
+    def decode(self):
+        """Разбирает следующий элемент массива."""
+        self.next_char()
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, self.index)
+            except json.JSONDecodeError:
+                self.check_item_size()
+                if not self.refill():
+                    raise
+                continue
+            if end == len(self.buffer):
+                self.check_item_size()
+                if self.refill():
+                    continue
+            self.index = end
+            return item
+
+    def check_item_size(self):
+        """Не даёт недоразобранному элементу расти без ограничений."""
+        if len(self.buffer) - self.index > self.max_item_size:
+            raise json.JSONDecodeError(
+                f'Элемент массива длиннее {self.max_item_size} символов',
+                self.buffer[self.index:self.index + 100], 0
+            )
+
+    def __iter__(self):
+        self.expect('[')
+        if self.next_char() == ']':
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_json(file):
+    """Построчно читает пары (название, единица измерения) из JSON."""
+    for item in JSONArrayReader(file):
+        name = item.get('name')
+        measurement_unit = item.get('measurement_unit')
+        if not name or not measurement_unit:
+            raise ValueError('В JSON файле отсутствуют обязательные поля')
+        yield name, measurement_unit
+
+
+def batched(rows, size):
+    """Разбивает поток строк на пачки заданного размера."""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class CopySource:
+    """
+    Файлоподобный объект для COPY FROM STDIN.
+
+    Формирует CSV из потока строк по мере чтения драйвером.
+    """
+
+    def __init__(self, rows, progress):
+        self.rows = iter(rows)
+        self.progress = progress
+        self.buffer = ''
+
+    def readline(self, size=-1):
+        """Читает одну строку CSV."""
+        return self.read(size)
+
+    def read(self, size=-1):
+        """Отдаёт следующую порцию CSV."""
+        writer = csv.writer(self)
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            writer.writerow(row)
+            self.progress(1)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def write(self, value):
+        """Приёмник для csv.writer."""
+        self.buffer += value
+
 
 class Command(BaseCommand):
     """Класс, в котором описана команда импортирования жанров
@@ -18,75 +182,137 @@ class Command(BaseCommand):
             type=str,
             help='Путь к файлу с жанрами'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одной транзакции'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Количество потоков, загружающих пачки параллельно'
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загрузка через COPY (только PostgreSQL)'
+        )
 
     def handle(self, *args, **options):
         """Функция handler."""
         file_path = options['file_path']
         file_extension = os.path.splitext(file_path)[1].lower()
+        readers = {'.csv': iter_csv, '.json': iter_json}
+        if file_extension not in readers:
+            raise CommandError(
+                'Неподдерживаемый формат файла. '
+                'Поддерживаются только CSV и JSON.'
+            )
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('COPY поддерживается только PostgreSQL')
 
+        self.started = time.monotonic()
+        self.processed = 0
+        self.reported = 0
+        self.lock = threading.Lock()
+        self.report_every = options['batch_size']
         try:
-            if file_extension == '.csv':
-                self.import_from_csv(file_path)
-            elif file_extension == '.json':
-                self.import_from_json(file_path)
-            else:
-                raise CommandError(
-                    'Неподдерживаемый формат файла. '
-                    'Поддерживаются только CSV и JSON.'
-                )
+            with open(file_path, 'r', encoding='utf-8') as file:
+                rows = readers[file_extension](file)
+                if options['copy']:
+                    self.import_with_copy(rows)
+                else:
+                    self.import_in_batches(
+                        rows, options['batch_size'], options['workers']
+                    )
+        except FileNotFoundError:
+            raise CommandError(f'Файл {file_path} не найден')
+        except json.JSONDecodeError:
+            raise CommandError('Неверный формат JSON файла')
         except Exception as e:
             raise CommandError(
                 f'Ошибка при импорте жанров: {e}'
             )
+        finally:
+            autocomplete.invalidate()
 
+        self.report()
         self.stdout.write(
             self.style.SUCCESS('Жанры успешно импортированы')
         )
 
-    def import_from_csv(self, file_path):
-        """Функция, которая импортирует жанры из CSV файла."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                ingredients = []
-                for row in reader:
-                    name, measurement_unit = row
-                    ingredients.append(
-                        Ingredient(name=name,
-                                   measurement_unit=measurement_unit)
-                    )
-                Ingredient.objects.bulk_create(
-                    ingredients, ignore_conflicts=True
-                )
-        except FileNotFoundError:
-            raise CommandError(f'Файл {file_path} не найден')
-        except ValueError:
-            raise CommandError(
-                'Неверный формат CSV файла. '
-                'Ожидаются колонки: название, единица измерения'
-            )
+    def progress(self, rows):
+        """Учитывает обработанные строки и выводит прогресс."""
+        with self.lock:
+            self.processed += rows
+            if self.processed - self.reported >= self.report_every:
+                self.report()
 
-    def import_from_json(self, file_path):
-        """Функция, которая импортирует жанры из JSON файла."""
+    def report(self):
+        """Выводит количество строк и скорость импорта."""
+        if self.processed == self.reported:
+            return
+        self.reported = self.processed
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        self.stdout.write(
+            f'Обработано строк: {self.processed} '
+            f'({self.processed / elapsed:.0f} строк/с)'
+        )
+
+    def save_batch(self, batch):
+        """
+        Сохраняет пачку жанров в отдельной транзакции.
+
+        Ограничение unique_name_measurement_unit покрывает все поля
+        жанра, поэтому вставка с пропуском конфликтов и есть upsert.
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                ingredients = []
-                for item in data:
-                    name = item.get('name')
-                    measurement_unit = item.get('measurement_unit')
-                    if not name or not measurement_unit:
-                        raise ValueError(
-                            'В JSON файле отсутствуют обязательные поля'
-                        )
-                    ingredients.append(
-                        Ingredient(name=name,
-                                   measurement_unit=measurement_unit)
-                    )
+            with transaction.atomic():
                 Ingredient.objects.bulk_create(
-                    ingredients, ignore_conflicts=True
+                    [Ingredient(name=name, measurement_unit=unit)
+                     for name, unit in batch],
+                    ignore_conflicts=True
                 )
-        except FileNotFoundError:
-            raise CommandError(f'Файл {file_path} не найден')
-        except json.JSONDecodeError:
-            raise CommandError('Неверный формат JSON файла')
+            self.progress(len(batch))
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+
+    def import_in_batches(self, rows, batch_size, workers):
+        """Загружает жанры пачками, при workers > 1 - параллельно."""
+        if workers <= 1:
+            for batch in batched(rows, batch_size):
+                self.save_batch(batch)
+            return
+        slots = threading.BoundedSemaphore(workers * 2)
+        with ThreadPoolExecutor(workers) as executor:
+            futures = []
+            for batch in batched(rows, batch_size):
+                slots.acquire()
+                future = executor.submit(self.save_batch, batch)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+                for done in [item for item in futures if item.done()]:
+                    done.result()
+                    futures.remove(done)
+            for future in futures:
+                future.result()
+
+    def import_with_copy(self, rows):
+        """Загружает жанры через COPY во временную таблицу."""
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(COPY_SQL)
+            cursor.copy_expert(
+                'COPY genres_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                CopySource(rows, self.progress)
+            )
+            cursor.execute(
+                f'INSERT INTO {Ingredient._meta.db_table} '
+                '(name, measurement_unit, updated_at) '
+                'SELECT DISTINCT name, measurement_unit, now() '
+                'FROM genres_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
@@ -1,145 +1,433 @@
-from django.core.management.base import BaseCommand
-from django.contrib.auth import get_user_model
-from django.db import transaction
-
-from recipes.models import Ingredient, Recipe, IngredientInRecipe
-
-User = get_user_model()
-
-
-class Command(BaseCommand):
-    """Класс, в котором описана команда импортирования тестовых
-    данных для manage.py"""
-    help = 'Создает тестовые данные для проекта'
-
-    def add_arguments(self, parser):
-        parser.add_argument(
-            '--no-genres',
-            action='store_true',
-            help='Не загружать жанры'
-        )
-
-    @transaction.atomic
-    def handle(self, *args, **options):
-        """Функция handler."""
-        self.stdout.write('Создание тестовых данных...')
-
-        if Ingredient.objects.count() == 0 and not options['no_genres']:
-            self.stdout.write(
-                'Ингредиенты отсутствуют. '
-                'Воспользуйтесь командой import_genres для их загрузки.'
-            )
-            return
-
-        users = [
-            {
-                'username': 'Pepega',
-                'email': 'pepega@example.com',
-                'first_name': 'Invader',
-                'last_name': '303',
-                'password': 'pepega'
-            },
-            {
-                'username': 'user1',
-                'email': 'user1@example.com',
-                'first_name': 'Hideaki',
-                'last_name': 'Kobayashi',
-                'password': 'user1pass'
-            },
-            {
-                'username': 'user2',
-                'email': 'user2@example.com',
-                'first_name': 'Lyn',
-                'last_name': 'Inaizumi',
-                'password': 'user2pass'
-            }
-        ]
-
-        created_users = []
-        for user_data in users:
-            user, created = User.objects.get_or_create(
-                username=user_data['username'],
-                defaults=user_data
-            )
-            if created:
-                user.set_password(user_data['password'])
-                user.save()
-            created_users.append(user)
-
-        self.stdout.write(self.style.SUCCESS('Пользователи созданы'))
-
-        if not options['no_genres'] and Ingredient.objects.exists():
-            genres = list(Ingredient.objects.all()[:20])
-
-            albums_data = [
-                {
-                    'name': 'SANABI',
-                    'text': (
-                        'Executing The King Order\n'
-                        'SANABI'
-                    ),
-                    'cooking_time': 120,
-                    'author': created_users[0],
-                    'genres': [
-                        (genres[0], 2),
-                        (genres[1], 2),
-                        (genres[2], 3)
-                    ]
-                },
-                {
-                    'name': 'Like A Dragon: Gaiden',
-                    'text': (
-                        'Bring It On\n'
-                        'Obediance '
-                    ),
-                    'cooking_time': 12,
-                    'author': created_users[1],
-                    'genres': [
-                        (genres[3], 2),
-                        (genres[4], 3),
-                        (genres[5], 4),
-                        (genres[6], 2)
-                    ]
-                },
-                {
-                    'name': 'Persona 5 Royal',
-                    'text': (
-                        'I Believe\n'
-                        'Last Surprise\n'
-                        'Takeover'
-                    ),
-                    'cooking_time': 20,
-                    'author': created_users[2],
-                    'genres': [
-                        (genres[7], 100),
-                        (genres[8], 150),
-                        (genres[9], 50),
-                        (genres[10], 30)
-                    ]
-                }
-            ]
-
-            for album_data in albums_data:
-                album = Recipe.objects.create(
-                    name=album_data['name'],
-                    text=album_data['text'],
-                    cooking_time=album_data['cooking_time'],
-                    author=album_data['author']
-                )
-
-                album_genres = []
-                for ingredient, amount in album_data['genres']:
-                    album_genres.append(
-                        IngredientInRecipe(
-                            recipe=album,
-                            ingredient=ingredient,
-                            amount=amount
-                        )
-                    )
-                IngredientInRecipe.objects.bulk_create(album_genres)
-
-            self.stdout.write(self.style.SUCCESS('Альбомы созданы'))
-
-        self.stdout.write(
-            self.style.SUCCESS('Тестовые данные успешно созданы')
-        )
+import copy
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from PIL import Image
+
+from recipes import cart_totals, counters, search
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Subscription)
+
+User = get_user_model()
+
+SYNTHETIC_PASSWORD = 'synthetic'
+SYNTHETIC_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+PLACEHOLDER_NAME = 'recipes/images/synthetic_placeholder.png'
+ZIPF_EXPONENT = 1.1
+ZIPF_MAX_ROUNDS = 10
+
+
+class ZipfSampler:
+    """
+    Выбор объектов с распределением Ципфа.
+
+    Популярность объектов задаётся случайной перестановкой,
+    поэтому при одинаковом seed выборка воспроизводима.
+    """
+
+    def __init__(self, items, rng, exponent=ZIPF_EXPONENT):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)
+        ))
+        self.rng = rng
+
+    def sample(self, k, exclude=None):
+        """Выбирает k различных объектов, кроме exclude."""
+        available = len(self.items) - (exclude is not None)
+        k = min(k, available)
+        chosen = set()
+        for _ in range(ZIPF_MAX_ROUNDS):
+            if len(chosen) >= k:
+                break
+            chosen.update(self.rng.choices(
+                self.items, cum_weights=self.cum_weights, k=k - len(chosen)
+            ))
+            chosen.discard(exclude)
+        if len(chosen) < k:
+            rest = [item for item in self.items
+                    if item not in chosen and item != exclude]
+            chosen.update(self.rng.sample(rest, k - len(chosen)))
+        return chosen
+
+
+def insert_fields(model):
+    """
+    Поля для вставки с явно заданным created_at.
+
+    auto_now_add выключается у копий полей, а не у полей модели,
+    поэтому остальные сохранения в процессе его не теряют.
+    """
+    fields = []
+    for field in model._meta.local_concrete_fields:
+        if field is model._meta.auto_field:
+            continue
+        if getattr(field, 'auto_now_add', False):
+            field = copy.copy(field)
+            field.auto_now_add = False
+        fields.append(field)
+    return fields
+
+
+class Command(BaseCommand):
+    """Класс, в котором описана команда импортирования тестовых
+    данных для manage.py"""
+    help = 'Создает тестовые данные для проекта'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-genres',
+            action='store_true',
+            help='Не загружать жанры'
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=0,
+            help='Количество синтетических пользователей'
+        )
+        parser.add_argument(
+            '--recipes-per-user',
+            type=int,
+            default=5,
+            help='Количество альбомов у каждого пользователя'
+        )
+        parser.add_argument(
+            '--genres-per-recipe',
+            type=int,
+            default=3,
+            help='Количество жанров в альбоме'
+        )
+        parser.add_argument(
+            '--favorites-per-user',
+            type=int,
+            default=10,
+            help='Количество альбомов в избранном у пользователя'
+        )
+        parser.add_argument(
+            '--carts-per-user',
+            type=int,
+            default=3,
+            help='Количество альбомов в корзине у пользователя'
+        )
+        parser.add_argument(
+            '--subscriptions-per-user',
+            type=int,
+            default=5,
+            help='Количество подписок у пользователя'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Зерно генератора случайных чисел'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество строк в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        """Функция handler."""
+        if options['users']:
+            self.generate(options)
+            return
+        with transaction.atomic():
+            self.create_demo_data(options)
+
+    def create_demo_data(self, options):
+        """Создаёт трёх демонстрационных пользователей и их альбомы."""
+        self.stdout.write('Создание тестовых данных...')
+
+        if Ingredient.objects.count() == 0 and not options['no_genres']:
+            self.stdout.write(
+                'Ингредиенты отсутствуют. '
+                'Воспользуйтесь командой import_genres для их загрузки.'
+            )
+            return
+
+        users = [
+            {
+                'username': 'Pepega',
+                'email': 'pepega@example.com',
+                'first_name': 'Invader',
+                'last_name': '303',
+                'password': 'pepega'
+            },
+            {
+                'username': 'user1',
+                'email': 'user1@example.com',
+                'first_name': 'Hideaki',
+                'last_name': 'Kobayashi',
+                'password': 'user1pass'
+            },
+            {
+                'username': 'user2',
+                'email': 'user2@example.com',
+                'first_name': 'Lyn',
+                'last_name': 'Inaizumi',
+                'password': 'user2pass'
+            }
+        ]
+
+        created_users = []
+        for user_data in users:
+            user, created = User.objects.get_or_create(
+                username=user_data['username'],
+                defaults=user_data
+            )
+            if created:
+                user.set_password(user_data['password'])
+                user.save()
+            created_users.append(user)
+
+        self.stdout.write(self.style.SUCCESS('Пользователи созданы'))
+
+        if not options['no_genres'] and Ingredient.objects.exists():
+            genres = list(Ingredient.objects.all()[:20])
+
+            albums_data = [
+                {
+                    'name': 'SANABI',
+                    'text': (
+                        'Executing The King Order\n'
+                        'SANABI'
+                    ),
+                    'cooking_time': 120,
+                    'author': created_users[0],
+                    'genres': [
+                        (genres[0], 2),
+                        (genres[1], 2),
+                        (genres[2], 3)
+                    ]
+                },
+                {
+                    'name': 'Like A Dragon: Gaiden',
+                    'text': (
+                        'Bring It On\n'
+                        'Obediance '
+                    ),
+                    'cooking_time': 12,
+                    'author': created_users[1],
+                    'genres': [
+                        (genres[3], 2),
+                        (genres[4], 3),
+                        (genres[5], 4),
+                        (genres[6], 2)
+                    ]
+                },
+                {
+                    'name': 'Persona 5 Royal',
+                    'text': (
+                        'I Believe\n'
+                        'Last Surprise\n'
+                        'Takeover'
+                    ),
+                    'cooking_time': 20,
+                    'author': created_users[2],
+                    'genres': [
+                        (genres[7], 100),
+                        (genres[8], 150),
+                        (genres[9], 50),
+                        (genres[10], 30)
+                    ]
+                }
+            ]
+
+            for album_data in albums_data:
+                album = Recipe.objects.create(
+                    name=album_data['name'],
+                    text=album_data['text'],
+                    cooking_time=album_data['cooking_time'],
+                    author=album_data['author']
+                )
+
+                album_genres = []
+                for ingredient, amount in album_data['genres']:
+                    album_genres.append(
+                        IngredientInRecipe(
+                            recipe=album,
+                            ingredient=ingredient,
+                            amount=amount
+                        )
+                    )
+                IngredientInRecipe.objects.bulk_create(album_genres)
+
+            self.stdout.write(self.style.SUCCESS('Альбомы созданы'))
+
+        self.stdout.write(
+            self.style.SUCCESS('Тестовые данные успешно созданы')
+        )
+
+    def generate(self, options):
+        """
+        Создаёт воспроизводимый синтетический набор данных.
+
+        Связи (избранное, корзины, подписки) распределены по Ципфу:
+        небольшая часть альбомов и авторов собирает большую часть связей.
+        """
+        rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.started = time.monotonic()
+        prefix = f's{options["seed"]}u'
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Синтетические данные с seed={options["seed"]} уже созданы'
+            )
+        genre_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if len(genre_ids) < options['genres_per_recipe']:
+            raise CommandError(
+                'Недостаточно жанров. '
+                'Воспользуйтесь командой import_genres для их загрузки.'
+            )
+
+        password = make_password(SYNTHETIC_PASSWORD)
+        user_ids = self.create_users(prefix, options['users'], password)
+        image = self.placeholder_image()
+        recipe_ids = self.create_recipes(
+            prefix, rng, user_ids, options['recipes_per_user'], image
+        )
+        self.create_genres(
+            rng, recipe_ids, genre_ids, options['genres_per_recipe']
+        )
+
+        recipes = ZipfSampler(recipe_ids, rng)
+        for model, per_user in ((Favorite, options['favorites_per_user']),
+                                (ShoppingCart, options['carts_per_user'])):
+            self.bulk_insert(model, (
+                model(user_id=user_id, recipe_id=recipe_id,
+                      created_at=self.timestamp(index))
+                for index, user_id in enumerate(user_ids)
+                for recipe_id in sorted(recipes.sample(per_user))
+            ))
+
+        authors = ZipfSampler(user_ids, rng)
+        self.bulk_insert(Subscription, (
+            Subscription(user_id=user_id, author_id=author_id,
+                         created_at=self.timestamp(index))
+            for index, user_id in enumerate(user_ids)
+            for author_id in sorted(authors.sample(
+                options['subscriptions_per_user'], exclude=user_id
+            ))
+        ))
+
+        with transaction.atomic():
+            counters.recount()
+            cart_totals.rebuild()
+            search.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS('Синтетические данные успешно созданы')
+        )
+
+    def timestamp(self, index):
+        """Детерминированное время создания записи."""
+        return SYNTHETIC_EPOCH + timedelta(seconds=index)
+
+    def placeholder_image(self):
+        """Создаёт картинку-заглушку один раз для всех альбомов."""
+        if not default_storage.exists(PLACEHOLDER_NAME):
+            buffer = BytesIO()
+            Image.new('RGB', (480, 480), (90, 90, 120)).save(buffer, 'PNG')
+            default_storage.save(PLACEHOLDER_NAME,
+                                 ContentFile(buffer.getvalue()))
+        return PLACEHOLDER_NAME
+
+    def bulk_insert(self, model, objects):
+        """Вставляет объекты пачками, каждая в своей транзакции."""
+        name = model._meta.verbose_name_plural
+        fields = insert_fields(model)
+        batch, total = [], 0
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                total += self.flush(model, fields, batch)
+                batch = []
+                self.report(name, total)
+        if batch or not total:
+            total += self.flush(model, fields, batch)
+            self.report(name, total)
+
+    def flush(self, model, fields, batch):
+        """
+        Сохраняет одну пачку объектов.
+
+        Вставка идёт в обход bulk_create, которому нельзя передать
+        поля: иначе created_at перезаписывается текущим временем.
+        """
+        if not batch:
+            return 0
+        size = connection.ops.bulk_batch_size(fields, batch)
+        with transaction.atomic():
+            for start in range(0, len(batch), size):
+                model._base_manager._insert(
+                    batch[start:start + size], fields=fields,
+                    ignore_conflicts=True
+                )
+        return len(batch)
+
+    def report(self, name, total):
+        """Выводит прогресс генерации."""
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f'{name}: {total} ({elapsed:.1f} с)')
+
+    def create_users(self, prefix, count, password):
+        """Создаёт пользователей и возвращает их идентификаторы."""
+        self.bulk_insert(User, (
+            User(
+                username=f'{prefix}{index}',
+                email=f'{prefix}{index}@synthetic.test',
+                first_name='Synthetic',
+                last_name=str(index),
+                password=password,
+            )
+            for index in range(count)
+        ))
+        return list(User.objects.filter(
+            username__startswith=prefix
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_recipes(self, prefix, rng, user_ids, per_user, image):
+        """
+        Создаёт альбомы и возвращает их идентификаторы.
+
+        Альбомы выбираются по синтетическим авторам, а не по диапазону
+        id: в нём могут оказаться альбомы параллельных запросов.
+        """
+        self.bulk_insert(Recipe, (
+            Recipe(
+                name=f'Synthetic album {user_id}-{number}',
+                text='Synthetic tracklist',
+                cooking_time=rng.randint(1, 180),
+                image=image,
+                author_id=user_id,
+                created_at=self.timestamp(index * per_user + number),
+            )
+            for index, user_id in enumerate(user_ids)
+            for number in range(per_user)
+        ))
+        return list(Recipe.objects.filter(
+            author__username__startswith=prefix
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_genres(self, rng, recipe_ids, genre_ids, per_recipe):
+        """Добавляет жанры в альбомы."""
+        self.bulk_insert(IngredientInRecipe, (
+            IngredientInRecipe(
+                recipe_id=recipe_id, ingredient_id=genre_id,
+                amount=rng.randint(1, 10)
+            )
+            for recipe_id in recipe_ids
+            for genre_id in rng.sample(genre_ids, per_recipe)
+        ))
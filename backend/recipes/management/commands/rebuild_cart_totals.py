@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import cart_totals
+
+
+class Command(BaseCommand):
+    """Класс, в котором описана команда пересчёта итогов корзин
+    для manage.py"""
+    help = 'Проверяет и пересоздаёт итоги корзин покупок по жанрам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить итоги, не изменяя их'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        """Функция handler."""
+        drifted = cart_totals.check()
+        self.stdout.write(f'Расходящихся итогов: {drifted}')
+        if options['check']:
+            return
+        created = cart_totals.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Итоги корзин пересозданы: {created}')
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import counters, jobs, tasks
+
+
+class Command(BaseCommand):
+    """Класс, в котором описана команда пересчёта счётчиков
+    для manage.py"""
+    help = 'Пересчитывает счётчики избранного, корзин, подписок и альбомов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Поставить пересчёт фоновой задачей'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        """Функция handler."""
+        if options['enqueue']:
+            job = jobs.enqueue(tasks.RECOUNT)
+            self.stdout.write(
+                self.style.SUCCESS(f'Пересчёт поставлен в очередь: #{job.pk}')
+            )
+            return
+        for counter, repaired in counters.recount().items():
+            self.stdout.write(f'{counter}: исправлено записей {repaired}')
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
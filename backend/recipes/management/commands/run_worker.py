@@ -0,0 +1,67 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from foodgram.caches import require_shared
+from recipes import jobs
+
+
+class Command(BaseCommand):
+    """Класс, в котором описана команда запуска воркеров фоновых задач
+    для manage.py"""
+    help = 'Выполняет фоновые задачи из очереди в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.JOBS_WORKERS,
+            help='Количество процессов-воркеров'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить задачи, ожидающие в очереди, и завершиться'
+        )
+
+    def handle(self, *args, **options):
+        """Функция handler."""
+        if options['processes'] < 1:
+            raise CommandError('Нужен хотя бы один процесс')
+        try:
+            require_shared('задачи выполняются в отдельном процессе')
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+        if options['once'] or options['processes'] == 1:
+            stop = threading.Event()
+            self.handle_signals(stop)
+            jobs.work(stop, once=options['once'])
+            return
+
+        # Соединения не должны переходить в дочерние процессы.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        self.handle_signals(stop)
+        workers = [
+            context.Process(target=jobs.work, args=(stop,),
+                            name=f'job-worker-{number}')
+            for number in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Запущено воркеров: {len(workers)}')
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('Воркеры остановлены'))
+
+    @staticmethod
+    def handle_signals(stop):
+        """SIGTERM и SIGINT завершают воркеры после текущей задачи."""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop.set())
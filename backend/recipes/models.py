@@ -1,9 +1,34 @@
 from django.core.validators import MinValueValidator
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import OpClass
+from django.contrib.postgres.search import SearchVectorField
 import constants
 
+from .search import SearchIndex
+
+
+class PatternIndex(models.Index):
+    """
+    Индекс для LIKE 'префикс%' с классом операторов в PostgreSQL.
+
+    На других СУБД классы операторов не поддерживаются и создаётся
+    обычный индекс по тем же выражениям.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().create_sql(model, schema_editor, using, **kwargs)
+        plain = models.Index(*(
+            expression.source_expressions[0]
+            if isinstance(expression, OpClass) else expression
+            for expression in self.expressions
+        ), name=self.name)
+        return plain.create_sql(model, schema_editor, using, **kwargs)
+
 
 class Ingredient(models.Model):
     """
@@ -11,6 +36,7 @@ class Ingredient(models.Model):
 
     :param name (CharField): Название ингредиента
     :param measurement_unit (CharField): Единица измерения количества
+    :param updated_at (DateTimeField): Время последнего изменения
     """
 
     name = models.CharField(
@@ -25,6 +51,12 @@ class Ingredient(models.Model):
         help_text='Единица измерения количества ингредиента (г, кг, шт.)'
     )
 
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+        help_text='Используется для Last-Modified и ETag'
+    )
+
     class Meta:
         """Meta класс описания объекта"""
         verbose_name = 'Жанр'
@@ -35,6 +67,12 @@ class Ingredient(models.Model):
                 name='unique_name_measurement_unit'
             )
         ]
+        indexes = [
+            PatternIndex(
+                OpClass(Lower('name'), name='text_pattern_ops'),
+                name='ingredient_lower_name_idx'
+            ),
+        ]
         ordering = ('name',)
 
     def __str__(self):
@@ -51,6 +89,11 @@ class User(AbstractUser):
     :param first_name (CharField): Имя пользователя
     :param last_name (CharField): Фамилия пользователя
     :param avatar (ImageField): Аватар пользователя (опционально)
+    :param avatar_variants (JSONField): Производные аватара
+    :param recipes_count (PositiveIntegerField): Количество альбомов
+    :param followers_count (PositiveIntegerField): Количество подписчиков
+    :param following_count (PositiveIntegerField): Количество подписок
+    :param updated_at (DateTimeField): Время последнего изменения профиля
     """
 
     email = models.EmailField(
@@ -92,6 +135,41 @@ class User(AbstractUser):
         help_text='Изображение профиля пользователя'
     )
 
+    avatar_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Производные аватара',
+        help_text='Пути к уменьшенным копиям аватара'
+    )
+
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество альбомов',
+        help_text='Поддерживается сигналами, чинится командой recount'
+    )
+
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+        help_text='Поддерживается сигналами, чинится командой recount'
+    )
+
+    following_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписок',
+        help_text='Поддерживается сигналами, чинится командой recount'
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+        help_text='Используется для Last-Modified и ETag'
+    )
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [
         'username',
@@ -118,9 +196,17 @@ class Recipe(models.Model):
     :param ingredients (ManyToManyField):
     :param Связь с ингредиентами через промежуточную модель
     :param image (ImageField): Изображение готового блюда
+    :param image_variants (JSONField): Производные изображения
     :param author (ForeignKey): Создатель рецепта
     :param cooking_time (IntegerField): Время приготовления в минутах
     :param created_at (DateTimeField): Дата и время создания рецепта
+    :param favorites_count (PositiveIntegerField): Количество добавлений
+    в избранное
+    :param in_carts_count (PositiveIntegerField): Количество добавлений
+    в корзину
+    :param search_vector (SearchVectorField): Поисковый документ
+    для PostgreSQL
+    :param updated_at (DateTimeField): Время последнего изменения
     """
 
     name = models.CharField(
@@ -147,6 +233,14 @@ class Recipe(models.Model):
         help_text='Изображение готового блюда'
     )
 
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Производные картинки',
+        help_text='Пути к уменьшенным копиям изображения'
+    )
+
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -173,12 +267,53 @@ class Recipe(models.Model):
         help_text='Дата и время публикации рецепта'
     )
 
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+        help_text='Используется для Last-Modified и ETag'
+    )
+
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+        help_text='Поддерживается сигналами, чинится командой recount'
+    )
+
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В корзинах',
+        help_text='Поддерживается сигналами, чинится командой recount'
+    )
+
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый документ',
+        help_text='Название, описание и жанры альбома с весами A, B, C'
+    )
+
     class Meta:
         """Meta класс описания объекта"""
         verbose_name = 'Альбом'
         verbose_name_plural = 'Альбомы'
         ordering = ('-created_at',)
         default_related_name = 'recipes'
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='recipe_created_at_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-created_at', '-id'],
+                name='recipe_author_created_at_idx'
+            ),
+            SearchIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'ID рецепта: {self.id} | {self.name}'
@@ -282,7 +417,7 @@ class Favorite(UserOfRecipeBase):
     Класс модели избранных рецептов.
     """
 
-    class Meta:
+    class Meta(UserOfRecipeBase.Meta):
         """Meta класс описания объекта"""
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные'
@@ -293,12 +428,96 @@ class ShoppingCart(UserOfRecipeBase):
     Класс модели корзины покупок.
     """
 
-    class Meta:
+    class Meta(UserOfRecipeBase.Meta):
         """Meta класс описания объекта"""
         verbose_name = 'Корзина покупок'
         verbose_name_plural = 'Корзины покупок'
 
 
+class ShoppingCartTotal(models.Model):
+    """
+    Класс модели итогов корзины покупок по жанрам.
+
+    Материализованная сумма IngredientInRecipe.amount по альбомам
+    в корзине пользователя, обновляется при изменении корзины.
+
+    :param user (ForeignKey): Владелец корзины
+    :param ingredient (ForeignKey): Жанр
+    :param total_amount (PositiveIntegerField): Суммарное количество
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        help_text='Владелец корзины покупок'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Жанр',
+        help_text='Жанр из альбомов в корзине'
+    )
+    total_amount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество',
+        help_text='Суммарное количество по альбомам в корзине'
+    )
+
+    class Meta:
+        """Meta класс описания объекта"""
+        verbose_name = 'Итог корзины покупок'
+        verbose_name_plural = 'Итоги корзин покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_total'
+            )
+        ]
+        default_related_name = 'cart_totals'
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient}: {self.total_amount}'
+
+
+class RecipeSnapshot(models.Model):
+    """
+    Класс модели готового JSON-представления альбома.
+
+    Хранит общую для всех пользователей часть ответа API; персональные
+    флаги и адрес сервера подставляются при отдаче.
+
+    :param recipe (OneToOneField): Альбом
+    :param version (PositiveIntegerField): Версия формата представления
+    :param body (TextField): JSON-текст с маркерами подстановки
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='snapshot',
+        verbose_name='Альбом',
+        help_text='Альбом, для которого построено представление'
+    )
+    version = models.PositiveIntegerField(
+        verbose_name='Версия',
+        help_text='Версия формата представления'
+    )
+    body = models.TextField(
+        verbose_name='Представление',
+        help_text='JSON-текст альбома без персональных флагов'
+    )
+
+    class Meta:
+        """Meta класс описания объекта"""
+        verbose_name = 'Представление альбома'
+        verbose_name_plural = 'Представления альбомов'
+
+    def __str__(self):
+        return f'{self.recipe_id} v{self.version}'
+
+
 class Subscription(models.Model):
     """
     Класс, описывающий взаимодействие с подписками пользователей на рецепты.
@@ -336,9 +555,160 @@ class Subscription(models.Model):
                 name='unique_subscription'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['user', 'created_at', 'id'],
+                name='subscription_user_created_idx'
+            ),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
         ordering = ['created_at']
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'
+
+
+class Job(models.Model):
+    """
+    Класс модели фоновой задачи.
+
+    Очередь задач хранится в базе: задачи ставятся в одной транзакции
+    с данными, из которых появились, а manage.py run_worker выбирает их
+    по приоритету (см. recipes.jobs).
+
+    :param name (CharField): Имя зарегистрированной задачи
+    :param key (CharField): Ключ, по которому не ставятся повторы
+    :param payload (JSONField): Аргументы задачи
+    :param user (ForeignKey): Пользователь, поставивший задачу
+    :param status (CharField): Состояние задачи
+    :param priority (SmallIntegerField): Приоритет, большие - раньше
+    :param attempts (PositiveSmallIntegerField): Сделано попыток
+    :param max_attempts (PositiveSmallIntegerField): Допустимо попыток
+    :param run_after (DateTimeField): Не запускать раньше этого времени
+    :param heartbeat_at (DateTimeField): Последняя отметка воркера
+    :param result (JSONField): Результат выполнения
+    :param result_file (FileField): Файл с результатом
+    :param error (TextField): Ошибка последней попытки
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(
+        max_length=constants.JOB_NAME_MAX_LENGTH,
+        verbose_name='Задача',
+        help_text='Имя зарегистрированной задачи'
+    )
+    key = models.CharField(
+        max_length=constants.JOB_KEY_MAX_LENGTH,
+        blank=True,
+        db_index=True,
+        verbose_name='Ключ',
+        help_text='Пока задача с ключом в очереди, повторная не ставится'
+    )
+    payload = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Аргументы',
+        help_text='Аргументы задачи'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='jobs',
+        verbose_name='Пользователь',
+        help_text='Пользователь, поставивший задачу'
+    )
+    status = models.CharField(
+        max_length=constants.JOB_STATUS_MAX_LENGTH,
+        choices=STATUSES,
+        default=QUEUED,
+        verbose_name='Состояние',
+        help_text='Состояние задачи'
+    )
+    priority = models.SmallIntegerField(
+        default=0,
+        verbose_name='Приоритет',
+        help_text='Задачи с большим приоритетом выполняются раньше'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Попыток',
+        help_text='Количество начатых попыток'
+    )
+    max_attempts = models.PositiveSmallIntegerField(
+        default=constants.JOB_MAX_ATTEMPTS,
+        verbose_name='Допустимо попыток',
+        help_text='После стольких неудач задача считается проваленной'
+    )
+    run_after = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Запуск не раньше',
+        help_text='Время, раньше которого задача не выполняется'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания',
+        help_text='Дата и время постановки задачи'
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Начало',
+        help_text='Дата и время начала последней попытки'
+    )
+    heartbeat_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Отметка воркера',
+        help_text='Последняя отметка воркера, выполняющего задачу'
+    )
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Завершение',
+        help_text='Дата и время завершения задачи'
+    )
+    result = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name='Результат',
+        help_text='Результат выполнения задачи'
+    )
+    result_file = models.FileField(
+        upload_to='jobs/results/',
+        blank=True,
+        verbose_name='Файл результата',
+        help_text='Файл, сформированный задачей'
+    )
+    error = models.TextField(
+        blank=True,
+        verbose_name='Ошибка',
+        help_text='Ошибка последней попытки'
+    )
+
+    class Meta:
+        """Meta класс описания объекта"""
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(
+                fields=['status', '-priority', 'run_after', 'id'],
+                name='job_queue_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
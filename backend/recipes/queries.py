@@ -0,0 +1,51 @@
+"""Выборки альбомов, общие для нескольких представлений."""
+from collections import defaultdict
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Recipe
+
+SHORT_FIELDS = ('id', 'name', 'image', 'image_variants', 'cooking_time',
+                'author_id', 'created_at')
+
+
+def latest_by_author(author_ids, limit=None):
+    """
+    Последние альбомы каждого автора одним запросом.
+
+    При заданном limit альбомы нумеруются оконной функцией
+    ROW_NUMBER() OVER (PARTITION BY author_id ORDER BY created_at DESC)
+    и отбираются первые limit альбомов каждого автора.
+
+    :param author_ids: Идентификаторы авторов
+    :param limit: Количество альбомов на автора (None - все)
+    :returns: Словарь author_id -> список альбомов от новых к старым
+    """
+    result = defaultdict(list)
+    author_ids = list(author_ids)
+    if not author_ids or limit == 0:
+        return result
+    queryset = Recipe.objects.filter(
+        author_id__in=author_ids
+    ).only(*SHORT_FIELDS)
+    order = ('author_id', '-created_at', '-id')
+    if limit is None:
+        recipes = queryset.order_by(*order)
+    else:
+        ranked = queryset.annotate(recipe_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=[F('created_at').desc(), F('id').desc()]
+        )).order_by()
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            'WHERE ranked.recipe_rank <= %s '
+            'ORDER BY ranked.author_id, ranked.created_at DESC, '
+            'ranked.id DESC',
+            (*params, limit)
+        )
+    for recipe in recipes:
+        result[recipe.author_id].append(recipe)
+    return result
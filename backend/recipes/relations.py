@@ -0,0 +1,159 @@
+"""
+Связи пользователя: избранное, корзина покупок и подписки.
+
+Для пользователя хранятся три отсортированных массива array('q'):
+избранные альбомы, альбомы в корзине и авторы, на которых он подписан.
+Проверка принадлежности выполняется bisect без запросов к базе.
+Связи загружаются одним запросом (UNION ALL трёх таблиц), кэшируются
+в общем кэше и запоминаются на объекте запроса. При изменении связей
+запись в кэше удаляется сразу, а после коммита изменение записывается
+в массивы, которые параллельный запрос успел загрузить по старым данным
+(write-through). Запись не атомарна, поэтому при одновременных
+изменениях одного пользователя расхождение живёт не дольше
+RELATIONS_CACHE_TIMEOUT.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import IntegerField, Value
+
+from .models import Favorite, ShoppingCart, Subscription
+
+FAVORITES = 'favorites'
+CART = 'cart'
+FOLLOWING = 'following'
+
+SOURCES = {
+    Favorite: (FAVORITES, 'recipe_id'),
+    ShoppingCart: (CART, 'recipe_id'),
+    Subscription: (FOLLOWING, 'author_id'),
+}
+
+
+class Relations:
+    """
+    Связи одного пользователя.
+
+    :param favorites: Идентификаторы избранных альбомов
+    :param cart: Идентификаторы альбомов в корзине
+    :param following: Идентификаторы авторов в подписках
+    """
+
+    __slots__ = (FAVORITES, CART, FOLLOWING)
+
+    def __init__(self, favorites=(), cart=(), following=()):
+        self.favorites = array('q', sorted(favorites))
+        self.cart = array('q', sorted(cart))
+        self.following = array('q', sorted(following))
+
+    @staticmethod
+    def _contains(ids, pk):
+        position = bisect_left(ids, pk)
+        return position < len(ids) and ids[position] == pk
+
+    def is_favorited(self, recipe_id):
+        return self._contains(self.favorites, recipe_id)
+
+    def is_in_shopping_cart(self, recipe_id):
+        return self._contains(self.cart, recipe_id)
+
+    def is_following(self, author_id):
+        return self._contains(self.following, author_id)
+
+    def add(self, kind, pk):
+        ids = getattr(self, kind)
+        position = bisect_left(ids, pk)
+        if position == len(ids) or ids[position] != pk:
+            ids.insert(position, pk)
+
+    def discard(self, kind, pk):
+        ids = getattr(self, kind)
+        position = bisect_left(ids, pk)
+        if position < len(ids) and ids[position] == pk:
+            del ids[position]
+
+
+EMPTY = Relations()
+
+
+def get_cache():
+    """Возвращает бэкенд кэша, настроенный для связей."""
+    return caches[settings.RELATIONS_CACHE_ALIAS]
+
+
+def make_key(user_id):
+    return f'relations:{user_id}'
+
+
+def load(user_id):
+    """Загружает связи пользователя из базы одним запросом."""
+    queries = [
+        model.objects.filter(user_id=user_id).annotate(
+            kind=Value(position, output_field=IntegerField())
+        ).values_list('kind', field).order_by()
+        for position, (model, (_, field)) in enumerate(SOURCES.items())
+    ]
+    ids = [[] for _ in SOURCES]
+    for kind, pk in queries[0].union(*queries[1:], all=True):
+        ids[kind].append(pk)
+    return Relations(*ids)
+
+
+def get(user_id):
+    """Связи пользователя из кэша; при промахе загружаются из базы."""
+    cache = get_cache()
+    key = make_key(user_id)
+    relations = cache.get(key)
+    if relations is None:
+        relations = load(user_id)
+        cache.set(key, relations, settings.RELATIONS_CACHE_TIMEOUT)
+    return relations
+
+
+def for_request(request):
+    """
+    Связи текущего пользователя, один раз на запрос.
+
+    Для анонимного пользователя и вызовов без запроса связи пустые.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return EMPTY
+    relations = getattr(request, '_relations', None)
+    if relations is None:
+        relations = request._relations = get(user.pk)
+    return relations
+
+
+def changed(model, user_id, target_ids, added):
+    """
+    Сбрасывает связи в кэше и записывает изменение после коммита.
+
+    :param model: Модель связи (Favorite, ShoppingCart, Subscription)
+    :param target_ids: Идентификаторы альбомов или авторов
+    :param added: True - связи созданы, False - удалены
+    """
+    kind = SOURCES[model][0]
+    target_ids = list(target_ids)
+    if not target_ids:
+        return
+
+    cache = get_cache()
+    key = make_key(user_id)
+    cache.delete(key)
+
+    def write():
+        relations = cache.get(key)
+        if relations is None:
+            return
+        for pk in target_ids:
+            if added:
+                relations.add(kind, pk)
+            else:
+                relations.discard(kind, pk)
+        cache.set(key, relations, settings.RELATIONS_CACHE_TIMEOUT)
+
+    transaction.on_commit(write)
@@ -0,0 +1,43 @@
+"""
+Версия кэша ответов API.
+
+Закэшированные ответы по альбомам (api.cache) хранятся под ключами
+с текущей версией; увеличение версии делает их все устаревшими.
+Версию меняют и представления API, и админка, и фоновые задачи,
+поэтому она живёт здесь, а не в api.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'recipes:version'
+
+
+def get_cache():
+    """Возвращает бэкенд кэша, настроенный для ответов API."""
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def get_version():
+    """
+    Возвращает текущую версию кэша рецептов.
+
+    Начальное значение берётся из текущего времени, чтобы после
+    вытеснения ключа версии не воскресали старые записи.
+    """
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """Инвалидирует все закэшированные ответы по рецептам."""
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
@@ -0,0 +1,158 @@
+"""
+Полнотекстовый поиск по альбомам.
+
+В PostgreSQL документ альбома хранится в Recipe.search_vector
+(tsvector с GIN-индексом): название с весом A, описание с весом B,
+названия жанров с весом C. В SQLite для разработки и тестов
+используется виртуальная таблица FTS5 с теми же колонками и весами
+в bm25. Индекс обновляется при сохранении альбома, после изменения
+его жанров и при переименовании жанра.
+"""
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, FloatField, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+from django.db.models.indexes import Index
+
+CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+
+class SearchIndex(GinIndex):
+    """GIN-индекс в PostgreSQL, на других СУБД обычный индекс."""
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().create_sql(model, schema_editor, using, **kwargs)
+        return Index.create_sql(self, model, schema_editor, using, **kwargs)
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def _genre_names():
+    """Подзапрос с названиями жанров альбома через пробел."""
+    from .models import IngredientInRecipe
+    return Subquery(
+        IngredientInRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+
+
+def _fts_query(term):
+    """Запрос FTS5: каждое слово в кавычках, все слова обязательны."""
+    words = term.split()
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def update_index(recipe_ids):
+    """
+    Обновляет поисковый документ альбомов.
+
+    :param recipe_ids: Идентификаторы альбомов или queryset с ними
+    """
+    from .models import Recipe
+    if is_postgresql():
+        Recipe.objects.filter(pk__in=recipe_ids).update(search_vector=(
+            SearchVector('name', weight='A', config=CONFIG)
+            + SearchVector('text', weight='B', config=CONFIG)
+            + SearchVector(_genre_names(), weight='C', config=CONFIG)
+        ))
+        return
+    ids = list(Recipe.objects.filter(
+        pk__in=recipe_ids
+    ).values_list('pk', flat=True))
+    if not ids:
+        return
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', ids
+        )
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text, genres) '
+            f'SELECT recipe.id, recipe.name, recipe.text, '
+            f'COALESCE((SELECT group_concat(genre.name, \' \') '
+            f'FROM recipes_ingredientinrecipe link '
+            f'JOIN recipes_ingredient genre ON genre.id = link.ingredient_id '
+            f'WHERE link.recipe_id = recipe.id), \'\') '
+            f'FROM recipes_recipe recipe WHERE recipe.id IN ({placeholders})',
+            ids
+        )
+
+
+def remove_from_index(recipe_id):
+    """Удаляет документ альбома (нужно только для FTS5)."""
+    if is_postgresql():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [recipe_id])
+
+
+def search(queryset, term):
+    """
+    Отбирает альбомы по запросу и сортирует их по релевантности.
+
+    :param queryset: Queryset альбомов
+    :param term: Поисковый запрос пользователя
+    :returns: Queryset с аннотацией search_rank
+    """
+    term = term.strip()
+    if not term:
+        return queryset
+    if is_postgresql():
+        query = SearchQuery(term, search_type='websearch', config=CONFIG)
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-created_at', '-id')
+    match = _fts_query(term)
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        [match]
+    )).annotate(search_rank=RawSQL(
+        f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s '
+        f'AND {FTS_TABLE}.rowid = recipes_recipe.id',
+        [match], output_field=FloatField()
+    )).order_by('-search_rank', '-created_at', '-id')
+
+
+def rebuild():
+    """Пересоздаёт поисковые документы всех альбомов."""
+    from .models import Recipe
+    if not is_postgresql():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    update_index(Recipe.objects.all())
+
+
+def ensure_index(**kwargs):
+    """
+    Обработчик post_migrate.
+
+    В SQLite создаёт таблицу FTS5, в PostgreSQL заполняет документы
+    альбомов, созданных до появления поискового поля.
+    """
+    from .models import Recipe
+    if is_postgresql():
+        update_index(Recipe.objects.filter(search_vector__isnull=True))
+        return
+    with connection.cursor() as cursor:
+        exists = FTS_TABLE in connection.introspection.table_names(cursor)
+        if not exists:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+                f'name, text, genres, tokenize=\'unicode61\')'
+            )
+    if not exists:
+        rebuild()
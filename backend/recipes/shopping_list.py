@@ -0,0 +1,129 @@
+"""Формирование списка покупок в форматах txt, csv и pdf."""
+import csv
+import os
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from .models import Recipe
+
+PDF_FONT_NAME = 'DejaVuSans'
+PDF_FALLBACK_FONT = 'Helvetica'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 18
+
+MEDIA_TYPES = {
+    'txt': 'text/plain',
+    'csv': 'text/csv',
+    'pdf': 'application/pdf',
+}
+
+
+def cart_rows(user):
+    """
+    Строки отчета по корзине пользователя.
+
+    :returns: Пара querysets: (название альбома, автор) и
+    (жанр, единица, количество)
+    """
+    recipes = Recipe.objects.filter(
+        id__in=user.shoppingcarts.values_list('recipe_id', flat=True)
+    ).order_by('name').values_list('name', 'author__username').distinct()
+    ingredients = user.cart_totals.order_by('ingredient__name').values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total_amount'
+    )
+    return recipes, ingredients
+
+
+def iter_txt(recipes, ingredients, date):
+    """
+    Построчно отдаёт текстовый отчет со списком покупок.
+
+    :param recipes: Итератор пар (название альбома, автор)
+    :param ingredients: Итератор троек (жанр, единица, количество)
+    :param date: Дата формирования отчета
+    """
+    yield f'Список покупок на {date}\n\n'
+    yield 'Альбом в списке покупок:\n'
+    for name, author in recipes:
+        yield f'- {name} (автор: {author})\n'
+    yield '\n'
+    yield 'Жанры:\n'
+    for i, (name, unit, amount) in enumerate(ingredients, 1):
+        yield f'{i}. {name} - {amount} {unit}\n'
+    yield '\nСпасибо за использование сервиса Musicgram!'
+
+
+class _Echo:
+    """Псевдобуфер, возвращающий записанную строку csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(recipes, ingredients, date):
+    """Построчно отдаёт список жанров в формате csv."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(('Жанр', 'Единица измерения', 'Количество'))
+    for name, unit, amount in ingredients:
+        yield writer.writerow((name, unit, amount))
+
+
+@lru_cache(maxsize=None)
+def get_pdf_font():
+    """
+    Регистрирует шрифт с кириллицей один раз на процесс.
+
+    :returns: Имя зарегистрированного шрифта или стандартного,
+    если файл шрифта не найден
+    """
+    for path in settings.PDF_FONT_PATHS:
+        if os.path.exists(path):
+            pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, str(path)))
+            return PDF_FONT_NAME
+    return PDF_FALLBACK_FONT
+
+
+def render_pdf(recipes, ingredients, date):
+    """Формирует pdf-отчет со списком покупок."""
+    font = get_pdf_font()
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    _, height = A4
+    position = height - PDF_MARGIN
+
+    pdf.setFont(font, PDF_FONT_SIZE)
+    for line in iter_txt(recipes, ingredients, date):
+        for text in line.rstrip('\n').split('\n'):
+            if position < PDF_MARGIN:
+                pdf.showPage()
+                pdf.setFont(font, PDF_FONT_SIZE)
+                position = height - PDF_MARGIN
+            pdf.drawString(PDF_MARGIN, position, text)
+            position -= PDF_LINE_HEIGHT
+    pdf.save()
+    buffer.seek(0)
+    return buffer
+
+
+def render(report_format, recipes, ingredients, date):
+    """
+    Формирует отчет целиком.
+
+    :param report_format: txt, csv или pdf
+    :returns: Содержимое файла
+    """
+    if report_format == 'pdf':
+        return render_pdf(recipes, ingredients, date).getvalue()
+    lines = iter_csv if report_format == 'csv' else iter_txt
+    return ''.join(lines(
+        recipes.iterator(), ingredients.iterator(), date
+    )).encode('utf-8')
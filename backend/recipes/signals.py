@@ -0,0 +1,167 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import (autocomplete, cart_totals, counters, feed, images, relations,
+               search, snapshots)
+from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                     ShoppingCart, Subscription, User)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_genre_index(sender, **kwargs):
+    """Сбрасывает индекс автодополнения при изменении жанра."""
+    transaction.on_commit(autocomplete.invalidate)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remember_genre_recipes(sender, instance, **kwargs):
+    """Запоминает альбомы удаляемого жанра до каскадного удаления."""
+    instance.recipe_ids = list(IngredientInRecipe.objects.filter(
+        ingredient=instance
+    ).values_list('recipe_id', flat=True))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def reindex_genre_recipes(sender, instance, created=False, **kwargs):
+    """Обновляет поисковые документы альбомов изменённого жанра."""
+    if hasattr(instance, 'recipe_ids'):
+        search.update_index(instance.recipe_ids)
+    elif not created:
+        search.update_index(IngredientInRecipe.objects.filter(
+            ingredient=instance
+        ).values('recipe_id'))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def drop_genre_snapshots(sender, instance, created=False, **kwargs):
+    """Сбрасывает представления альбомов изменённого жанра."""
+    if hasattr(instance, 'recipe_ids'):
+        snapshots.invalidate(instance.recipe_ids)
+    elif not created:
+        snapshots.invalidate_genre(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def drop_recipe_snapshot(sender, instance, **kwargs):
+    """Сбрасывает представление изменённого альбома."""
+    snapshots.invalidate((instance.pk,))
+
+
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+def drop_recipe_snapshot_on_genres(sender, instance, **kwargs):
+    """Сбрасывает представление альбома при изменении его жанров."""
+    snapshots.invalidate((instance.recipe_id,))
+
+
+@receiver(post_save, sender=User)
+def drop_author_snapshots(sender, instance, created=False, update_fields=None,
+                          **kwargs):
+    """Сбрасывает представления альбомов после изменения профиля автора."""
+    if created or (
+        update_fields and snapshots.AUTHOR_FIELDS.isdisjoint(update_fields)
+    ):
+        return
+    snapshots.invalidate_author(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, **kwargs):
+    """Обновляет поисковый документ сохранённого альбома."""
+    search.update_index((instance.pk,))
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, **kwargs):
+    """Удаляет поисковый документ удалённого альбома."""
+    search.remove_from_index(instance.pk)
+
+
+def _delta(signal, created):
+    """Приращение счётчика для сигнала или None, если менять нечего."""
+    if signal is post_delete:
+        return -1
+    return 1 if created else None
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscription)
+def write_through_relations(sender, instance, signal, created=False,
+                            **kwargs):
+    """Обновляет закэшированные связи пользователя."""
+    if signal is post_delete or created:
+        target_field = relations.SOURCES[sender][1]
+        relations.changed(
+            sender, instance.user_id, (getattr(instance, target_field),),
+            added=signal is not post_delete
+        )
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def count_favorites(sender, instance, signal, created=False, **kwargs):
+    """Поддерживает Recipe.favorites_count."""
+    delta = _delta(signal, created)
+    if delta:
+        counters.adjust(Recipe, instance.recipe_id, 'favorites_count', delta)
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def count_carts(sender, instance, signal, created=False, **kwargs):
+    """Поддерживает Recipe.in_carts_count."""
+    delta = _delta(signal, created)
+    if delta:
+        counters.adjust(Recipe, instance.recipe_id, 'in_carts_count', delta)
+
+
+@receiver((post_save, pre_delete), sender=ShoppingCart)
+def update_cart_totals(sender, instance, signal, created=False, **kwargs):
+    """Поддерживает итоги корзины покупок по жанрам."""
+    if signal is pre_delete:
+        cart_totals.cart_changed(instance.user_id, instance.recipe_id, -1)
+    elif created:
+        cart_totals.cart_changed(instance.user_id, instance.recipe_id, 1)
+
+
+@receiver((post_save, post_delete), sender=Subscription)
+def count_subscriptions(sender, instance, signal, created=False, **kwargs):
+    """Поддерживает User.followers_count и User.following_count."""
+    delta = _delta(signal, created)
+    if delta:
+        counters.adjust(User, instance.author_id, 'followers_count', delta)
+        counters.adjust(User, instance.user_id, 'following_count', delta)
+
+
+@receiver((post_save, post_delete), sender=Subscription)
+def reset_feed(sender, instance, **kwargs):
+    """Сбрасывает ленту пользователя после изменения подписок."""
+    transaction.on_commit(lambda: feed.invalidate(instance.user_id))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def count_recipes(sender, instance, signal, created=False, **kwargs):
+    """Поддерживает User.recipes_count."""
+    delta = _delta(signal, created)
+    if delta:
+        counters.adjust(User, instance.author_id, 'recipes_count', delta)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def fan_out_recipe(sender, instance, signal, created=False, **kwargs):
+    """Ставит обновление закэшированных лент подписчиков автора."""
+    if signal is post_delete:
+        transaction.on_commit(lambda: feed.removed(instance))
+    elif created:
+        transaction.on_commit(lambda: feed.published(instance))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def schedule_image_variants(sender, instance, **kwargs):
+    """Ставит в очередь генерацию производных нового изображения."""
+    field = 'image' if sender is Recipe else 'avatar'
+    variants_field = images.VARIANT_FIELDS[field]
+    if images.is_stale(instance, field):
+        images.schedule(instance, field)
+    elif not getattr(instance, field) and getattr(instance, variants_field):
+        sender.objects.filter(pk=instance.pk).update(**{variants_field: {}})
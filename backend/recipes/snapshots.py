@@ -0,0 +1,38 @@
+"""
+Сброс готовых JSON-представлений альбомов.
+
+Представления удаляются сразу и ещё раз после коммита изменения:
+повторное удаление убирает представление, которое параллельный запрос
+успел построить по старым данным. Заново они строятся при следующем
+чтении (см. api.snapshots).
+"""
+from django.db import transaction
+
+from .models import IngredientInRecipe, RecipeSnapshot
+
+AUTHOR_FIELDS = frozenset((
+    'username', 'email', 'first_name', 'last_name', 'avatar',
+    'avatar_variants',
+))
+
+
+def _delete(queryset):
+    queryset.delete()
+    transaction.on_commit(queryset.all().delete)
+
+
+def invalidate(recipe_ids):
+    """Сбрасывает представления альбомов."""
+    _delete(RecipeSnapshot.objects.filter(recipe_id__in=list(recipe_ids)))
+
+
+def invalidate_author(user_id):
+    """Сбрасывает представления альбомов автора."""
+    _delete(RecipeSnapshot.objects.filter(recipe__author_id=user_id))
+
+
+def invalidate_genre(ingredient_id):
+    """Сбрасывает представления альбомов с жанром."""
+    invalidate(IngredientInRecipe.objects.filter(
+        ingredient_id=ingredient_id
+    ).values_list('recipe_id', flat=True))
@@ -0,0 +1,65 @@
+"""
+Фоновые задачи, которые ставят эндпоинты и команды.
+
+Генерация производных изображений зарегистрирована в recipes.images,
+обновление лент подписчиков - в recipes.feed.
+"""
+from io import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from . import counters, jobs, shopping_list
+
+SHOPPING_CART_REPORT = 'shopping_cart_report'
+IMPORT_GENRES = 'import_genres'
+RECOUNT = 'recount'
+
+@jobs.task(SHOPPING_CART_REPORT, priority=5)
+def shopping_cart_report(job):
+    """
+    Список покупок пользователя в файл.
+
+    :param job: payload {'format': 'txt' | 'csv' | 'pdf'}
+    """
+    report_format = job.payload['format']
+    recipes, ingredients = shopping_list.cart_rows(job.user)
+    content = shopping_list.render(
+        report_format, recipes, ingredients,
+        timezone.localtime(job.created_at).strftime('%d.%m.%Y')
+    )
+    filename = f'shopping_cart.{report_format}'
+    job.result_file.save(
+        f'{job.pk}-{filename}', ContentFile(content), save=False
+    )
+    return {
+        'filename': filename,
+        'content_type': shopping_list.MEDIA_TYPES[report_format],
+        'size': len(content),
+    }
+
+
+@jobs.task(IMPORT_GENRES)
+def import_genres(job):
+    """
+    Импорт жанров из загруженного файла командой import_genres.
+
+    :param job: payload {'upload': имя файла в хранилище}
+    """
+    output = StringIO()
+    call_command(
+        'import_genres', default_storage.path(job.payload['upload']),
+        stdout=output
+    )
+    default_storage.delete(job.payload['upload'])
+    return {'output': output.getvalue().splitlines()}
+
+
+@jobs.task(RECOUNT, priority=-10, max_attempts=1)
+def recount(job):
+    """Пересчёт денормализованных счётчиков."""
+    with transaction.atomic():
+        return counters.recount()